@@ -1,20 +1,14 @@
 import os
 import logging
-import time
 import streamlit as st
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.docstore.document import Document
-import pdfplumber
-from PyPDF2 import PdfReader
-from PyPDF2.errors import PdfReadError
-from pdfminer.high_level import extract_text
-from pdfminer.pdfparser import PDFSyntaxError
-from docx import Document as DocxDocument
-import odf.opendocument as odf
-from odf.text import P
-from pptx import Presentation
+from utils.embeddings import get_embeddings
+from utils.embedding_engine import EmbeddingEngine, DEFAULT_BATCH_SIZE, DEFAULT_NUM_THREADS, DEFAULT_NUM_WORKERS
+from utils.faiss_store import load_index, save_index, invalidate_index
+from amm.ingestion import ingest_files, get_parsed_document, split_indexed_entries
+from utils.bm25_index import BM25Index, load_lexical_index
+from utils.ann_index import (
+    convert_index, write_index_meta, read_index_meta, update_index_meta, INDEX_AUTO, INDEX_TYPES, INDEX_TYPE_LABELS
+)
 
 def create_database():
     logging.basicConfig(
@@ -42,7 +36,8 @@ def create_database():
             st.write(f"#### Documento: {uploaded_file.name}")
 
             if f"title_{i}" not in updated_metadata:
-                initial_metadata = extract_metadata(uploaded_file)
+                # Analisi unica e memorizzata: i rerun non riaprono il file
+                initial_metadata = get_parsed_document(uploaded_file).metadata
                 updated_metadata[f"title_{i}"] = initial_metadata["title"]
                 updated_metadata[f"author_{i}"] = initial_metadata["author"]
 
@@ -80,30 +75,51 @@ def create_database():
         st.write("### Fase 2: Embedding e Creazione dell'Indice FAISS")
         st.info("Caricamento metadati...")
 
-        all_documents = []
-        for i, entry in enumerate(st.session_state.metadata_list):
-            file = entry["file"]
-            metadata = entry["metadata"]
-
-            documents, structured_content = load_file(file, metadata)
-            all_documents.extend(documents)
-
-            st.session_state.metadata_list[i]["structured_content"] = structured_content
-
         chunk_size = 1000
         chunk_overlap = 20
         min_chunk_length = 50
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L12-v2"
-        )
-        subfolder_name = st.text_input(
-            "Nome del database indicizzato:", "Inserisci il nome del database"
+        embeddings = get_embeddings()
+
+        existing_indexes = sorted(
+            name for name in os.listdir("app/db") if os.path.isdir(os.path.join("app/db", name))
+        ) if os.path.exists("app/db") else []
+        modalita = st.radio(
+            "Cosa vuoi fare con questi file?",
+            ["Crea un nuovo database", "Aggiungi i file a un database esistente"],
+            disabled=not existing_indexes,
         )
+        append_mode = modalita == "Aggiungi i file a un database esistente"
+
+        if append_mode:
+            # Solo i nuovi file vengono elaborati: i chunk già indicizzati non vengono toccati
+            subfolder_name = st.selectbox("Database indicizzato a cui aggiungere i file:", existing_indexes)
+            index_description = None
+            existing_titles = read_document_titles(os.path.join("app/db", subfolder_name))
+            # I documenti già presenti vengono esclusi: i loro chunk sarebbero duplicati in FAISS e BM25
+            entries = [
+                entry for entry in st.session_state.metadata_list if entry["metadata"]["title"] not in existing_titles
+            ]
+            duplicated = [
+                entry["metadata"]["title"] for entry in st.session_state.metadata_list
+                if entry["metadata"]["title"] in existing_titles
+            ]
+            if duplicated:
+                st.warning(
+                    f"Questi documenti sono già presenti nel database e non verranno aggiunti: {', '.join(duplicated)}"
+                )
+            if not entries:
+                st.error("Tutti i file selezionati sono già presenti nel database.")
+                return
+        else:
+            entries = st.session_state.metadata_list
+            subfolder_name = st.text_input(
+                "Nome del database indicizzato:", "Inserisci il nome del database"
+            )
 
-        index_description = st.text_area(
-            "Descrizione del database:",
-            "Inserisci una breve descrizione del database indicizzato",
-        )
+            index_description = st.text_area(
+                "Descrizione del database:",
+                "Inserisci una breve descrizione del database indicizzato",
+            )
 
         faiss_index_folder = os.path.join("app/db", subfolder_name)
 
@@ -111,180 +127,137 @@ def create_database():
             st.error("Inserisci un nome valido per il database indicizzato.")
             return
 
+        with st.expander("Impostazioni avanzate di embedding"):
+            embed_batch_size = st.number_input(
+                "Dimensione del batch di embedding", min_value=1, max_value=1024, value=DEFAULT_BATCH_SIZE
+            )
+            embed_threads = st.number_input(
+                "Thread di calcolo (torch)", min_value=1, max_value=256, value=DEFAULT_NUM_THREADS
+            )
+            embed_workers = st.number_input(
+                "Processi di embedding", min_value=1, max_value=64, value=DEFAULT_NUM_WORKERS,
+                help="Con più di un processo il modello viene caricato in ciascuno: conviene solo per lotti molto grandi.",
+            )
+            if append_mode:
+                # I nuovi vettori vengono aggiunti all'indice esistente, che mantiene il suo tipo
+                existing_type = read_index_meta(faiss_index_folder)["index_type"]
+                st.write(f"**Tipo di indice vettoriale:** {INDEX_TYPE_LABELS[existing_type]}")
+                index_type = None
+            else:
+                index_type = st.selectbox(
+                    "Tipo di indice vettoriale",
+                    (INDEX_AUTO,) + INDEX_TYPES,
+                    format_func=INDEX_TYPE_LABELS.get,
+                    help="Gli indici approssimati (IVF, HNSW, IVF-PQ) sono più veloci sui corpus grandi "
+                         "a scapito di una piccola perdita di recall: confrontali con il benchmark in Gestione Indici.",
+                )
+
         if st.button("Procedi con l'Embedding e la Creazione dell'Indice"):
+            progress_bar = st.progress(0.0)
             progress_text = st.empty()
-            progress_text.text("Divisione dei documenti in chunk...")
+            files_table = st.empty()
+            progress_text.text("Creazione dell'indice FAISS...")
 
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size, chunk_overlap=chunk_overlap
-            )
+            def mostra_avanzamento(progress):
+                progress_bar.progress(progress.fraction())
+                progress_text.text(progress.summary())
+                files_table.table(progress.files)
+
+            existing_index = None
+            lexical_index = BM25Index()
+            if append_mode:
+                try:
+                    existing_index = load_index(faiss_index_folder, embeddings)
+                    lexical_index = load_lexical_index(faiss_index_folder, existing_index)
+                except Exception as e:
+                    st.error(f"Errore durante il caricamento del db indicizzato: {e}")
+                    logging.error(f"Errore durante il caricamento dell'indice '{subfolder_name}': {e}")
+                    return
+                # description.txt può non elencare tutti i titoli: conta il contenuto dell'indice
+                entries, duplicated = split_indexed_entries(entries, existing_index)
+                if duplicated:
+                    st.warning(
+                        "Già presenti nell'indice e non aggiunti: "
+                        + ", ".join(entry["metadata"]["title"] for entry in duplicated)
+                    )
+                if not entries:
+                    st.error("Tutti i file selezionati sono già presenti nel database.")
+                    return
+
+            # Estrazione, divisione in chunk ed embedding procedono in streaming:
+            # i file vengono letti in un process pool e le pagine non restano in memoria
+            with EmbeddingEngine(
+                embeddings,
+                batch_size=int(embed_batch_size),
+                num_threads=int(embed_threads),
+                num_workers=int(embed_workers),
+            ) as engine:
+                index, first_chunks, progress = ingest_files(
+                    entries,
+                    embeddings,
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap,
+                    min_chunk_length=min_chunk_length,
+                    progress_callback=mostra_avanzamento,
+                    engine=engine,
+                    index=existing_index,
+                    lexical_index=lexical_index,
+                )
 
-            chunked_documents = []
-            for entry in st.session_state.metadata_list:
-                title = entry["metadata"]["title"]
-                author = entry["metadata"]["author"]
-                structured_content = entry["structured_content"]
-
-                updated_metadata = {
-                    "title": title,
-                    "author": author,
-                }
-                for page_number, page_content in enumerate(structured_content, start=1):
-                    chunks = text_splitter.split_text(page_content)
-                    for chunk in chunks:
-                        chunk_metadata = updated_metadata.copy()
-                        chunk_metadata["page_number"] = page_number
-
-                        chunked_documents.append(
-                            Document(page_content=chunk, metadata=chunk_metadata)
-                        )
-
-            splits = [sp for sp in chunked_documents if len(sp.page_content) >= min_chunk_length]
-
-            if not splits:
+            if index is None or progress.chunks == 0:
                 st.error("Nessun chunk valido è stato creato. Verifica i parametri di suddivisione.")
                 logging.error("Nessun chunk valido è stato creato. Verifica i parametri di suddivisione.")
                 return
 
             st.header("Primi 3 Chunk Estratti")
-            for i, chunk in enumerate(splits[:3]):
+            for i, chunk in enumerate(first_chunks):
                 st.subheader(f"Chunk {i + 1} - Metadati:")
                 st.json(chunk.metadata)
 
                 st.subheader(f"Contenuto del Chunk {i + 1}:")
                 st.write(chunk.page_content)
 
-            progress_text.text("Creazione dell'indice FAISS...")
-
-            for _ in range(5):
-                for dots in range(1, 6):
-                    progress_text.text(f"Sto elaborando il database{'.' * dots}")
-                    time.sleep(0.5)
-
-            docs = [
-                Document(page_content=split.page_content, metadata=split.metadata)
-                for split in splits
-            ]
-
-            if not docs:
-                st.error(
-                    "Nessun documento da indicizzare. Verifica che i documenti contengano testo valido."
-                )
-                logging.error(
-                    "Nessun documento da indicizzare. Verifica che i documenti contengano testo valido."
-                )
-                return
-
-            index = FAISS.from_documents(docs, embeddings)
-
             if not os.path.exists(faiss_index_folder):
                 os.makedirs(faiss_index_folder)
 
-            index.save_local(faiss_index_folder)
+            if append_mode:
+                save_index(index, faiss_index_folder)
+                update_index_meta(faiss_index_folder, index)
+            else:
+                # L'indice viene costruito flat durante l'ingestione e convertito alla fine
+                progress_text.text("Costruzione dell'indice vettoriale...")
+                index_meta = convert_index(index, index_type)
+                save_index(index, faiss_index_folder)
+                write_index_meta(faiss_index_folder, index_meta)
+            lexical_index.save(faiss_index_folder)
+            invalidate_index(faiss_index_folder)
 
             description_file_path = os.path.join(faiss_index_folder, "description.txt")
-            with open(description_file_path, "w") as desc_file:
-                desc_file.write(f"Descrizione dell'indice: {index_description}\n")
-                desc_file.write("Titoli dei documenti:\n")
-                for entry in st.session_state.metadata_list:
-                    desc_file.write(f"- {entry['metadata']['title']}\n")
-
-            progress_text.text(f"Indice '{subfolder_name}' creato con successo.")
-
-
-def extract_metadata(file):
-    metadata = {"title": "Sconosciuto", "author": "Sconosciuto"}
-    try:
-        if file.name.endswith(".pdf"):
-            reader = PdfReader(file)
-            doc_info = reader.metadata
-            metadata["title"] = doc_info.get("/Title", "Sconosciuto")
-            metadata["author"] = doc_info.get("/Author", "Sconosciuto")
-        elif file.name.endswith(".docx"):
-            doc = DocxDocument(file)
-            metadata["title"] = doc.core_properties.title or "Sconosciuto"
-            metadata["author"] = doc.core_properties.author or "Sconosciuto"
-        elif file.name.endswith(".odt"):
-            odt_file = odf.load(file)
-            metadata["title"] = odt_file.meta.get("title", "Sconosciuto")
-            metadata["author"] = odt_file.meta.get("creator", "Sconosciuto")
-        elif file.name.endswith(".pptx"):
-            ppt = Presentation(file)
-            metadata["title"] = ppt.core_properties.title or "Sconosciuto"
-            metadata["author"] = ppt.core_properties.author or "Sconosciuto"
-        elif file.name.endswith(".txt"):
-            metadata["title"] = file.name
-            metadata["author"] = "Sconosciuto"
-    except Exception as e:
-        logging.error(f"Errore nell'estrazione dei metadati dal file {file.name}: {e}")
-
-    return metadata
-
-
-def load_file(file, metadata):
-    try:
-        if file.name.endswith(".pdf"):
-            structured_content = extract_structured_content_pdf(file)
-        elif file.name.endswith(".docx"):
-            structured_content = extract_structured_content_docx(file)
-        elif file.name.endswith(".odt"):
-            structured_content = extract_structured_content_odt(file)
-        elif file.name.endswith(".pptx"):
-            structured_content = extract_structured_content_pptx(file)
-        elif file.name.endswith(".txt"):
-            structured_content = extract_structured_content_txt(file)
-        documents = create_documents_with_metadata(structured_content, metadata)
-        return documents, structured_content
-    except Exception as e:
-        logging.error(f"Errore nel caricamento del file {file.name}: {str(e)}")
-        return [], []
-
-
-def extract_structured_content_pdf(file):
-    structured_content = []
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-            structured_content.append(text)
-    return structured_content
-
-
-def extract_structured_content_docx(file):
-    doc = DocxDocument(file)
-    return [para.text for para in doc.paragraphs if para.text.strip()]
-
-
-def extract_structured_content_odt(file):
-    odt_file = odf.load(file)
-    text_content = []
-    for elem in odt_file.getElementsByType(P):
-        text_content.append(str(elem))
-    return text_content
-
-
-def extract_structured_content_pptx(file):
-    ppt = Presentation(file)
-    text_content = []
-    for slide in ppt.slides:
-        slide_text = []
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                slide_text.append(shape.text)
-        text_content.append("\n".join(slide_text))
-    return text_content
-
-
-def extract_structured_content_txt(file):
-    text = file.read().decode("utf-8")
-    return text.splitlines()
-
-
-def create_documents_with_metadata(chunks, metadata):
-    docs = []
-    for chunk in chunks:
-        doc = Document(page_content=chunk, metadata=metadata)
-        docs.append(doc)
-    return docs
+            if append_mode:
+                # Aggiunge in coda i titoli dei nuovi documenti
+                with open(description_file_path, "a", encoding="utf-8") as desc_file:
+                    for entry in entries:
+                        desc_file.write(f"- {entry['metadata']['title']}\n")
+                message = f"{progress.chunks} chunk aggiunti all'indice '{subfolder_name}'."
+            else:
+                with open(description_file_path, "w") as desc_file:
+                    desc_file.write(f"Descrizione dell'indice: {index_description}\n")
+                    desc_file.write("Titoli dei documenti:\n")
+                    for entry in st.session_state.metadata_list:
+                        desc_file.write(f"- {entry['metadata']['title']}\n")
+                message = f"Indice '{subfolder_name}' creato con successo."
+
+            progress_bar.progress(1.0)
+            progress_text.text(f"{message} {progress.summary()}")
+
+
+def read_document_titles(index_folder):
+    """Read the document titles listed in the description.txt of an index."""
+    description_file_path = os.path.join(index_folder, "description.txt")
+    if not os.path.exists(description_file_path):
+        return []
+    with open(description_file_path, "r", encoding="utf-8") as desc_file:
+        return [line.strip("- \n") for line in desc_file if line.startswith("-")]
 
 
 if __name__ == "__main__":
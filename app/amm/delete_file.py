@@ -3,8 +3,10 @@
 import os
 import logging
 import streamlit as st
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from utils.embeddings import get_embeddings
+from utils.faiss_store import load_index, save_index, invalidate_index, find_ids_by_title, delete_documents
+from utils.bm25_index import load_lexical_index
+from utils.ann_index import update_index_meta
 
 def delete_file_from_database():
     # Configurazione del logging
@@ -31,10 +33,10 @@ def delete_file_from_database():
     # Percorso del db indicizzato selezionato
     index_path = os.path.join(faiss_index_folder, selected_index)
 
-    # Carica l'indice FAISS
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L12-v2")
+    # Carica una copia privata dell'indice FAISS (quella in cache è in sola lettura)
+    embeddings = get_embeddings()
     try:
-        index = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        index = load_index(index_path, embeddings)
     except Exception as e:
         st.error(f"Errore durante il caricamento del db indicizzato: {str(e)}")
         return
@@ -64,22 +66,27 @@ def delete_file_from_database():
             st.error("Nessun PDF selezionato per la rimozione.")
             return
 
-        # Ricostruisci l'indice escludendo i documenti selezionati
-        remaining_documents = []
-        for doc in index.docstore._dict.values():
-            if doc.metadata.get("title") not in selected_pdfs:
-                remaining_documents.append(doc)
+        # Trova i chunk dei documenti selezionati: solo questi vengono rimossi,
+        # i vettori degli altri documenti restano invariati (nessun nuovo embedding)
+        ids_to_delete = find_ids_by_title(index, selected_pdfs)
 
         # Verifica se ci sono documenti rimanenti
-        if not remaining_documents:
+        if len(ids_to_delete) == len(index.index_to_docstore_id):
             st.warning("Nessun documento rimanente dopo la rimozione.")
             return
 
-        # Crea un nuovo indice con i documenti rimanenti
-        new_index = FAISS.from_documents(remaining_documents, embeddings)
+        # L'indice BM25 deve corrispondere ai chunk presenti prima della rimozione
+        lexical_index = load_lexical_index(index_path, index)
 
-        # Salva il nuovo indice
-        new_index.save_local(index_path)
+        removed = delete_documents(index, ids_to_delete)
+        lexical_index.remove(ids_to_delete)
+        logging.info(f"Rimossi {removed} chunk dall'indice '{selected_index}'")
+
+        # Salva l'indice aggiornato e scarta la copia in cache ormai superata
+        save_index(index, index_path)
+        update_index_meta(index_path, index)
+        lexical_index.save(index_path)
+        invalidate_index(index_path)
 
         # Aggiorna il file di descrizione
         with open(description_file_path, "w", encoding="utf-8") as desc_file:
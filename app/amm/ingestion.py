@@ -0,0 +1,399 @@
+# ingestion.py
+
+import os
+import logging
+import math
+import shutil
+import hashlib
+import tempfile
+import threading
+import time
+import uuid
+from io import BytesIO
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from utils.embedding_cache import cached_embed, model_key
+from utils.faiss_store import find_ids_by_title
+
+# Pagine PDF estratte da ogni task del process pool
+PDF_PAGES_PER_TASK = 16
+# Chunk accumulati prima di calcolarne gli embedding e aggiungerli all'indice
+EMBED_BATCH_SIZE = 256
+INGEST_WORKERS = int(os.getenv("EDURAG_INGEST_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def extract_structured_content_pdf(file, start=0, end=None):
+    import pdfplumber
+
+    structured_content = []
+    with pdfplumber.open(file) as pdf:
+        for page in pdf.pages[start:end]:
+            structured_content.append(page.extract_text() or "")
+            # Libera gli oggetti della pagina: i PDF lunghi non restano in memoria
+            page.close()
+    return structured_content
+
+
+def docx_pages(doc):
+    return [para.text for para in doc.paragraphs if para.text.strip()]
+
+
+def odt_pages(odt_file):
+    from odf.text import P
+
+    text_content = []
+    for elem in odt_file.getElementsByType(P):
+        text_content.append(str(elem))
+    return text_content
+
+
+def pptx_pages(ppt):
+    text_content = []
+    for slide in ppt.slides:
+        slide_text = []
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                slide_text.append(shape.text)
+        text_content.append("\n".join(slide_text))
+    return text_content
+
+
+def txt_pages(data):
+    text = data.decode("utf-8")
+    return text.splitlines()
+
+
+class ParsedDocument:
+    """An upload parsed once: metadata and page structure from a single open of the file.
+
+    For DOCX, ODT, PPTX and TXT the content is read in the same pass and kept in
+    pages. For PDFs the same pdfplumber open gives metadata and page count; the
+    page text is extracted later, in parallel, by the ingestion process pool.
+    """
+
+    def __init__(self, name, data):
+        self.name = name
+        self.content_hash = hashlib.sha256(data).hexdigest()
+        self.extension = os.path.splitext(name)[1].lower()
+        self.metadata = {"title": "Sconosciuto", "author": "Sconosciuto"}
+        self.num_pages = 0
+        self.pages = None
+        try:
+            self._parse(data)
+        except Exception as e:
+            logging.error(f"Errore nell'estrazione dei metadati dal file {name}: {e}")
+
+    def _parse(self, data):
+        if self.extension == ".pdf":
+            import pdfplumber
+
+            with pdfplumber.open(BytesIO(data)) as pdf:
+                doc_info = pdf.metadata or {}
+                self.metadata["title"] = doc_info.get("Title") or "Sconosciuto"
+                self.metadata["author"] = doc_info.get("Author") or "Sconosciuto"
+                self.num_pages = len(pdf.pages)
+        elif self.extension == ".docx":
+            from docx import Document as DocxDocument
+
+            doc = DocxDocument(BytesIO(data))
+            self.metadata["title"] = doc.core_properties.title or "Sconosciuto"
+            self.metadata["author"] = doc.core_properties.author or "Sconosciuto"
+            self.pages = docx_pages(doc)
+        elif self.extension == ".odt":
+            import odf.opendocument as odf
+
+            odt_file = odf.load(BytesIO(data))
+            self.metadata["title"] = odt_file.meta.get("title", "Sconosciuto")
+            self.metadata["author"] = odt_file.meta.get("creator", "Sconosciuto")
+            self.pages = odt_pages(odt_file)
+        elif self.extension == ".pptx":
+            from pptx import Presentation
+
+            ppt = Presentation(BytesIO(data))
+            self.metadata["title"] = ppt.core_properties.title or "Sconosciuto"
+            self.metadata["author"] = ppt.core_properties.author or "Sconosciuto"
+            self.pages = pptx_pages(ppt)
+        elif self.extension == ".txt":
+            self.metadata["title"] = self.name
+            self.pages = txt_pages(data)
+
+        if self.pages is not None:
+            self.num_pages = len(self.pages)
+
+
+# Documenti già analizzati, per hash del contenuto: i rerun di Streamlit non li rileggono
+_parsed_documents = OrderedDict()
+_parsed_lock = threading.Lock()
+MAX_PARSED_DOCUMENTS = 64
+
+
+def get_parsed_document(uploaded_file):
+    """Return the ParsedDocument of an upload, parsing it only the first time."""
+    data = uploaded_file.getvalue()
+    content_hash = hashlib.sha256(data).hexdigest()
+    with _parsed_lock:
+        parsed = _parsed_documents.get(content_hash)
+        if parsed is not None and parsed.name == uploaded_file.name:
+            _parsed_documents.move_to_end(content_hash)
+            return parsed
+
+    parsed = ParsedDocument(uploaded_file.name, data)
+    with _parsed_lock:
+        _parsed_documents[content_hash] = parsed
+        while len(_parsed_documents) > MAX_PARSED_DOCUMENTS:
+            _parsed_documents.popitem(last=False)
+    return parsed
+
+
+def extract_pdf_task(path, name, start, end):
+    """Extract a range of pages of a PDF (runs in a worker process)."""
+    try:
+        with open(path, "rb") as file:
+            return extract_structured_content_pdf(file, start, end)
+    except Exception as e:
+        logging.error(f"Errore nel caricamento del file {name}: {e}")
+        return []
+
+
+def plan_tasks(files):
+    """Split the files into extraction tasks: page ranges for PDFs, already parsed content for the rest."""
+    tasks = []
+    for file_index, entry in enumerate(files):
+        parsed = entry["parsed"]
+        if parsed.extension == ".pdf":
+            for start in range(0, parsed.num_pages, PDF_PAGES_PER_TASK):
+                tasks.append((file_index, entry["path"], parsed.name, start, min(start + PDF_PAGES_PER_TASK, parsed.num_pages)))
+        else:
+            tasks.append((file_index, None, parsed.name, 0, None))
+    return tasks
+
+
+class IngestionProgress:
+    """Real progress of an ingestion: per-file extraction, chunks and embedding batches."""
+
+    def __init__(self, files, tasks, batch_size):
+        self.start = time.perf_counter()
+        self.batch_size = batch_size
+        self.total_tasks = len(tasks)
+        self.tasks_done = 0
+        self.files = [
+            {"file": entry["name"], "pagine": 0, "chunk": 0, "task": 0,
+             "task totali": sum(1 for task in tasks if task[0] == file_index)}
+            for file_index, entry in enumerate(files)
+        ]
+        self.chunks = 0
+        self.chunks_embedded = 0
+        self.batches_done = 0
+        self.embed_seconds = 0.0
+
+    def task_done(self, file_index, num_pages):
+        self.tasks_done += 1
+        self.files[file_index]["task"] += 1
+        self.files[file_index]["pagine"] += num_pages
+
+    def chunk_added(self, file_index):
+        self.chunks += 1
+        self.files[file_index]["chunk"] += 1
+
+    def batch_embedded(self, num_chunks, seconds):
+        self.batches_done += 1
+        self.chunks_embedded += num_chunks
+        self.embed_seconds += seconds
+
+    def estimated_total_chunks(self):
+        """Extrapolate the total number of chunks from the tasks extracted so far."""
+        if self.tasks_done >= self.total_tasks or self.tasks_done == 0:
+            return self.chunks
+        return max(self.chunks, round(self.chunks * self.total_tasks / self.tasks_done))
+
+    def estimated_total_batches(self):
+        return max(self.batches_done, math.ceil(self.estimated_total_chunks() / self.batch_size))
+
+    def throughput(self):
+        """Embedding throughput in chunks per second."""
+        return self.chunks_embedded / self.embed_seconds if self.embed_seconds else 0.0
+
+    def eta_seconds(self):
+        elapsed = time.perf_counter() - self.start
+        if not self.chunks_embedded:
+            return None
+        remaining = self.estimated_total_chunks() - self.chunks_embedded
+        return max(remaining, 0) * elapsed / self.chunks_embedded
+
+    def fraction(self):
+        # Metà avanzamento per l'estrazione, metà per gli embedding
+        extraction = self.tasks_done / self.total_tasks if self.total_tasks else 1.0
+        total_chunks = self.estimated_total_chunks()
+        embedding = self.chunks_embedded / total_chunks if total_chunks else 0.0
+        return min((extraction + embedding) / 2, 1.0)
+
+    def summary(self):
+        eta = self.eta_seconds()
+        return (
+            f"Estrazione: {self.tasks_done}/{self.total_tasks} task - "
+            f"chunk: {self.chunks} - "
+            f"batch di embedding: {self.batches_done}/{self.estimated_total_batches()} - "
+            f"{self.throughput():.1f} chunk/s - "
+            f"tempo rimanente stimato: {'n.d.' if eta is None else f'{eta:.0f} s'}"
+        )
+
+
+def iter_pages(files, tasks, max_workers=INGEST_WORKERS, progress=None):
+    """Yield (file_index, page_number, text) in document order, extracting in a process pool.
+
+    At most 2 * max_workers tasks are in flight, so only a bounded window of
+    pages lives in memory regardless of the size of the batch.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        next_task = 0
+        while pending or next_task < len(tasks):
+            while next_task < len(tasks) and len(pending) < 2 * max_workers:
+                file_index, path, name, start, end = tasks[next_task]
+                if path is None:
+                    # Contenuto già letto insieme ai metadati: nessun task nel pool
+                    pending.append((file_index, start, None))
+                else:
+                    pending.append((file_index, start, pool.submit(extract_pdf_task, path, name, start, end)))
+                next_task += 1
+
+            file_index, start, future = pending.popleft()
+            pages = (files[file_index]["parsed"].pages or []) if future is None else future.result()
+            if progress is not None:
+                progress.task_done(file_index, len(pages))
+            for offset, text in enumerate(pages):
+                yield file_index, start + offset + 1, text
+
+
+def save_uploaded_pdfs(uploaded_files, folder):
+    """Write the uploaded PDFs to a folder so worker processes can open them."""
+    paths = []
+    for i, uploaded_file in enumerate(uploaded_files):
+        if not uploaded_file.name.lower().endswith(".pdf"):
+            paths.append(None)
+            continue
+        path = os.path.join(folder, f"{i}_{os.path.basename(uploaded_file.name)}")
+        with open(path, "wb") as out:
+            out.write(uploaded_file.getvalue())
+        paths.append(path)
+    return paths
+
+
+def ingest_files(entries, embeddings, chunk_size=1000, chunk_overlap=20, min_chunk_length=50,
+                 batch_size=EMBED_BATCH_SIZE, max_workers=INGEST_WORKERS, progress_callback=None,
+                 engine=None, index=None, lexical_index=None):
+    """Build a FAISS index streaming pages -> chunks -> embeddings.
+
+    If index is given, the new chunks are appended to it: only the new files
+    are embedded and the existing vectors and docstore entries are left as they are.
+
+    entries is a list of {"file": uploaded file, "metadata": {"title", "author"}}.
+    progress_callback, if given, receives the IngestionProgress after every
+    extracted task and every embedded batch. engine, if given, is an open
+    EmbeddingEngine used instead of embeddings.embed_documents(). lexical_index,
+    if given, is a BM25Index that receives the same chunks with the same docstore ids.
+    Returns the index (None if no valid chunk was found), the first chunks
+    and the final IngestionProgress. Entries whose title is already in index
+    are skipped, so appending a document twice does not duplicate its chunks.
+    """
+    if index is not None:
+        entries, duplicated = split_indexed_entries(entries, index)
+        for entry in duplicated:
+            logging.warning(f"'{entry['metadata']['title']}' è già presente nell'indice: file ignorato")
+        if not entries:
+            return index, [], IngestionProgress([], [], batch_size)
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from langchain_community.docstore.document import Document
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+    temp_dir = tempfile.mkdtemp(prefix="edurag_ingest_")
+    try:
+        paths = save_uploaded_pdfs([entry["file"] for entry in entries], temp_dir)
+        files = [
+            {"path": path, "name": entry["file"].name, "metadata": entry["metadata"],
+             "parsed": get_parsed_document(entry["file"])}
+            for path, entry in zip(paths, entries)
+        ]
+
+        if engine is not None:
+            # Batch abbastanza grandi da tenere occupati tutti i processi di encoding
+            batch_size = max(batch_size, engine.batch_size * engine.num_workers * 4)
+
+        tasks = plan_tasks(files)
+        progress = IngestionProgress(files, tasks, batch_size)
+
+        def report():
+            if progress_callback is not None:
+                progress_callback(progress)
+
+        batch = []
+        first_chunks = []
+        tasks_reported = 0
+        for file_index, page_number, page_content in iter_pages(files, tasks, max_workers, progress):
+            if progress.tasks_done != tasks_reported:
+                tasks_reported = progress.tasks_done
+                report()
+
+            metadata = files[file_index]["metadata"]
+            for chunk in text_splitter.split_text(page_content):
+                if len(chunk) < min_chunk_length:
+                    continue
+                doc = Document(
+                    page_content=chunk,
+                    metadata={"title": metadata["title"], "author": metadata["author"], "page_number": page_number},
+                )
+                if len(first_chunks) < 3:
+                    first_chunks.append(doc)
+                batch.append(doc)
+                progress.chunk_added(file_index)
+
+            if len(batch) >= batch_size:
+                index = add_batch(index, batch, embeddings, progress, engine, lexical_index)
+                batch = []
+                report()
+
+        if batch:
+            index = add_batch(index, batch, embeddings, progress, engine, lexical_index)
+        report()
+
+        return index, first_chunks, progress
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def split_indexed_entries(entries, index):
+    """Split entries into (new, already indexed) by the titles of the chunks in index."""
+    new_entries, duplicated = [], []
+    for entry in entries:
+        if find_ids_by_title(index, [entry["metadata"]["title"]]):
+            duplicated.append(entry)
+        else:
+            new_entries.append(entry)
+    return new_entries, duplicated
+
+
+def add_batch(index, documents, embeddings, progress=None, engine=None, lexical_index=None):
+    """Embed a batch of chunks and add it to the index (creating it if needed)."""
+    from langchain_community.vectorstores import FAISS
+
+    texts = [doc.page_content for doc in documents]
+    metadatas = [doc.metadata for doc in documents]
+    # Id espliciti: gli stessi chunk hanno lo stesso id nel docstore e nell'indice BM25
+    ids = [str(uuid.uuid4()) for _ in documents]
+    if lexical_index is not None:
+        lexical_index.add_documents(zip(ids, texts))
+    start = time.perf_counter()
+    if engine is not None:
+        vectors = engine.encode(texts)
+    else:
+        vectors = cached_embed(texts, model_key(embeddings), embeddings.embed_documents)
+    if progress is not None:
+        progress.batch_embedded(len(texts), time.perf_counter() - start)
+    if index is None:
+        return FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas, ids=ids)
+    index.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+    return index
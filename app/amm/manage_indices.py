@@ -5,6 +5,11 @@ import shutil
 import logging
 import streamlit as st
 from utils.utils import read_descriptions_and_documents
+from utils.embeddings import get_embeddings
+from utils.faiss_store import invalidate_index, load_index, save_index, is_legacy_index, migrate_legacy_index
+from utils.ann_index import (
+    benchmark_index_types, convert_index, read_index_meta, write_index_meta, INDEX_TYPES, INDEX_TYPE_LABELS
+)
 
 # Configurazione del logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -48,6 +53,61 @@ def view_and_manage_db():
         for doc in selected_info['documenti']:
             st.write(f"- {doc}")
 
+    # Tipo di indice vettoriale: confronto recall/latenza e conversione
+    st.write("---------")
+    st.write("#### Tipo di indice vettoriale")
+    index_path = os.path.join(faiss_index_folder, selected_index)
+    if is_legacy_index(index_path):
+        st.warning(
+            "Questo indice usa ancora il formato index.pkl: a ogni caricamento tutti i chunk vengono letti in memoria."
+        )
+        if st.button("Converti al formato chunks.sqlite"):
+            with st.spinner("Conversione del formato dell'indice..."):
+                try:
+                    if migrate_legacy_index(index_path, get_embeddings()):
+                        st.success(f"Indice '{selected_index}' convertito al formato chunks.sqlite.")
+                    else:
+                        st.info("L'indice era già stato convertito.")
+                except Exception as e:
+                    st.error(f"Errore durante la conversione del formato: {e}")
+                    logging.error(f"Errore durante la conversione del formato dell'indice '{selected_index}': {e}")
+    index_meta = read_index_meta(index_path)
+    st.write(f"**Tipo attuale:** {INDEX_TYPE_LABELS[index_meta['index_type']]}")
+    if index_meta.get("params"):
+        st.json(index_meta["params"])
+
+    with st.expander("Benchmark recall/latenza"):
+        benchmark_types = st.multiselect(
+            "Tipi da confrontare:", INDEX_TYPES, default=list(INDEX_TYPES), format_func=INDEX_TYPE_LABELS.get
+        )
+        num_queries = st.number_input("Numero di query di prova", min_value=10, max_value=1000, value=100)
+        benchmark_k = st.number_input("k (risultati per query)", min_value=1, max_value=100, value=10)
+        if st.button("Esegui benchmark"):
+            with st.spinner("Costruzione degli indici di prova..."):
+                try:
+                    index = load_index(index_path, get_embeddings())
+                    results = benchmark_index_types(index, benchmark_types, int(num_queries), int(benchmark_k))
+                    st.table(results)
+                    st.caption("La recall è misurata rispetto alla ricerca esatta (flat) sugli stessi vettori.")
+                except Exception as e:
+                    st.error(f"Errore durante il benchmark: {e}")
+                    logging.error(f"Errore durante il benchmark dell'indice '{selected_index}': {e}")
+
+        new_type = st.selectbox("Converti l'indice in:", INDEX_TYPES, format_func=INDEX_TYPE_LABELS.get)
+        if st.button("Converti indice"):
+            with st.spinner("Conversione dell'indice..."):
+                try:
+                    index = load_index(index_path, get_embeddings())
+                    new_meta = convert_index(index, new_type)
+                    save_index(index, index_path)
+                    write_index_meta(index_path, new_meta)
+                    invalidate_index(index_path)
+                    st.success(f"Indice '{selected_index}' convertito in {INDEX_TYPE_LABELS[new_meta['index_type']]}.")
+                    logging.info(f"Indice '{selected_index}' convertito in '{new_meta['index_type']}'")
+                except Exception as e:
+                    st.error(f"Errore durante la conversione: {e}")
+                    logging.error(f"Errore durante la conversione dell'indice '{selected_index}': {e}")
+
     # Funzione per rinominare l'indice selezionato
     st.write("---------")
     st.write("#### Rinomina db indicizzato")
@@ -64,6 +124,7 @@ def view_and_manage_db():
                     new_path = os.path.join(faiss_index_folder, new_index_name)
                     logging.info(f"Tentativo di rinominare la directory da {old_path} a {new_path}")
                     os.rename(old_path, new_path)
+                    invalidate_index(old_path)
                     st.success(f"db indicizzato '{selected_index}' rinominato in '{new_index_name}'.")
                     logging.info(f"db indicizzato '{selected_index}' rinominato in '{new_index_name}' con successo.")
                     # Trigger page refresh
@@ -90,6 +151,7 @@ def view_and_manage_db():
                 try:
                     logging.info(f"Sto per cancellare la directory: {index_path}")
                     shutil.rmtree(index_path)
+                    invalidate_index(index_path)
                     logging.info(f"shutil.rmtree eseguito per: {index_path}")
                     if not os.path.exists(index_path):  # Verifica che la directory sia stata effettivamente rimossa
                         st.success(f"db indicizzato '{selected_index}' cancellato con successo.")
@@ -0,0 +1,100 @@
+# prestazioni.py
+
+import streamlit as st
+from utils.metrics import rss_bytes, format_bytes
+from utils.embeddings import get_embeddings_stats
+from utils.faiss_store import get_index_cache_stats
+from utils.embedding_engine import get_embedding_runs
+from utils.embedding_cache import get_embedding_cache_stats
+from utils.page_registry import get_import_report
+from utils.llm_cache import get_llm_cache_stats
+from utils.answer_cache import get_answer_cache_stats
+from utils.query_coalescing import get_coalescing_stats
+
+
+def mostra_prestazioni():
+    """Mostra le metriche di prestazione condivise dal processo."""
+    st.write("### Prestazioni")
+    st.write(f"**Memoria residente del processo:** {format_bytes(rss_bytes())}")
+
+    st.write("#### Modelli di embedding")
+    embeddings_stats = get_embeddings_stats()
+    if embeddings_stats:
+        st.table(embeddings_stats)
+    else:
+        st.write("Nessun modello di embedding caricato in questo processo.")
+
+    st.write("#### Cache degli indici FAISS")
+    totals, cached_indices = get_index_cache_stats()
+    st.write(
+        f"**Occupazione:** {format_bytes(totals['bytes'])} su {format_bytes(totals['max_bytes'])} - "
+        f"**hit:** {totals['hits']} - **miss:** {totals['misses']} - "
+        f"**invalidazioni:** {totals['invalidations']} - **evizioni:** {totals['evictions']}"
+    )
+    st.write(
+        f"**File mappati in memoria:** {format_bytes(totals['mapped_bytes'])} - "
+        f"**di cui residenti:** {format_bytes(totals['mapped_resident_bytes'])}"
+    )
+    if cached_indices:
+        st.table(cached_indices)
+        st.caption(
+            "Le pagine mappate di index.faiss e chunks.sqlite sono nella page cache e condivise tra i processi: "
+            "la parte residente conta una sola volta anche con più worker. Con faiss-cpu 1.8 solo gli indici IVF "
+            "sono mappati: gli indici flat e HNSW vengono letti in memoria da ogni processo."
+        )
+    else:
+        st.write("Nessun indice in cache.")
+
+    st.write("#### Ultime creazioni di indici (throughput di embedding)")
+    embedding_runs = get_embedding_runs()
+    if embedding_runs:
+        st.table(embedding_runs)
+    else:
+        st.write("Nessun embedding calcolato in questo processo.")
+
+    st.write("#### Cache degli embedding su disco")
+    cache_stats = get_embedding_cache_stats()
+    st.write(
+        f"**Voci:** {cache_stats['entries']} - "
+        f"**occupazione:** {format_bytes(cache_stats['bytes'])} su {format_bytes(cache_stats['max_bytes'])} - "
+        f"**hit rate:** {cache_stats['hit_rate']:.0%} ({cache_stats['hits']} hit, {cache_stats['misses']} miss) - "
+        f"**evizioni:** {cache_stats['evictions']}"
+    )
+
+    st.write("#### Cache semantica delle risposte")
+    answer_totals, answer_indices = get_answer_cache_stats()
+    st.write(
+        f"**hit rate:** {answer_totals['hit_rate']:.0%} ({answer_totals['hits']} hit, {answer_totals['misses']} miss) - "
+        f"**invalidazioni:** {answer_totals['invalidations']} - **evizioni:** {answer_totals['evictions']}"
+    )
+    if answer_indices:
+        st.table(answer_indices)
+
+    st.write("#### Domande identiche condivise")
+    coalescing = get_coalescing_stats()
+    st.write(
+        f"**Query avviate:** {coalescing['started']} - "
+        f"**richieste accodate a una query identica in corso:** {coalescing['coalesced']} - "
+        f"**in corso ora:** {coalescing['in_flight']}"
+    )
+
+    st.write("#### Cache delle risposte LLM (tool di riassunto)")
+    llm_stats = get_llm_cache_stats()
+    st.write(
+        f"**Voci:** {llm_stats['entries']} - "
+        f"**occupazione:** {format_bytes(llm_stats['bytes'])} su {format_bytes(llm_stats['max_bytes'])} - "
+        f"**hit rate:** {llm_stats['hit_rate']:.0%} ({llm_stats['hits']} hit, {llm_stats['misses']} miss) - "
+        f"**scadute:** {llm_stats['expired']} (dopo {llm_stats['ttl_days']:g} giorni) - "
+        f"**evizioni:** {llm_stats['evictions']}"
+    )
+
+    st.write("#### Import delle pagine (avvio a freddo)")
+    import_report = get_import_report()
+    if import_report:
+        st.table(import_report)
+        st.caption(
+            "Tempo e memoria del primo import di ogni pagina: le dipendenze condivise "
+            "sono attribuite alla prima pagina che le importa."
+        )
+    else:
+        st.write("Nessuna pagina importata in questo processo.")
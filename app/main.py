@@ -1,19 +1,8 @@
 # main.py
 import streamlit as st
 from description import get_description
-from amm.manage_indices import view_and_manage_db
-from amm.crea_database import create_database
-from amm.delete_file import delete_file_from_database
-from query_database.query_gpt import query_db_gpt4
-from query_database.query_claude import query_db_claude
-from tool.pdf_summary import pdf_summary
-from tool.pdf_summary_a import pdf_summary_a
-#from tool.savickas_interview import savickas_interview
-from tool.open_question import open_question
-from utilizzo.uso import get_uso
-from utilizzo.consigli import get_consigli
 from mostra_indici import mostra_indici_disponibili
-from tool.voce import voce
+from utils.page_registry import run_page, PAGES
 
 
 
@@ -38,7 +27,7 @@ def display_sub_menu(selected_page):
 
     # Define the sub-menu options for each main menu page
     if selected_page == "Amministrazione":
-        sub_page_options = ["Gestione Indici", "Crea Database", "Elimina File"]
+        sub_page_options = ["Gestione Indici", "Crea Database", "Elimina File", "Prestazioni"]
         sub_page = st.sidebar.selectbox("Seleziona una funzione:", sub_page_options)
         
         mostra_indici_disponibili()
@@ -63,62 +52,26 @@ def mostra_home():
     st.title("EduRag")
     st.write(get_description())
     
+def mostra_sottopagina(title, selected_page):
+    """Show the title and the sub-menu of a main page, then run the selected subpage."""
+    st.title(title)
+    selected_subpage = display_sub_menu(selected_page)
+
+    # Le sottopagine senza voce in PAGES (es. Intervista Savickas, disattivata) non mostrano nulla
+    if selected_subpage in PAGES:
+        run_page(selected_subpage)
+
 def mostra_come_si_usa():
-    st.title("Come si usa")
-   
-    # Mostra il sottomenu per "Come si usa"
-    selected_subpage = display_sub_menu("Come si usa")
-
-    # Mostra solo la funzione corretta per la sottopagina selezionata
-    if selected_subpage == "Primo utilizzo":
-        get_uso()
-    elif selected_subpage == "Consigli":
-        get_consigli()
-        
+    mostra_sottopagina("Come si usa", "Come si usa")
+
 def mostra_amministrazione():
-    st.title("Amministrazione")
-   
-    # Mostra il sottomenu per le operazioni amministrative
-    selected_subpage = display_sub_menu("Amministrazione")
-
-    # Mostra solo la funzione corretta per la sottopagina selezionata
-    if selected_subpage == "Gestione Indici":
-        view_and_manage_db()
-    elif selected_subpage == "Crea Database":
-        create_database()
-    elif selected_subpage == "Elimina File":
-        delete_file_from_database()
+    mostra_sottopagina("Amministrazione", "Amministrazione")
 
 def mostra_interrogazione_db():
-    st.title("Interroga il db indicizzato")
-
-    # Mostra il sottomenu per le operazioni di interrogazione db
-    selected_subpage = display_sub_menu("Interrogazione db indicizzato")
-
-    # Mostra solo la funzione corretta per la sottopagina selezionata
-    if selected_subpage == "Openai":
-        query_db_gpt4()
-    elif selected_subpage == "Anthropic":
-        query_db_claude()
+    mostra_sottopagina("Interroga il db indicizzato", "Interrogazione db indicizzato")
 
 def mostra_tool():
-    st.title("Tool")
-    #st.write("Funzioni di supporto.")
-
-    # Mostra il sottomenu per le operazioni di Tool
-    selected_subpage = display_sub_menu("Tool")
-
-    # Mostra solo la funzione corretta per la sottopagina selezionata
-    if selected_subpage == "Riassunto PDF":
-        pdf_summary()
-    elif selected_subpage == "Riassunto PDF articoli scientifici":
-        pdf_summary_a()
-  #  elif selected_subpage == "Intervista Savickas":
-   #     savickas_interview()
-    elif selected_subpage == "Domande aperte":
-        open_question()
-    elif selected_subpage == "TTS Edge":
-        voce()
+    mostra_sottopagina("Tool", "Tool")
 
 
 # Main application
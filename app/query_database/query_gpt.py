@@ -1,43 +1,17 @@
 import os
-import re
 import streamlit as st
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from utils.embeddings import get_embeddings
 from langchain_core.runnables import RunnablePassthrough
 from sidebar.sidebar_config import sidebar_c  # Import the sidebar configuration function
 from prompt.prompt_config import get_chat_prompt_template  # Import the prompt module
 from utils.openai_m import openai_m
 from utils.def_comuny import *
 
-import tempfile
-import edge_tts
-import asyncio
-import os
-
-# Function to clean the text from markdown markers
-def clean_text(text):
-    # Remove bold markers **text**
-    clean_text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    # Remove italic markers *text* or _text_
-    clean_text = re.sub(r'\*(.*?)\*', r'\1', clean_text)
-    clean_text = re.sub(r'\_(.*?)\_', r'\1', clean_text)
-    # Remove other potential markdown markers if necessary
-    return clean_text
-
-# Asynchronous function to convert text to speech
-async def text_to_speech_edge_async(text, voice="it-IT-IsabellaNeural"):
-    communicate = edge_tts.Communicate(text, voice)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-        tmp_path = tmp_file.name
-        await communicate.save(tmp_path)
-    return tmp_path
-
-# Function to run the asynchronous TTS function
-def text_to_speech_edge(text, voice="it-IT-IsabellaNeural"):
-    return asyncio.run(text_to_speech_edge_async(text, voice))
+from utils.tts import start_audio_job
 
 # Main function for querying the database with GPT-4
 def query_db_gpt4():
@@ -51,7 +25,7 @@ def query_db_gpt4():
 
     # Sidebar configuration
     db_path = "app/db"
-    temperature, similarity_k, Indice = sidebar_c(db_path, list_subfolders)
+    temperature, similarity_k, Indice, cache_threshold, retrieval_mode, indici = sidebar_c(db_path, list_subfolders)
 
     if Indice is None:
         return  # Early return if there was an error with the subfolders
@@ -61,6 +35,8 @@ def query_db_gpt4():
         "Inserisci la tua domanda", st.session_state.user_query
     )
 
+    genera_audio = st.checkbox("Genera l'audio della risposta", value=True)
+
     if st.button("Invia"):
         if not openai_api_key.startswith("sk-"):
             st.warning("Per favore, inserisci una chiave API OpenAI valida!", icon="⚠")
@@ -68,34 +44,44 @@ def query_db_gpt4():
 
         # Configuration settings
         model = ChatOpenAI(temperature=temperature, model_name=st.session_state.model_choice, api_key=openai_api_key)
-        embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L12-v2')
+        embeddings = get_embeddings()
 
         # Load or create the FAISS index with the specified folder
-        faiss_index = get_faiss_index(os.path.join(db_path, Indice), embeddings)
-
-        if faiss_index is None:
-            st.error("Impossibile caricare o creare l'indice FAISS.")
-            return
+        faiss_index = None
+        if len(indici) == 1:
+            faiss_index = get_faiss_index(os.path.join(db_path, indici[0]), embeddings)
 
-        retriever = faiss_index.as_retriever(
-            search_type="mmr", search_kwargs={"k": similarity_k}
-        )
+            if faiss_index is None:
+                st.error("Impossibile caricare o creare l'indice FAISS.")
+                return
 
         # Prompt configuration
         prompt = get_chat_prompt_template()  # Use the external prompt
 
-        rag_chain = build_rag_chain(prompt, model, retriever)
-
         # Execute the query and display the response
         try:
-            st.session_state.last_response = query_stream(
-                st.session_state.user_query, rag_chain
-            )
+            # Retrieve once: the same documents feed the prompt and the sources
+            timings = {}
+            answer_placeholder = st.empty()  # Tokens are shown here while they arrive
+            if faiss_index is not None:
+                st.session_state.last_response, documents = answer_query(
+                    st.session_state.user_query, faiss_index, prompt, model, similarity_k, timings,
+                    placeholder=answer_placeholder,
+                    index_folder=os.path.join(db_path, indici[0]), cache_threshold=cache_threshold,
+                    retrieval_mode=retrieval_mode,
+                )
+            else:
+                # Several indices searched in parallel, one combined context for the model
+                st.session_state.last_response, documents = answer_federated_query(
+                    st.session_state.user_query, [os.path.join(db_path, name) for name in indici], embeddings,
+                    prompt, model, similarity_k, timings,
+                    placeholder=answer_placeholder, retrieval_mode=retrieval_mode,
+                )
+            st.session_state.last_timings = timings
+            answer_placeholder.empty()  # The full answer is shown below with its sources
 
             # Format retrieved documents to add them to the conversation
-            st.session_state.formatted_context = format_documents(
-                retriever.get_relevant_documents(st.session_state.user_query)
-            )
+            st.session_state.formatted_context = format_documents(documents)
 
             # Add the question, answer, and additional information to the list of interactions
             add_interaction(
@@ -110,22 +96,11 @@ def query_db_gpt4():
             # Reset the query after obtaining the response
             st.session_state.user_query = ""
 
-            # Clean the response text and generate the audio
-            cleaned_response = clean_text(st.session_state.last_response)
-            try:
-                audio_path = text_to_speech_edge(cleaned_response)
-                with open(audio_path, "rb") as audio_file:
-                    audio_bytes = audio_file.read()
-                    st.session_state.audio_bytes = audio_bytes  # Save the audio to session state
-                    st.audio(audio_bytes, format="audio/mp3")
-                    st.download_button(
-                        label="Scarica l'audio",
-                        data=audio_bytes,
-                        file_name=os.path.basename(audio_path),
-                        mime="audio/mp3"
-                    )
-            except Exception as e:
-                st.error(f"Si è verificato un errore durante la generazione dell'audio: {e}")
+            # The audio is synthesized in background, after the text answer is shown
+            if genera_audio:
+                st.session_state.audio_job = start_audio_job(st.session_state.last_response)
+            else:
+                st.session_state.audio_job = None
 
         except Exception as e:
             st.error(f"Si è verificato un errore durante l'esecuzione della query: {e}")
@@ -137,15 +112,8 @@ def query_db_gpt4():
             temperature, similarity_k, Indice, st.session_state.formatted_context
         )
 
-        # Display the audio if it exists in the session state
-        if 'audio_bytes' in st.session_state:
-            st.audio(st.session_state.audio_bytes, format="audio/mp3")
-            st.download_button(
-                label="Scarica l'audio",
-                data=st.session_state.audio_bytes,
-                file_name="audio.mp3",
-                mime="audio/mp3"
-            )
+        # Display the audio once the background job has produced it
+        display_answer_audio()
 
     # Toggle to show/hide conversation history
     mostra_storico = st.checkbox("Mostra storico delle conversazioni", value=False)
@@ -159,7 +127,8 @@ def query_db_gpt4():
         st.session_state.user_query = ""
         st.session_state.last_response = ""
         st.session_state.formatted_context = ""
-        st.session_state.audio_bytes = None  # Reset the audio
+        st.session_state.last_timings = ""
+        st.session_state.audio_job = None  # Reset the audio
 
     # Button to download the conversation
     if st.button("Scarica conversazione"):
@@ -170,6 +139,5 @@ def query_db_gpt4():
             mime="text/plain",
         )
 
-comuni()
 if __name__ == "__main__":
     query_db_gpt4()
@@ -1,8 +1,14 @@
 #sidebar_config.py
 import streamlit as st
+from utils.answer_cache import DEFAULT_SIMILARITY_THRESHOLD
+from utils.retrieval import RETRIEVAL_MMR, RETRIEVAL_HYBRID
 
 def sidebar_c(db_path, list_subfolders):
-    """Configure the sidebar elements."""
+    """Configure the sidebar elements.
+
+    Returns temperature, similarity_k, Indice (the selected index names, joined for display),
+    cache_threshold, retrieval_mode and indici (the list of selected index names).
+    """
     
     # Add a small decorative bar in the sidebar
     st.sidebar.markdown("---")
@@ -25,6 +31,32 @@ def sidebar_c(db_path, list_subfolders):
         help="Nel contesto del Retrieval-Augmented Generation (RAG), i chunk sono segmenti di testo suddivisi da documenti più grandi. Questa suddivisione ottimizza l'elaborazione del modello, mantiene il contesto semantico e migliora la precisione del recupero delle informazioni rilevanti per una query specifica.",
     )
 
+    # Retrieval mode: vector search only, or fused with the BM25 lexical index
+    retrieval_options = {
+        "Semantica (MMR)": RETRIEVAL_MMR,
+        "Ibrida (parole chiave + semantica)": RETRIEVAL_HYBRID,
+    }
+    retrieval_choice = st.sidebar.selectbox(
+        "Modalità di ricerca",
+        list(retrieval_options.keys()),
+        help="La ricerca ibrida unisce ai risultati semantici quelli per parole chiave (BM25): trova meglio nomi di autori, acronimi e riferimenti normativi, e serve un numero minore di chunk.",
+    )
+    retrieval_mode = retrieval_options[retrieval_choice]
+
+    # Similarity threshold of the semantic answer cache
+    cache_threshold = st.sidebar.slider(
+        "Soglia cache semantica",
+        0.80,
+        1.00,
+        DEFAULT_SIMILARITY_THRESHOLD,
+        step=0.01,
+        help="Se una domanda già posta sullo stesso indice, con lo stesso modello, temperatura, chunk e chiave API, ha una similarità almeno pari alla soglia, viene mostrata la sua risposta senza interrogare di nuovo il modello. Le risposte non sono mai condivise tra chiavi API diverse. Con 1.00 la cache è disattivata.",
+    )
+
+    # Per-request bypass: the semantic cache is neither read nor written
+    if st.sidebar.checkbox("Ignora la cache per questa domanda", value=False):
+        cache_threshold = 1.0
+
     # Retrieve subfolders from the 'db' directory
     subfolders = list_subfolders(db_path)
 
@@ -32,9 +64,18 @@ def sidebar_c(db_path, list_subfolders):
         st.error(
             "Nessuna sotto-cartella trovata nella cartella 'db'. Assicurati che ci siano dati disponibili per la ricerca."
         )
-        return None, None
+        return None, None, None, None, None, None
 
-    # Topic selection (Note: st.selectbox returns the selected value, not the index)
-    Indice = st.selectbox("Seleziona il db indicizzato", subfolders)
+    # Federated mode: the same question is asked to several indices at once
+    multi_index = st.checkbox("Cerca in più db indicizzati", value=False)
+    if multi_index:
+        indici = st.multiselect("Seleziona i db indicizzati", subfolders, default=subfolders[:1])
+        if not indici:
+            st.warning("Seleziona almeno un db indicizzato.")
+            return None, None, None, None, None, None
+    else:
+        # Topic selection (Note: st.selectbox returns the selected value, not the index)
+        indici = [st.selectbox("Seleziona il db indicizzato", subfolders)]
+    Indice = ", ".join(indici)
 
-    return temperature, similarity_k, Indice
+    return temperature, similarity_k, Indice, cache_threshold, retrieval_mode, indici
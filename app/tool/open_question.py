@@ -1,11 +1,16 @@
 import os
-import random
 import streamlit as st
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from utils.faiss_store import get_cached_index, invalidate_index, save_index
+from utils.embeddings import get_embeddings
+from utils.question_prefetch import (
+    get_question_queue, read_question_bank, bank_matches, build_question_bank, pop_bank_question, DEFAULT_PREFETCH_SIZE,
+)
+from utils.docstore_sampler import sample_documents, STRATIFY_NONE, STRATIFY_DOCUMENT, STRATIFY_PAGE
+from utils.credentials import credential_hash
 from langchain_core.runnables import RunnablePassthrough
 from dotenv import load_dotenv
 
@@ -66,9 +71,45 @@ def open_question():
         help="Nel contesto del Retrieval-Augmented Generation (RAG), i chunk sono segmenti di testo suddivisi da documenti più grandi. Questa suddivisione ottimizza l'elaborazione del modello, mantiene il contesto semantico e migliora la precisione del recupero delle informazioni rilevanti per una query specifica.",
     )
 
+    # Modalità di estrazione del chunk da cui generare la domanda
+    sampling_options = {
+        "Chunk casuale": STRATIFY_NONE,
+        "Documento casuale": STRATIFY_DOCUMENT,
+        "Pagina casuale": STRATIFY_PAGE,
+    }
+    sampling_choice = st.sidebar.selectbox(
+        "Estrazione del contenuto",
+        list(sampling_options.keys()),
+        help="Per documento o per pagina: si estrae prima un documento (o una pagina) e poi un suo chunk, così i documenti lunghi non prevalgono. Nella stessa sessione non si ripete lo stesso chunk finché ce ne sono altri.",
+    )
+
     # Selezione dell'indice FAISS
     Indice = st.selectbox("Seleziona l'indice", subfolders)
 
+    index_folder = os.path.join(db_path, Indice)
+    stratify = sampling_options[sampling_choice]
+
+    # Domande generate in background mentre lo studente risponde alla domanda corrente
+    prefetch_size = st.sidebar.number_input(
+        "Domande da preparare in anticipo",
+        0,
+        10,
+        DEFAULT_PREFETCH_SIZE,
+        help="Mentre rispondi vengono generate in background le domande successive, così la prossima è subito disponibile. Con 0 la preparazione è disattivata.",
+    )
+
+    # Il banco è proposto solo con il modello e la temperatura con cui è stato generato
+    bank = read_question_bank(index_folder)
+    question_bank = bank.get("domande", []) if bank_matches(bank, model_choice, temperature_gen) else []
+    use_bank = False
+    if question_bank:
+        use_bank = st.checkbox(f"Usa il banco di domande dell'indice ({len(question_bank)} domande già pronte)", value=True)
+    elif bank.get("domande"):
+        st.caption(
+            f"Il banco di domande dell'indice è stato generato con {bank.get('modello')} "
+            f"(temperatura {bank.get('temperatura')}) e non viene usato con le impostazioni attuali."
+        )
+
     if st.button("Genera Domanda"):
         if not openai_api_key.startswith("sk-"):
             st.warning("Per favore, inserisci una chiave API OpenAI valida!", icon="⚠")
@@ -76,14 +117,10 @@ def open_question():
 
         # Configuration settings
         model_gen = ChatOpenAI(temperature=temperature_gen, model_name=model_choice, api_key=openai_api_key)
-        embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L12-v2')
+        embeddings = get_embeddings()
 
-        # Load or create the FAISS index with the specified folder
-        if "faiss_index" not in st.session_state or st.session_state.faiss_index is None:
-            faiss_index = get_faiss_index(os.path.join(db_path, Indice), embeddings)
-            st.session_state.faiss_index = faiss_index
-        else:
-            faiss_index = st.session_state.faiss_index
+        # Load the FAISS index from the shared cache (reloaded only if the files change)
+        faiss_index = get_faiss_index(index_folder, embeddings)
 
         if faiss_index is None:
             st.error("Impossibile caricare o creare l'indice FAISS.")
@@ -93,41 +130,42 @@ def open_question():
             search_type="mmr", search_kwargs={"k": similarity_k}
         )
         st.session_state.retriever = retriever
-
-        # Recupera i chunk selezionati
-        relevant_docs = retriever.get_relevant_documents("")
-        selected_docs = random.sample(relevant_docs, 1)  # Seleziona casualmente 1 chunk
-
-        combined_context = " ".join([doc.page_content for doc in selected_docs])
-
-        # Prompt configuration for question generation
-        messages = [
-            SystemMessagePromptTemplate.from_template("""Sei un assistente utile che genera domande in italiano basate sui contenuti forniti rivolte a studenti universitari. Queste sono le istruzione:
-
-    Sei un assistente utile che genera domande in italiano basate sui contenuti forniti rivolte a studenti universitari. Queste sono le istruzione:
-
-   Definisci il Verbo d'Azione Complesso: utilizza un verbo che richieda un'elaborazione cognitiva avanzata, come "analizzare," "valutare," o "creare." Questo verbo deve chiaramente indicare il tipo di attività mentale richiesta per rispondere alla domanda.
-
-    Stabilisci il Contesto e la Condizione: specifica il contesto in cui deve avvenire la risposta, inclusi i dettagli su risorse, formato, e condizioni ambientali. Questo aiuta a inquadrare la domanda e a guidare la riflessione degli studenti.
-
-    Stabilisci i Criteri di Valutazione: definisci chiaramente i criteri secondo cui la risposta sarà valutata, come l'accuratezza, la coerenza, o l'originalità. Questo permette di misurare la performance degli studenti in modo chiaro e oggettivo.
-
-    Assicura la Rilevanza Didattica: verifica che la domanda sia allineata agli obiettivi di apprendimento del corso e contribuisca allo sviluppo delle competenze chiave. La domanda deve essere pertinente e significativa per il processo educativo.
-
-    Integra un Riferimento Temporale (se necessario): Inserisci un riferimento temporale per delimitare il periodo di analisi o il contesto storico. Questo aiuta a circoscrivere l'ambito di applicazione della risposta e a garantire la sua rilevanza."""),
-            HumanMessagePromptTemplate.from_template("Rivolgiti a me come studente. Genera una domanda basata su questi contenuti: {context}")
-        ]
-        prompt_gen = ChatPromptTemplate.from_messages(messages)
-
-        rag_chain = build_rag_chain(prompt_gen, model_gen, retriever)
+        generate_question = make_question_generator(model_gen, retriever)
+
+        # Chunk già usati in questa sessione: non vengono riproposti finché ce ne sono altri
+        drawn_chunks = st.session_state.drawn_chunks.setdefault(Indice, set())
+        if len(drawn_chunks) >= len(faiss_index.index_to_docstore_id):
+            drawn_chunks.clear()  # Tutti i chunk sono già stati usati: si ricomincia
+
+        question_queue = None
+        if prefetch_size:
+            question_queue = get_question_queue(
+                index_folder, model_choice, temperature_gen, similarity_k, stratify, prefetch_size,
+                credential=credential_hash(model_gen),
+            )
+            if question_queue.error is not None:
+                st.warning(f"La preparazione delle domande in background non è riuscita: {question_queue.error}")
 
         # Execute the query and display the response
         try:
-            st.session_state.last_question = query_stream(
-                combined_context, rag_chain
-            )
-
-            st.session_state.formatted_context = format_documents(selected_docs)
+            # Prima il banco di domande, poi le domande già pronte, infine la generazione immediata
+            item = None
+            if use_bank:
+                item = pop_bank_question(question_bank, faiss_index, drawn_chunks)
+            if item is None and question_queue is not None:
+                item = question_queue.pop(exclude=drawn_chunks)
+            if item is None:
+                sampled = sample_documents(faiss_index, 1, stratify, exclude=drawn_chunks)
+                if not sampled:
+                    st.error("L'indice selezionato non contiene chunk da cui generare una domanda.")
+                    return
+                docstore_id, document = sampled[0]
+                item = {"question": generate_question(document), "docstore_id": docstore_id, "document": document}
+
+            drawn_chunks.add(item["docstore_id"])
+            st.session_state.last_question = item["question"]
+
+            st.session_state.formatted_context = format_documents([item["document"]])
 
             # Salva l'interazione nello storico
             st.session_state.interazioni.append({
@@ -144,6 +182,37 @@ def open_question():
             st.error(f"Si è verificato un errore durante la generazione della domanda: {e}")
             return
 
+        # Prepara le prossime domande mentre lo studente risponde
+        if question_queue is not None:
+            question_queue.ensure_filling(faiss_index, generate_question, stratify)
+
+    # Generazione offline del banco di domande dell'indice
+    with st.expander("Banco di domande dell'indice"):
+        st.write(
+            "Genera in anticipo un insieme di domande sull'indice selezionato: vengono salvate con l'indice "
+            "e proposte prima di generarne di nuove, solo con il modello e la temperatura usati per generarle."
+        )
+        bank_size = st.number_input("Numero di domande da generare", 1, 500, 20)
+        if st.button("Genera il banco di domande"):
+            if not openai_api_key.startswith("sk-"):
+                st.warning("Per favore, inserisci una chiave API OpenAI valida!", icon="⚠")
+                return
+            faiss_index = get_faiss_index(index_folder, get_embeddings())
+            if faiss_index is None:
+                st.error("Impossibile caricare o creare l'indice FAISS.")
+                return
+            model_gen = ChatOpenAI(temperature=temperature_gen, model_name=model_choice, api_key=openai_api_key)
+            retriever = faiss_index.as_retriever(search_type="mmr", search_kwargs={"k": similarity_k})
+            bank_progress = st.progress(0.0, text="Generazione del banco di domande...")
+            saved = build_question_bank(
+                index_folder, faiss_index, make_question_generator(model_gen, retriever), bank_size,
+                model_choice, temperature_gen, stratify,
+                on_question_done=lambda completed, total: bank_progress.progress(
+                    completed / total, text=f"Domande generate: {completed}/{total}"
+                ),
+            )
+            st.success(f"Banco di domande salvato con {saved} domande.")
+
     # Mostra la domanda generata se esiste
     if "last_question" in st.session_state and st.session_state.last_question:
         st.text_area("Domanda generata:", st.session_state.last_question, height=150)
@@ -293,6 +362,10 @@ def init_session_state():
         if var not in st.session_state:
             st.session_state[var] = None if var in ["faiss_index", "retriever", "proposed_answer"] else []
 
+    # Chunk già usati per generare domande, per indice
+    if "drawn_chunks" not in st.session_state:
+        st.session_state.drawn_chunks = {}
+
 def configure_ui():
     """Configure user interface elements."""
     st.write(
@@ -314,18 +387,48 @@ def get_faiss_index(cartella, embeddings, splits=None):
     index_path = os.path.join(cartella, "index.faiss")
     if os.path.exists(cartella) and os.path.exists(index_path):
         try:
-            return FAISS.load_local(cartella, embeddings, allow_dangerous_deserialization=True)
+            return get_cached_index(cartella, embeddings)
         except Exception as e:
             st.error(f"Errore durante il caricamento dell'indice FAISS: {e}")
             return None
     elif splits is not None:
         faiss_index = FAISS.from_documents(splits, embeddings)
-        faiss_index.save_local(cartella)
+        save_index(faiss_index, cartella)
+        invalidate_index(cartella)
         return faiss_index
     else:
         st.error("Non ci sono dati disponibili per creare l'indice FAISS.")
         return None
 
+def get_question_prompt():
+    """Return the prompt that generates a question from a chunk."""
+    messages = [
+        SystemMessagePromptTemplate.from_template("""Sei un assistente utile che genera domande in italiano basate sui contenuti forniti rivolte a studenti universitari. Queste sono le istruzione:
+
+    Sei un assistente utile che genera domande in italiano basate sui contenuti forniti rivolte a studenti universitari. Queste sono le istruzione:
+
+   Definisci il Verbo d'Azione Complesso: utilizza un verbo che richieda un'elaborazione cognitiva avanzata, come "analizzare," "valutare," o "creare." Questo verbo deve chiaramente indicare il tipo di attività mentale richiesta per rispondere alla domanda.
+
+    Stabilisci il Contesto e la Condizione: specifica il contesto in cui deve avvenire la risposta, inclusi i dettagli su risorse, formato, e condizioni ambientali. Questo aiuta a inquadrare la domanda e a guidare la riflessione degli studenti.
+
+    Stabilisci i Criteri di Valutazione: definisci chiaramente i criteri secondo cui la risposta sarà valutata, come l'accuratezza, la coerenza, o l'originalità. Questo permette di misurare la performance degli studenti in modo chiaro e oggettivo.
+
+    Assicura la Rilevanza Didattica: verifica che la domanda sia allineata agli obiettivi di apprendimento del corso e contribuisca allo sviluppo delle competenze chiave. La domanda deve essere pertinente e significativa per il processo educativo.
+
+    Integra un Riferimento Temporale (se necessario): Inserisci un riferimento temporale per delimitare il periodo di analisi o il contesto storico. Questo aiuta a circoscrivere l'ambito di applicazione della risposta e a garantire la sua rilevanza."""),
+        HumanMessagePromptTemplate.from_template("Rivolgiti a me come studente. Genera una domanda basata su questi contenuti: {context}")
+    ]
+    return ChatPromptTemplate.from_messages(messages)
+
+def make_question_generator(model_gen, retriever):
+    """Return a function that generates a question from a sampled chunk (usable from any thread)."""
+    rag_chain = build_rag_chain(get_question_prompt(), model_gen, retriever)
+
+    def generate_question(document):
+        return query_stream(document.page_content, rag_chain)
+
+    return generate_question
+
 def build_rag_chain(prompt, model, retriever):
     """Create the RAG chain to execute the query."""
     return {
@@ -14,6 +14,12 @@ import edge_tts
 import tempfile
 import asyncio
 import re
+from utils.token_splitter import split_text_into_chunks, minimal_num_chunks, count_tokens, DEFAULT_CHUNK_TOKENS
+from utils.llm_cache import cached_invoke, prompt_versions
+from utils.concurrent_llm import summarize_chunks, show_chunk_progress, SUMMARY_CONCURRENCY
+
+# Versione dei prompt nella chiave della cache delle risposte: va aggiornata quando si modifica un prompt
+PROMPT_VERSIONS = prompt_versions("pdf_summary", summarize=1, enhance=1, outline=1, apa=1)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -127,23 +133,7 @@ def upload_and_extract_text():
     else:
         return None, None
 
-def split_text_into_chunks(text, num_chunks):
-    chunk_size = len(text) // num_chunks
-    chunks = []
-    start = 0
-    
-    for i in range(num_chunks):
-        end = start + chunk_size
-        if i == num_chunks - 1:
-            end = len(text)
-        chunk = text[start:end].strip()
-        chunks.append(chunk)
-        start = end
-        logger.info(f"Chunk {i+1}: {chunk[:100]}...")
-    
-    return chunks
-
-def summarize_text_with_context(text, prev_chunk, next_chunk, model_choice, temperature, openai_api_key, language="Italian", custom_prompt=""):
+def summarize_text_with_context(text, prev_chunk, next_chunk, model_choice, temperature, openai_api_key, language="Italian", custom_prompt="", use_cache=False):
     logger.info(f"Starting text summarization with context in {language}.")
     
     llm = ChatOpenAI(
@@ -176,17 +166,16 @@ def summarize_text_with_context(text, prev_chunk, next_chunk, model_choice, temp
         custom_text = f"\n\n{custom_prompt}"
         text += custom_text
     
-    chain = template.pipe(llm)
-    response = chain.invoke({
+    response = cached_invoke(template, llm, {
         "previous_chunk": prev_chunk,
         "next_chunk": next_chunk,
         "input": text
-    })
+    }, model_choice, temperature, PROMPT_VERSIONS["summarize"], use_cache)
     
     logger.info(f"Text summarization with context in {language} completed.")
-    return response.content
+    return response
 
-def enhance_text_with_headings(summarized_text, model_choice, temperature, openai_api_key, language="Italian", num_parts=3, custom_prompt=""):
+def enhance_text_with_headings(summarized_text, model_choice, temperature, openai_api_key, language="Italian", num_parts=3, custom_prompt="", use_cache=False):
     logger.info(f"Starting text enhancement with headings in {language}.")
     
     llm = ChatOpenAI(
@@ -195,7 +184,7 @@ def enhance_text_with_headings(summarized_text, model_choice, temperature, opena
         openai_api_key=openai_api_key
     )
     
-    text_parts = split_text_into_chunks(summarized_text, num_parts)
+    text_parts = split_text_into_chunks(summarized_text, num_parts, model=model_choice)
     
     enhanced_text = ""
     
@@ -220,17 +209,16 @@ def enhance_text_with_headings(summarized_text, model_choice, temperature, opena
             ("human", "{input}")
         ])
         
-        chain = template.pipe(llm)
-        response = chain.invoke({
+        response = cached_invoke(template, llm, {
             "input": part
-        })
+        }, model_choice, temperature, PROMPT_VERSIONS["enhance"], use_cache)
         
-        enhanced_text += response.content + "\n"
+        enhanced_text += response + "\n"
 
     logger.info(f"Text enhancement with headings in {language} completed.")
     return enhanced_text
 
-def generate_outline_from_enhanced_text(enhanced_text, model_choice, temperature, openai_api_key, language="Italian", num_parts=3):
+def generate_outline_from_enhanced_text(enhanced_text, model_choice, temperature, openai_api_key, language="Italian", num_parts=3, use_cache=False):
     logger.info(f"Starting outline generation from enhanced text in {language}.")
     
     llm = ChatOpenAI(
@@ -239,7 +227,7 @@ def generate_outline_from_enhanced_text(enhanced_text, model_choice, temperature
         openai_api_key=openai_api_key
     )
     
-    text_parts = split_text_into_chunks(enhanced_text, num_parts)
+    text_parts = split_text_into_chunks(enhanced_text, num_parts, model=model_choice)
     
     outline_text = ""
     
@@ -256,18 +244,17 @@ def generate_outline_from_enhanced_text(enhanced_text, model_choice, temperature
             ("human", "{input}")
         ])
         
-        chain = template.pipe(llm)
-        response = chain.invoke({
+        response = cached_invoke(template, llm, {
             "input": part
-        })
+        }, model_choice, temperature, PROMPT_VERSIONS["outline"], use_cache)
         
-        outline_text += f"{response.content}\n\n"  # Rimuovi la dicitura "Parte X:"
+        outline_text += f"{response}\n\n"  # Rimuovi la dicitura "Parte X:"
 
     logger.info(f"Outline generation from enhanced text in {language} completed.")
     return outline_text
 
 
-def format_bibliography_in_apa(enhanced_text, model_choice, temperature, openai_api_key, language="Italian"):
+def format_bibliography_in_apa(enhanced_text, model_choice, temperature, openai_api_key, language="Italian", use_cache=False):
     logger.info(f"Starting bibliography formatting in APA style in {language}.")
     
     llm = ChatOpenAI(
@@ -289,14 +276,13 @@ def format_bibliography_in_apa(enhanced_text, model_choice, temperature, openai_
         ("human", "{input}")
     ])
     
-    chain = template.pipe(llm)
-    response = chain.invoke({
+    response = cached_invoke(template, llm, {
         "input": enhanced_text
-    })
+    }, model_choice, temperature, PROMPT_VERSIONS["apa"], use_cache)
     
     logger.info(f"Bibliography formatting in APA style in {language} completed.")
     
-    final_text_with_bibliography = response.content
+    final_text_with_bibliography = response
     return final_text_with_bibliography
 
 def create_markdown_file(text, filename):
@@ -461,41 +447,52 @@ def pdf_summary():
         custom_prompt_first = st.text_area("A chi è rivolto il riassunto? ci sono istruzioni particolari che vorresti includere per fare il riassunto? (Riassunto)", "")
         custom_prompt_second = st.text_area("Ci sono istruzionio che vorresti includere per la revisione del riassunto? (Miglioramento e Titolazione)", "")
         
-        num_chunks = st.number_input("In quanti pezzi vuoi dividere il testo per il riassunto?", min_value=1, max_value=20, value=5)
+        # Divisione in blocchi contando i token del modello scelto, senza spezzare frasi e paragrafi
+        auto_chunks = st.checkbox("Usa il numero minimo di blocchi entro un budget di token", value=False)
+        if auto_chunks:
+            max_chunk_tokens = st.number_input("Token massimi per blocco", min_value=500, max_value=32000, value=DEFAULT_CHUNK_TOKENS, step=500)
+            num_chunks = None
+            st.caption(f"Il testo ({count_tokens(text, model_choice)} token) sarà diviso in {minimal_num_chunks(text, max_chunk_tokens, model_choice)} blocchi.")
+        else:
+            num_chunks = st.number_input("In quanti pezzi vuoi dividere il testo per il riassunto?", min_value=1, max_value=20, value=5)
+            max_chunk_tokens = None
         num_parts = st.number_input("In quante parti vuoi dividere il testo per il miglioramento con titoletti?", min_value=1, max_value=10, value=3)
+        max_concurrency = st.number_input("Quanti blocchi riassumere contemporaneamente?", min_value=1, max_value=16, value=SUMMARY_CONCURRENCY)
+        use_cache = st.checkbox("Riusa le risposte già generate per lo stesso testo e le stesse impostazioni", value=False, help="Con temperatura maggiore di 0 viene riusata la prima risposta generata.")
 
         # Attiva il processo solo dopo che l'utente ha fornito tutte le informazioni
         if st.button("Avvia il processo di riassunto e miglioramento"):
-            chunks = split_text_into_chunks(text, num_chunks)
+            chunks = split_text_into_chunks(text, num_chunks, model=model_choice, max_tokens=max_chunk_tokens)
             st.success(f"Testo diviso in {len(chunks)} blocchi.")
             
             summarized_text = f"Riassunto - {pdf_filename} ({model_choice}, Temp: {temperature})\n\n"
-            
-            for i, chunk in enumerate(chunks):
-                prev_chunk = chunks[i-1] if i > 0 else ""
-                next_chunk = chunks[i+1] if i < len(chunks) - 1 else ""
-
-                try:
-                    summary = summarize_text_with_context(chunk, prev_chunk, next_chunk, model_choice, temperature, openai_api_key, language=language, custom_prompt=custom_prompt_first)
-                    if not summary.strip():
-                        summary = "Impossibile generare il riassunto."
-                    logger.info(f"Blocco {i+1} riassunto con successo.")
-                    
-                    if i == 0:
-                        st.write("### Primo Riassunto Generato:")
-                        st.write(summary)
-                    
-                except Exception as e:
+
+            # I blocchi sono riassunti in parallelo: ognuno usa solo il testo grezzo dei vicini
+            summaries = summarize_chunks(
+                chunks,
+                lambda chunk, prev_chunk, next_chunk: summarize_text_with_context(chunk, prev_chunk, next_chunk, model_choice, temperature, openai_api_key, language=language, custom_prompt=custom_prompt_first, use_cache=use_cache),
+                max_workers=max_concurrency,
+                on_chunk_done=show_chunk_progress(len(chunks)),
+            )
+
+            for i, (summary, error) in enumerate(summaries):
+                if error is not None:
                     summary = "Errore durante la generazione del riassunto."
-                    logger.error(f"Errore nel riassumere il blocco {i+1}: {e}")
-                
+                    logger.error(f"Errore nel riassumere il blocco {i+1}: {error}")
+                elif not summary.strip():
+                    summary = "Impossibile generare il riassunto."
+
+                if i == 0 and error is None:
+                    st.write("### Primo Riassunto Generato:")
+                    st.write(summary)
+
                 summarized_text += summary + "\n"
             
-            enhanced_text = enhance_text_with_headings(summarized_text, model_choice, temperature, openai_api_key, language=language, num_parts=num_parts, custom_prompt=custom_prompt_second)
+            enhanced_text = enhance_text_with_headings(summarized_text, model_choice, temperature, openai_api_key, language=language, num_parts=num_parts, custom_prompt=custom_prompt_second, use_cache=use_cache)
 
-            outline_text = generate_outline_from_enhanced_text(enhanced_text, model_choice, temperature, openai_api_key, language=language, num_parts=num_parts)
+            outline_text = generate_outline_from_enhanced_text(enhanced_text, model_choice, temperature, openai_api_key, language=language, num_parts=num_parts, use_cache=use_cache)
 
-            bibliography_text = format_bibliography_in_apa(enhanced_text, model_choice, temperature, openai_api_key, language=language)
+            bibliography_text = format_bibliography_in_apa(enhanced_text, model_choice, temperature, openai_api_key, language=language, use_cache=use_cache)
             
             st.session_state['final_text'] = enhanced_text
             st.session_state['outline_text'] = outline_text
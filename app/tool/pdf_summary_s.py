@@ -12,6 +12,12 @@ import edge_tts
 import tempfile
 import asyncio
 import re
+from utils.token_splitter import split_text_into_chunks, minimal_num_chunks, count_tokens, DEFAULT_CHUNK_TOKENS
+from utils.llm_cache import cached_invoke, prompt_versions
+from utils.concurrent_llm import summarize_chunks, show_chunk_progress, SUMMARY_CONCURRENCY
+
+# Versione dei prompt nella chiave della cache delle risposte: va aggiornata quando si modifica un prompt
+PROMPT_VERSIONS = prompt_versions("pdf_summary_s", summarize=1, enhance=1)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -86,23 +92,7 @@ def extract_text_from_pdf(reader):
         text += page.extract_text() + "\n\n"
     return text
 
-def split_text_into_chunks(text, num_chunks):
-    chunk_size = len(text) // num_chunks
-    chunks = []
-    start = 0
-    
-    for i in range(num_chunks):
-        end = start + chunk_size
-        if i == num_chunks - 1:  # L'ultimo chunk prende tutto il testo rimanente
-            end = len(text)
-        chunk = text[start:end].strip()
-        chunks.append(chunk)
-        start = end
-        logger.info(f"Chunk {i+1}: {chunk[:100]}...")  # Mostra l'inizio di ciascun chunk per verifica
-    
-    return chunks
-
-def summarize_text_with_context(text, prev_chunk, next_chunk, model_choice, temperature, openai_api_key, language="Italian"):
+def summarize_text_with_context(text, prev_chunk, next_chunk, model_choice, temperature, openai_api_key, language="Italian", use_cache=False):
     logger.info(f"Starting text summarization with context in {language}.")
     
     # Set up the chat model with the specific model, temperature, and API key
@@ -134,17 +124,16 @@ def summarize_text_with_context(text, prev_chunk, next_chunk, model_choice, temp
     ])
     
     # Format the prompt with the specific input and context
-    chain = template.pipe(llm)
-    response = chain.invoke({
+    response = cached_invoke(template, llm, {
         "previous_chunk": prev_chunk,
         "next_chunk": next_chunk,
         "input": text
-    })
+    }, model_choice, temperature, PROMPT_VERSIONS["summarize"], use_cache)
     
     logger.info(f"Text summarization with context in {language} completed.")
-    return response.content
+    return response
 
-def enhance_text_with_headings(summarized_text, model_choice, temperature, openai_api_key, language="Italian"):
+def enhance_text_with_headings(summarized_text, model_choice, temperature, openai_api_key, language="Italian", use_cache=False):
     logger.info(f"Starting text enhancement with headings in {language}.")
     
     # Set up the chat model with the specific model, temperature, and API key
@@ -173,13 +162,12 @@ def enhance_text_with_headings(summarized_text, model_choice, temperature, opena
     ])
     
     # Format the prompt with the specific input
-    chain = template.pipe(llm)
-    response = chain.invoke({
+    response = cached_invoke(template, llm, {
         "input": summarized_text
-    })
+    }, model_choice, temperature, PROMPT_VERSIONS["enhance"], use_cache)
     
     logger.info(f"Text enhancement with headings in {language} completed.")
-    return response.content
+    return response
 
 def create_docx(text):
     logger.info(f"Creating the .docx file in memory.")
@@ -235,11 +223,20 @@ def pdf_summary_s():
             st.error("Configurazione non corretta. Verifica la chiave API e le altre impostazioni.")
             return
         
-        # Ask the user how many chunks they want
-        num_chunks = st.number_input("In quanti pezzi vuoi dividere il PDF?", min_value=1, max_value=20, value=5)
+        # Ask the user how many chunks they want (or a token budget per chunk)
+        auto_chunks = st.checkbox("Usa il numero minimo di blocchi entro un budget di token", value=False)
+        if auto_chunks:
+            max_chunk_tokens = st.number_input("Token massimi per blocco", min_value=500, max_value=32000, value=DEFAULT_CHUNK_TOKENS, step=500)
+            num_chunks = None
+            st.caption(f"Il testo ({count_tokens(text, model_choice)} token) sarà diviso in {minimal_num_chunks(text, max_chunk_tokens, model_choice)} blocchi.")
+        else:
+            num_chunks = st.number_input("In quanti pezzi vuoi dividere il PDF?", min_value=1, max_value=20, value=5)
+            max_chunk_tokens = None
+        max_concurrency = st.number_input("Quanti blocchi riassumere contemporaneamente?", min_value=1, max_value=16, value=SUMMARY_CONCURRENCY)
+        use_cache = st.checkbox("Riusa le risposte già generate per lo stesso testo e le stesse impostazioni", value=False, help="Con temperatura maggiore di 0 viene riusata la prima risposta generata.")
         
         # Split the text into the specified number of chunks
-        chunks = split_text_into_chunks(text, num_chunks)
+        chunks = split_text_into_chunks(text, num_chunks, model=model_choice, max_tokens=max_chunk_tokens)
         st.session_state['chunks'] = chunks
         st.success(f"Testo diviso in {len(chunks)} blocchi.")
         
@@ -248,31 +245,31 @@ def pdf_summary_s():
 
             if st.button("Riassumi e Genera"):
                 summarized_text = f"Riassunto - {pdf_filename} ({model_choice}, Temp: {temperature})\n\n"
-                
-                for i, chunk in enumerate(chunks):
-                    prev_chunk = chunks[i-1] if i > 0 else ""
-                    next_chunk = chunks[i+1] if i < len(chunks) - 1 else ""
 
-                    try:
-                        # Generate summary with context for the current chunk
-                        summary = summarize_text_with_context(chunk, prev_chunk, next_chunk, model_choice, temperature, openai_api_key, language=language)
-                        if not summary.strip():
-                            summary = "Impossibile generare il riassunto."
-                        logger.info(f"Blocco {i+1} riassunto con successo.")
-                        
-                        # Mostra il riassunto del primo blocco generato
-                        if i == 0:
-                            st.write("### Primo Riassunto Generato:")
-                            st.write(summary)
-                        
-                    except Exception as e:
+                # Generate the summaries concurrently, each with the raw neighbouring chunks as context
+                summaries = summarize_chunks(
+                    chunks,
+                    lambda chunk, prev_chunk, next_chunk: summarize_text_with_context(chunk, prev_chunk, next_chunk, model_choice, temperature, openai_api_key, language=language, use_cache=use_cache),
+                    max_workers=max_concurrency,
+                    on_chunk_done=show_chunk_progress(len(chunks)),
+                )
+
+                for i, (summary, error) in enumerate(summaries):
+                    if error is not None:
                         summary = "Errore durante la generazione del riassunto."
-                        logger.error(f"Errore nel riassumere il blocco {i+1}: {e}")
-                    
+                        logger.error(f"Errore nel riassumere il blocco {i+1}: {error}")
+                    elif not summary.strip():
+                        summary = "Impossibile generare il riassunto."
+
+                    # Mostra il riassunto del primo blocco generato
+                    if i == 0 and error is None:
+                        st.write("### Primo Riassunto Generato:")
+                        st.write(summary)
+
                     summarized_text += summary + "\n"
                 
                 # Enhance the summarized text and add headings using the same language
-                enhanced_text = enhance_text_with_headings(summarized_text, model_choice, temperature, openai_api_key, language=language)
+                enhanced_text = enhance_text_with_headings(summarized_text, model_choice, temperature, openai_api_key, language=language, use_cache=use_cache)
                 
                 # Memorizza il testo migliorato per permettere il download senza resettare la pagina
                 st.session_state['enhanced_text'] = enhanced_text
@@ -5,6 +5,7 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
+from utils.faiss_store import get_cached_index, invalidate_index, save_index
 from langchain_core.runnables import RunnablePassthrough
 from prompt.prompt_configs import get_chat_prompt_template  # Importa il modulo del prompt
 from dotenv import load_dotenv
@@ -200,13 +201,14 @@ def get_faiss_index(cartella, embeddings, splits=None):
     index_path = os.path.join(cartella, "index.faiss")
     if os.path.exists(cartella) and os.path.exists(index_path):
         try:
-            return FAISS.load_local(cartella, embeddings, allow_dangerous_deserialization=True)
+            return get_cached_index(cartella, embeddings)
         except Exception as e:
             st.error(f"Errore durante il caricamento dell'indice FAISS: {e}")
             return None
     elif splits is not None:
         faiss_index = FAISS.from_documents(splits, embeddings)
-        faiss_index.save_local(cartella)
+        save_index(faiss_index, cartella)
+        invalidate_index(cartella)
         return faiss_index
     else:
         st.error("Non ci sono dati disponibili per creare l'indice FAISS.")
@@ -0,0 +1,284 @@
+# ann_index.py
+
+import os
+import json
+import math
+import time
+import logging
+import numpy as np
+
+INDEX_META_FILE = "index_meta.json"
+
+INDEX_FLAT = "flat"
+INDEX_IVF = "ivf"
+INDEX_HNSW = "hnsw"
+INDEX_IVFPQ = "ivfpq"
+INDEX_AUTO = "auto"
+INDEX_TYPES = (INDEX_FLAT, INDEX_IVF, INDEX_HNSW, INDEX_IVFPQ)
+INDEX_TYPE_LABELS = {
+    INDEX_AUTO: "Automatico (in base al numero di chunk)",
+    INDEX_FLAT: "Flat (ricerca esatta)",
+    INDEX_IVF: "IVF (liste invertite)",
+    INDEX_HNSW: "HNSW (grafo)",
+    INDEX_IVFPQ: "IVF-PQ (vettori compressi)",
+}
+
+# Soglie della scelta automatica (numero di vettori)
+AUTO_HNSW_MIN_VECTORS = 50_000
+AUTO_IVFPQ_MIN_VECTORS = 1_000_000
+# Sotto questa soglia l'addestramento del product quantizer non è affidabile: si usa IVF
+IVFPQ_MIN_TRAINING_VECTORS = 10_000
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+PQ_NBITS = 8
+
+
+def choose_index_type(num_vectors):
+    """Pick the index type for a corpus size: exact search while it is cheap, then approximate."""
+    if num_vectors < AUTO_HNSW_MIN_VECTORS:
+        return INDEX_FLAT
+    if num_vectors < AUTO_IVFPQ_MIN_VECTORS:
+        return INDEX_HNSW
+    return INDEX_IVFPQ
+
+
+def index_type_of(index):
+    """Return the type name of a raw faiss index."""
+    import faiss
+
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return INDEX_HNSW
+    if isinstance(index, faiss.IndexIVFPQ):
+        return INDEX_IVFPQ
+    if isinstance(index, faiss.IndexIVFFlat):
+        return INDEX_IVF
+    return INDEX_FLAT
+
+
+def default_params(index_type, num_vectors, dimension):
+    """Return the construction and search parameters of an index type for a corpus."""
+    if index_type == INDEX_HNSW:
+        return {"M": HNSW_M, "efConstruction": HNSW_EF_CONSTRUCTION, "efSearch": HNSW_EF_SEARCH}
+    if index_type in (INDEX_IVF, INDEX_IVFPQ):
+        # Circa 4*sqrt(n) liste, con almeno 39 vettori di addestramento per lista
+        nlist = max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+        params = {"nlist": nlist, "nprobe": min(nlist, 64, max(8, nlist // 8))}
+        if index_type == INDEX_IVFPQ:
+            params["m"] = _pq_subquantizers(dimension)
+            params["nbits"] = PQ_NBITS
+        return params
+    return {}
+
+
+def _pq_subquantizers(dimension):
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if dimension % m == 0 and dimension // m >= 4:
+            return m
+    return 1
+
+
+def reconstruct_all(index):
+    """Return all the vectors of an index as a float32 matrix (approximate for IVF-PQ)."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    except RuntimeError:
+        return np.vstack([index.reconstruct(i) for i in range(index.ntotal)]).astype(np.float32)
+
+
+def build_index(vectors, index_type, params=None):
+    """Build a raw faiss index of the given type over the vectors (positions are preserved)."""
+    import faiss
+
+    num_vectors, dimension = vectors.shape
+    if index_type == INDEX_IVFPQ and num_vectors < IVFPQ_MIN_TRAINING_VECTORS:
+        logging.warning(f"Troppi pochi vettori ({num_vectors}) per IVF-PQ: si usa IVF")
+        index_type = INDEX_IVF
+    params = dict(default_params(index_type, num_vectors, dimension), **(params or {}))
+
+    if index_type == INDEX_HNSW:
+        index = faiss.IndexHNSWFlat(dimension, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+        index.hnsw.efSearch = params["efSearch"]
+    elif index_type in (INDEX_IVF, INDEX_IVFPQ):
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == INDEX_IVFPQ:
+            index = faiss.IndexIVFPQ(quantizer, dimension, params["nlist"], params["m"], params["nbits"])
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, params["nlist"], faiss.METRIC_L2)
+        index.train(vectors)
+        index.nprobe = params["nprobe"]
+    else:
+        index = faiss.IndexFlatL2(dimension)
+    if num_vectors:
+        index.add(vectors)
+    prepare_index(index)
+    return index, index_type, params
+
+
+def prepare_index(index):
+    """Enable reconstruct() on IVF indices (used by MMR, conversions and rebuilds)."""
+    import faiss
+
+    if index_type_of(index) in (INDEX_IVF, INDEX_IVFPQ) and index.direct_map.type != faiss.DirectMap.Hashtable:
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+
+def convert_index(faiss_store, index_type=INDEX_AUTO, params=None):
+    """Replace the flat index of a LangChain FAISS store with the requested type, in place.
+
+    The vectors are reconstructed from the current index and added in the same
+    order, so index_to_docstore_id and the docstore stay valid. Returns the metadata
+    to save with write_index_meta().
+    """
+    vectors = reconstruct_all(faiss_store.index)
+    if index_type == INDEX_AUTO:
+        index_type = choose_index_type(len(vectors))
+
+    start = time.perf_counter()
+    if index_type == INDEX_FLAT and index_type_of(faiss_store.index) == INDEX_FLAT:
+        used_type, used_params = INDEX_FLAT, {}
+    else:
+        faiss_store.index, used_type, used_params = build_index(vectors, index_type, params)
+    build_seconds = time.perf_counter() - start
+    logging.info(f"Indice convertito in '{used_type}' ({len(vectors)} vettori) in {build_seconds:.1f}s")
+    return {
+        "index_type": used_type,
+        "params": used_params,
+        "num_vectors": int(faiss_store.index.ntotal),
+        "dimension": int(faiss_store.index.d),
+        "build_seconds": round(build_seconds, 2),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def rebuild_without(faiss_store, ids):
+    """Remove chunks from an HNSW index by rebuilding it over the surviving vectors.
+
+    HNSW has no remove_ids. It stores the raw vectors, so reconstructing them
+    is lossless and the rebuilt graph keeps the same parameters.
+    """
+    ids = set(ids)
+    index = faiss_store.index
+    kept = [(position, docstore_id) for position, docstore_id in sorted(faiss_store.index_to_docstore_id.items())
+            if docstore_id not in ids]
+    vectors = reconstruct_all(index)[[position for position, _ in kept]] if kept else np.zeros((0, index.d), np.float32)
+
+    index_type = index_type_of(index)
+    params = {}
+    if index_type == INDEX_HNSW:
+        params = {"M": index.hnsw.nb_neighbors(1), "efConstruction": index.hnsw.efConstruction,
+                  "efSearch": index.hnsw.efSearch}
+    faiss_store.index, _, _ = build_index(np.ascontiguousarray(vectors, dtype=np.float32), index_type, params)
+    faiss_store.docstore.delete(list(ids))
+    faiss_store.index_to_docstore_id = {new_position: docstore_id for new_position, (_, docstore_id) in enumerate(kept)}
+
+
+def remove_from_ivf(faiss_store, ids):
+    """Remove chunks from an IVF or IVF-PQ index in place, keeping the stored codes.
+
+    remove_ids leaves the surviving vectors with their original labels, while
+    index_to_docstore_id must stay 0..n-1: the labels in the inverted lists are
+    renumbered in place and the direct map rebuilt. Nothing is re-quantized, so
+    IVF-PQ recall does not degrade with each deletion.
+    """
+    import faiss
+
+    ids = set(ids)
+    index = faiss_store.index
+    invlists = index.invlists
+    if not isinstance(faiss.downcast_InvertedLists(invlists), faiss.ArrayInvertedLists):
+        raise ValueError("Le liste dell'indice IVF non sono modificabili: ricrea l'indice dai documenti")
+
+    items = sorted(faiss_store.index_to_docstore_id.items())
+    removed = np.array([position for position, docstore_id in items if docstore_id in ids], dtype=np.int64)
+    kept = [(position, docstore_id) for position, docstore_id in items if docstore_id not in ids]
+    kept_positions = np.array([position for position, _ in kept], dtype=np.int64)
+
+    prepare_index(index)
+    index.remove_ids(removed)
+    for list_no in range(index.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            # Vista numpy sulle etichette della lista: la nuova etichetta è il rango tra i sopravvissuti
+            labels = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+            labels[:] = np.searchsorted(kept_positions, labels)
+    index.set_direct_map_type(faiss.DirectMap.NoMap)
+    prepare_index(index)
+
+    faiss_store.docstore.delete(list(ids))
+    faiss_store.index_to_docstore_id = {new_position: docstore_id for new_position, (_, docstore_id) in enumerate(kept)}
+
+
+def write_index_meta(folder, meta):
+    path = os.path.join(folder, INDEX_META_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as meta_file:
+        json.dump(meta, meta_file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_index_meta(folder):
+    """Return the index metadata (an exact flat index is assumed for older indices)."""
+    path = os.path.join(folder, INDEX_META_FILE)
+    if not os.path.exists(path):
+        return {"index_type": INDEX_FLAT, "params": {}}
+    with open(path, "r", encoding="utf-8") as meta_file:
+        return json.load(meta_file)
+
+
+def update_index_meta(folder, faiss_store):
+    """Refresh the vector count of the metadata after documents are added or removed."""
+    meta = read_index_meta(folder)
+    meta["index_type"] = index_type_of(faiss_store.index)
+    meta["num_vectors"] = int(faiss_store.index.ntotal)
+    meta["dimension"] = int(faiss_store.index.d)
+    write_index_meta(folder, meta)
+
+
+def benchmark_index_types(faiss_store, index_types=INDEX_TYPES, num_queries=100, k=10):
+    """Measure recall@k against exact search, search latency, build time and size of each index type.
+
+    The queries are vectors sampled from the index itself with a small perturbation.
+    """
+    import faiss
+
+    vectors = reconstruct_all(faiss_store.index)
+    num_vectors = len(vectors)
+    if num_vectors == 0:
+        return []
+    k = min(k, num_vectors)
+    rng = np.random.default_rng(0)
+    sample = rng.choice(num_vectors, size=min(num_queries, num_vectors), replace=False)
+    noise = rng.normal(scale=vectors.std() * 0.1, size=(len(sample), vectors.shape[1]))
+    queries = (vectors[sample] + noise).astype(np.float32)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index, used_type, params = build_index(vectors, index_type)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query[None, :], k)
+        latency = (time.perf_counter() - start) / len(queries)
+
+        _, found = index.search(queries, k)
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+        results.append({
+            "tipo": used_type,
+            f"recall@{k}": round(float(recall), 3),
+            "latenza (ms)": round(latency * 1000, 3),
+            "costruzione (s)": round(build_seconds, 2),
+            "dimensione (MB)": round(len(faiss.serialize_index(index)) / (1024 * 1024), 1),
+            "parametri": json.dumps(params),
+        })
+    return results
@@ -0,0 +1,126 @@
+# answer_cache.py
+
+import os
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from utils.faiss_store import index_signature
+from utils.retrieval import RETRIEVAL_MMR
+
+# Risposte memorizzate per indice, oltre questo numero si eliminano le meno usate
+MAX_ANSWERS_PER_INDEX = int(os.getenv("EDURAG_ANSWER_CACHE_SIZE", "500"))
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+# Cache condivisa da tutte le sessioni: percorso assoluto dell'indice -> risposte
+_indices = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _index_entry(key, signature):
+    """Return the answers of an index, dropping them if the index changed on disk (lock held)."""
+    entry = _indices.get(key)
+    if entry is not None and entry["signature"] != signature:
+        del _indices[key]
+        _stats["invalidations"] += 1
+        logging.info(f"Cache semantica di '{key}' invalidata: indice modificato")
+        entry = None
+    if entry is None:
+        entry = {"signature": signature, "answers": OrderedDict(), "next_id": 0}
+        _indices[key] = entry
+    return entry
+
+
+def _settings_match(answer, model_name, temperature, similarity_k, retrieval_mode, credential):
+    return (
+        answer["credential"] == credential
+        and answer["model"] == model_name
+        and answer["temperature"] == temperature
+        and answer["similarity_k"] == similarity_k
+        and answer["retrieval_mode"] == retrieval_mode
+    )
+
+
+def lookup_answer(index_folder, query_vector, model_name, temperature, similarity_k, threshold,
+                  retrieval_mode=RETRIEVAL_MMR, credential=None):
+    """Return (answer, documents, similarity) of the most similar previous question, or None.
+
+    Only questions asked with the same model, temperature, number of chunks, retrieval mode and
+    credential (the credential_hash() of the API key) are considered, and only if their cosine
+    similarity reaches the threshold: answers are never shared between different API keys.
+    """
+    key = os.path.abspath(index_folder)
+    signature = index_signature(index_folder)
+    query_vector = _normalize(query_vector)
+
+    with _lock:
+        answers = _index_entry(key, signature)["answers"]
+        candidates = [
+            (answer_id, answer) for answer_id, answer in answers.items()
+            if _settings_match(answer, model_name, temperature, similarity_k, retrieval_mode, credential)
+        ]
+        if candidates:
+            similarities = np.stack([answer["vector"] for _, answer in candidates]) @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= threshold:
+                answer_id, answer = candidates[best]
+                answers.move_to_end(answer_id)
+                answer["hits"] += 1
+                _stats["hits"] += 1
+                return answer["response"], answer["documents"], float(similarities[best])
+        _stats["misses"] += 1
+    return None
+
+
+def store_answer(index_folder, question, query_vector, model_name, temperature, similarity_k, response, documents,
+                 retrieval_mode=RETRIEVAL_MMR, credential=None):
+    """Remember the answer to a question for the next similar questions on the same index and API key."""
+    key = os.path.abspath(index_folder)
+    signature = index_signature(index_folder)
+
+    with _lock:
+        entry = _index_entry(key, signature)
+        entry["answers"][entry["next_id"]] = {
+            "question": question,
+            "vector": _normalize(query_vector),
+            "model": model_name,
+            "temperature": temperature,
+            "similarity_k": similarity_k,
+            "retrieval_mode": retrieval_mode,
+            "credential": credential,
+            "response": response,
+            "documents": documents,
+            "hits": 0,
+        }
+        entry["next_id"] += 1
+        while len(entry["answers"]) > MAX_ANSWERS_PER_INDEX:
+            entry["answers"].popitem(last=False)
+            _stats["evictions"] += 1
+        # Gli indici eliminati o rinominati non tengono occupata la memoria
+        for stale_key in [stale_key for stale_key in _indices if not os.path.exists(stale_key)]:
+            del _indices[stale_key]
+            _stats["invalidations"] += 1
+
+
+def get_answer_cache_stats():
+    """Return global counters and the number of stored answers per index."""
+    with _lock:
+        indices = [
+            {
+                "indice": os.path.basename(key),
+                "risposte": len(entry["answers"]),
+                "riutilizzi": sum(answer["hits"] for answer in entry["answers"].values()),
+            }
+            for key, entry in _indices.items()
+        ]
+        totals = dict(_stats)
+    lookups = totals["hits"] + totals["misses"]
+    totals["hit_rate"] = totals["hits"] / lookups if lookups else 0.0
+    return totals, indices
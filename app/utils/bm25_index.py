@@ -0,0 +1,177 @@
+# bm25_index.py
+
+import os
+import re
+import json
+import math
+import time
+import logging
+import threading
+from collections import Counter
+
+BM25_FILE = "bm25.json"
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Parole troppo frequenti per distinguere i chunk (italiano e inglese)
+STOPWORDS = frozenset("""
+a ad al alla alle allo ai agli all che chi ci con da dal dalla dalle dallo dai dagli de del della delle dello dei
+degli di e ed è gli i il in la le lo l ma ne nei nel nella nelle nello negli o per più se si sia sono su sul
+sulla sulle sullo sui sugli tra fra un una uno non come anche questo questa questi queste quello quella
+the of and or to in on for with is are be by an as at from that this it
+""".split())
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# Indici lessicali caricati, condivisi dalle sessioni: percorso assoluto -> BM25Index
+_loaded = {}
+_loaded_lock = threading.Lock()
+_load_locks = {}
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords; numbers and acronyms are kept."""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring over the chunks of a FAISS index, keyed by docstore id."""
+
+    def __init__(self, postings=None, doc_lengths=None):
+        self.postings = postings or {}  # termine -> {docstore_id: frequenza}
+        self.doc_lengths = doc_lengths or {}  # docstore_id -> numero di token
+        self.total_length = sum(self.doc_lengths.values())
+        self.mtime = None
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add_documents(self, items):
+        """Index (docstore_id, text) pairs."""
+        for docstore_id, text in items:
+            tokens = tokenize(text)
+            if docstore_id in self.doc_lengths:
+                self.remove([docstore_id])
+            self.doc_lengths[docstore_id] = len(tokens)
+            self.total_length += len(tokens)
+            for term, frequency in Counter(tokens).items():
+                self.postings.setdefault(term, {})[docstore_id] = frequency
+
+    def remove(self, ids):
+        """Remove chunks from the index."""
+        ids = set(ids) & set(self.doc_lengths)
+        if not ids:
+            return
+        for docstore_id in ids:
+            self.total_length -= self.doc_lengths.pop(docstore_id)
+        for term in list(self.postings):
+            documents = self.postings[term]
+            for docstore_id in ids & documents.keys():
+                del documents[docstore_id]
+            if not documents:
+                del self.postings[term]
+
+    def search(self, query, k):
+        """Return the k best (docstore_id, score) pairs for the query."""
+        if not self.doc_lengths:
+            return []
+        num_docs = len(self.doc_lengths)
+        average_length = self.total_length / num_docs or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+            idf = math.log(1 + (num_docs - len(documents) + 0.5) / (len(documents) + 0.5))
+            for docstore_id, frequency in documents.items():
+                length_norm = 1 - BM25_B + BM25_B * self.doc_lengths[docstore_id] / average_length
+                scores[docstore_id] = scores.get(docstore_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (
+                    frequency + BM25_K1 * length_norm
+                )
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, folder):
+        """Write the index to folder/bm25.json (atomically) and share it with the sessions."""
+        self._write(folder)
+        with _loaded_lock:
+            _loaded[os.path.abspath(folder)] = self
+
+    def _write(self, folder):
+        path = os.path.join(folder, BM25_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as bm25_file:
+            json.dump({"doc_lengths": self.doc_lengths, "postings": self.postings}, bm25_file, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        self.mtime = os.stat(path).st_mtime_ns
+
+    @classmethod
+    def load(cls, folder):
+        path = os.path.join(folder, BM25_FILE)
+        with open(path, "r", encoding="utf-8") as bm25_file:
+            data = json.load(bm25_file)
+        index = cls(data["postings"], data["doc_lengths"])
+        index.mtime = os.stat(path).st_mtime_ns
+        return index
+
+    @classmethod
+    def from_faiss(cls, faiss_index):
+        """Build the lexical index of the chunks already in a FAISS index."""
+        index = cls()
+        index.add_documents(
+            (docstore_id, faiss_index.docstore.search(docstore_id).page_content)
+            for docstore_id in faiss_index.index_to_docstore_id.values()
+        )
+        return index
+
+
+def load_lexical_index(folder, faiss_index):
+    """Return a private, modifiable BM25 index matching the chunks of faiss_index.
+
+    Indices created before the lexical index existed (or modified without
+    updating it) get it rebuilt from the docstore and saved.
+    """
+    index = None
+    if os.path.exists(os.path.join(folder, BM25_FILE)):
+        try:
+            index = BM25Index.load(folder)
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Indice BM25 di '{folder}' non leggibile: {e}")
+    if index is None or len(index) != len(faiss_index.index_to_docstore_id):
+        start = time.perf_counter()
+        index = BM25Index.from_faiss(faiss_index)
+        logging.info(f"Indice BM25 di '{folder}' costruito in {time.perf_counter() - start:.2f}s")
+        try:
+            index._write(folder)
+        except OSError as e:
+            logging.error(f"Impossibile salvare l'indice BM25 di '{folder}': {e}")
+    return index
+
+
+def get_lexical_index(folder, faiss_index):
+    """Return the shared, read-only BM25 index of an index folder, loading or building it if needed."""
+    key = os.path.abspath(folder)
+    path = os.path.join(folder, BM25_FILE)
+
+    def valid(index):
+        return (
+            index is not None
+            and os.path.exists(path)
+            and index.mtime == os.stat(path).st_mtime_ns
+            and len(index) == len(faiss_index.index_to_docstore_id)
+        )
+
+    with _loaded_lock:
+        index = _loaded.get(key)
+        if valid(index):
+            return index
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # Un solo caricamento per indice, senza bloccare le ricerche sugli altri indici
+    with load_lock:
+        with _loaded_lock:
+            index = _loaded.get(key)
+        if valid(index):
+            return index
+        index = load_lexical_index(folder, faiss_index)
+        with _loaded_lock:
+            _loaded[key] = index
+        return index
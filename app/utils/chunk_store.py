@@ -0,0 +1,217 @@
+# chunk_store.py
+
+import os
+import json
+import sqlite3
+import threading
+from collections.abc import Mapping
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.document import Document
+
+CHUNK_STORE_FILE = "chunks.sqlite"
+# Porzione del file mappata in memoria: le pagine lette restano nella page cache, condivise tra processi
+MMAP_BYTES = int(os.getenv("EDURAG_CHUNK_STORE_MMAP_MB", "1024")) * 1024 * 1024
+WRITE_BATCH_SIZE = 1000
+# Parametri per query IN (...): le versioni di SQLite precedenti alla 3.32 ne accettano al massimo 999
+READ_BATCH_SIZE = 900
+
+
+class StaleChunkStoreError(RuntimeError):
+    """The chunk store on disk no longer belongs to the loaded vectors."""
+
+
+def _not_found(docstore_id):
+    # Stesso messaggio di InMemoryDocstore: i chiamanti controllano isinstance(doc, str)
+    return f"ID {docstore_id} not found."
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Read-only chunk store backed by chunks.sqlite, with in-memory pending changes.
+
+    Opening is constant time: chunks are read only when searched. Added and
+    deleted chunks are kept in memory until the index is saved with
+    write_chunk_store(), so the file on disk is never modified in place.
+
+    With a generation, every new connection checks that the file is still the
+    one the index was loaded with: if it was replaced in the meantime (the
+    vectors in memory belong to the old pair) StaleChunkStoreError is raised.
+    """
+
+    def __init__(self, path, generation=None):
+        self.path = path
+        self.generation = generation
+        self._local = threading.local()
+        self._added = {}
+        self._deleted = set()
+
+    def _connection(self):
+        # sqlite3 non condivide le connessioni tra thread: una connessione in sola lettura per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            connection.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+            if self.generation is not None and _read_stamp(connection).get("generation") != self.generation:
+                connection.close()
+                raise StaleChunkStoreError(f"{self.path} è stato sostituito dopo il caricamento dell'indice")
+            self._local.connection = connection
+        return connection
+
+    def search(self, search):
+        if search in self._added:
+            return self._added[search]
+        if search in self._deleted:
+            return _not_found(search)
+        row = self._connection().execute(
+            "SELECT page_content, metadata FROM chunks WHERE docstore_id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return _not_found(search)
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def mget(self, ids):
+        """Return the documents of several ids with one query per batch (None for missing ids)."""
+        found = {docstore_id: self._added[docstore_id] for docstore_id in ids if docstore_id in self._added}
+        stored = [docstore_id for docstore_id in ids if docstore_id not in found and docstore_id not in self._deleted]
+        for start in range(0, len(stored), READ_BATCH_SIZE):
+            batch = stored[start:start + READ_BATCH_SIZE]
+            rows = self._connection().execute(
+                f"SELECT docstore_id, page_content, metadata FROM chunks WHERE docstore_id IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            for docstore_id, page_content, metadata in rows:
+                found[docstore_id] = Document(page_content=page_content, metadata=json.loads(metadata))
+        return [found.get(docstore_id) for docstore_id in ids]
+
+    def add(self, texts):
+        existing = [docstore_id for docstore_id, document in zip(texts, self.mget(list(texts))) if document is not None]
+        if existing:
+            raise ValueError(f"Tried to add ids that already exist: {set(existing)}")
+        self._added.update(texts)
+        self._deleted.difference_update(texts)
+
+    def delete(self, ids):
+        for docstore_id in ids:
+            self._added.pop(docstore_id, None)
+            self._deleted.add(docstore_id)
+
+    def iter_metadata(self):
+        """Yield (docstore_id, metadata) of every chunk without reading the texts."""
+        for docstore_id, metadata in self._connection().execute("SELECT docstore_id, metadata FROM chunks"):
+            if docstore_id not in self._deleted and docstore_id not in self._added:
+                yield docstore_id, json.loads(metadata)
+        for docstore_id, document in list(self._added.items()):
+            yield docstore_id, document.metadata
+
+    def ids_by_title(self, titles):
+        """Return the ids of the chunks of the given document titles."""
+        titles = list(titles)
+        rows = self._connection().execute(
+            f"SELECT docstore_id FROM chunks WHERE title IN ({','.join('?' * len(titles))})", titles
+        ) if titles else []
+        ids = [docstore_id for (docstore_id,) in rows if docstore_id not in self._deleted]
+        ids += [docstore_id for docstore_id, document in self._added.items() if document.metadata.get("title") in titles]
+        return ids
+
+
+class LazyIdMap(Mapping):
+    """Read-only FAISS position -> docstore id map read from chunks.sqlite on demand."""
+
+    def __init__(self, docstore):
+        self._docstore = docstore
+        self._len = None
+
+    def __getitem__(self, position):
+        row = self._docstore._connection().execute(
+            "SELECT docstore_id FROM chunks WHERE position = ?", (int(position),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __iter__(self):
+        for (position,) in self._docstore._connection().execute("SELECT position FROM chunks ORDER BY position"):
+            yield position
+
+    def __len__(self):
+        if self._len is None:
+            self._len = self._docstore._connection().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        return self._len
+
+    def items(self):
+        return list(self._docstore._connection().execute("SELECT position, docstore_id FROM chunks ORDER BY position"))
+
+    def values(self):
+        return [docstore_id for _, docstore_id in self.items()]
+
+
+def _read_stamp(connection):
+    try:
+        return dict(connection.execute("SELECT key, value FROM stamp"))
+    except sqlite3.OperationalError:
+        return {}  # File scritto prima che esistesse il timbro
+
+
+def read_chunk_store_stamp(path):
+    """Return the stamp of a chunks.sqlite: generation and size/mtime of its index.faiss ({} if absent)."""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return _read_stamp(connection)
+    finally:
+        connection.close()
+
+
+def open_chunk_store(folder, lazy=True, generation=None):
+    """Open the chunk store of an index folder.
+
+    Returns (docstore, index_to_docstore_id). With lazy the id map is read from
+    the file on demand (for shared, read-only indices); otherwise it is a dict
+    that FAISS can update when documents are added or removed.
+    """
+    docstore = SQLiteDocstore(os.path.join(folder, CHUNK_STORE_FILE), generation)
+    id_map = LazyIdMap(docstore)
+    return docstore, id_map if lazy else dict(id_map.items())
+
+
+def write_chunk_store(path, docstore, index_to_docstore_id, stamp):
+    """Write the chunks of a FAISS index to a new file at path, in position order.
+
+    stamp (generation, faiss_size, faiss_mtime_ns) ties the file to the
+    index.faiss written with it: the caller renames both into place.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        # File scritto una volta e poi solo letto: nessun journal
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.execute(
+            "CREATE TABLE chunks (position INTEGER PRIMARY KEY, docstore_id TEXT NOT NULL UNIQUE, "
+            "title TEXT, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        connection.execute("CREATE TABLE stamp (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        connection.executemany("INSERT INTO stamp VALUES (?, ?)", [(key, str(value)) for key, value in stamp.items()])
+        items = sorted(index_to_docstore_id.items())
+        for start in range(0, len(items), WRITE_BATCH_SIZE):
+            batch = items[start:start + WRITE_BATCH_SIZE]
+            ids = [docstore_id for _, docstore_id in batch]
+            if isinstance(docstore, SQLiteDocstore):
+                documents = docstore.mget(ids)
+            else:
+                documents = [docstore.search(docstore_id) for docstore_id in ids]
+            rows = []
+            for (position, docstore_id), document in zip(batch, documents):
+                if document is None or isinstance(document, str):
+                    raise ValueError(f"Chunk {docstore_id} assente dal docstore")
+                rows.append((
+                    int(position),
+                    docstore_id,
+                    document.metadata.get("title"),
+                    document.page_content,
+                    json.dumps(document.metadata, ensure_ascii=False, default=str),
+                ))
+            connection.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?)", rows)
+        connection.execute("CREATE INDEX chunks_title ON chunks (title)")
+        connection.commit()
+    finally:
+        connection.close()
@@ -0,0 +1,87 @@
+# concurrent_llm.py
+
+import os
+import time
+import random
+import logging
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Chiamate al modello eseguite in parallelo dai tool di riassunto, configurabile da ambiente
+SUMMARY_CONCURRENCY = int(os.getenv("EDURAG_SUMMARY_CONCURRENCY", "4"))
+RATE_LIMIT_RETRIES = 5
+RATE_LIMIT_BASE_DELAY = 2.0
+
+
+def is_rate_limit_error(error):
+    """Return True for the 429 / rate limit errors of the OpenAI and Anthropic clients."""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    return "ratelimit" in type(error).__name__.lower()
+
+
+def retry_after_seconds(error):
+    """Return the delay suggested by the provider in the Retry-After header, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_backoff(function, *args, **kwargs):
+    """Call function, waiting and retrying with exponential backoff when the provider rate limits."""
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == RATE_LIMIT_RETRIES:
+                raise
+            delay = retry_after_seconds(e) or RATE_LIMIT_BASE_DELAY * 2 ** attempt
+            # Jitter: le chiamate parallele limitate insieme non riprovano tutte nello stesso istante
+            delay *= random.uniform(1.0, 1.5)
+            logging.warning(f"Limite di richieste raggiunto, nuovo tentativo tra {delay:.1f}s")
+            time.sleep(delay)
+
+
+def summarize_chunks(chunks, summarize, max_workers=SUMMARY_CONCURRENCY, on_chunk_done=None):
+    """Summarize every chunk concurrently and return the (summary, error) pairs in chunk order.
+
+    summarize(chunk, prev_chunk, next_chunk) is called for each chunk with the raw
+    neighbouring chunks as context, exactly as the sequential loop did.
+    on_chunk_done(index, summary, error, completed) runs in the calling thread as
+    each call finishes, so it can update Streamlit widgets.
+    """
+    results = [None] * len(chunks)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {}
+        for i, chunk in enumerate(chunks):
+            prev_chunk = chunks[i-1] if i > 0 else ""
+            next_chunk = chunks[i+1] if i < len(chunks) - 1 else ""
+            futures[pool.submit(call_with_backoff, summarize, chunk, prev_chunk, next_chunk)] = i
+
+        for completed, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                results[i] = (future.result(), None)
+            except Exception as e:
+                results[i] = (None, e)
+            if on_chunk_done is not None:
+                on_chunk_done(i, *results[i], completed)
+    return results
+
+
+def show_chunk_progress(num_chunks):
+    """Return an on_chunk_done callback that shows the progress of the chunk summaries as they complete."""
+    progress_bar = st.progress(0.0, text=f"Riassunto dei blocchi: 0/{num_chunks}")
+    chunk_status = st.empty()
+    completed_chunks = []
+
+    def on_chunk_done(i, summary, error, completed):
+        logging.info(f"Blocco {i+1} riassunto {'con errore' if error else 'con successo'}.")
+        completed_chunks.append(f"{i+1}{' (errore)' if error else ''}")
+        progress_bar.progress(completed / num_chunks, text=f"Riassunto dei blocchi: {completed}/{num_chunks}")
+        chunk_status.caption("Blocchi completati: " + ", ".join(completed_chunks))
+
+    return on_chunk_done
@@ -0,0 +1,19 @@
+# credentials.py
+
+import hashlib
+
+
+def credential_hash(model):
+    """Return a short, non-reversible fingerprint of the provider and API key of a chat model.
+
+    Shared caches and jobs include it in their keys, so that answers generated
+    with one user's key are never served to, or billed to, another user.
+    """
+    secret = None
+    for attribute in ("openai_api_key", "anthropic_api_key", "api_key"):
+        secret = getattr(model, attribute, None)
+        if secret is not None:
+            break
+    if hasattr(secret, "get_secret_value"):
+        secret = secret.get_secret_value()
+    return hashlib.sha256(f"{type(model).__name__}:{secret or ''}".encode("utf-8")).hexdigest()[:16]
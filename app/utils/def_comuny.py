@@ -1,14 +1,22 @@
 import os
+import time
+import logging
 import streamlit as st
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.vectorstores import FAISS
+from utils.faiss_store import get_cached_index, invalidate_index, save_index
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.runnables import RunnablePassthrough
 from sidebar.sidebar_config import sidebar_c  # Import the sidebar configuration function
 from prompt.prompt_config import get_chat_prompt_template  # Importa il modulo del prompt
 from utils.openai_m import openai_m
+from utils.retrieval import retrieve_documents, retrieve_federated, embed_query, RETRIEVAL_MMR, RETRIEVAL_HYBRID
+from utils.bm25_index import get_lexical_index
+from utils.answer_cache import lookup_answer, store_answer
+from utils.query_coalescing import query_key, start_query_job
+from utils.credentials import credential_hash
 
 
 def init_session_state():
@@ -19,6 +27,8 @@ def init_session_state():
         "user_query",
         "last_response",
         "formatted_context",
+        "last_timings",
+        "audio_job",
         "user_api_key",
         "model_choice",
     ]
@@ -49,13 +59,14 @@ def get_faiss_index(cartella, embeddings, splits=None):
     index_path = os.path.join(cartella, "index.faiss")
     if os.path.exists(cartella) and os.path.exists(index_path):
         try:
-            return FAISS.load_local(cartella, embeddings, allow_dangerous_deserialization=True)
+            return get_cached_index(cartella, embeddings)
         except Exception as e:
             st.error(f"Errore durante il caricamento dell'indice FAISS: {e}")
             return None
     elif splits is not None:
         faiss_index = FAISS.from_documents(splits, embeddings)
-        faiss_index.save_local(cartella)
+        save_index(faiss_index, cartella)
+        invalidate_index(cartella)
         return faiss_index
     else:
         st.error("Non ci sono dati disponibili per creare l'indice FAISS.")
@@ -70,28 +81,204 @@ def build_rag_chain(prompt, model, retriever):
     } | prompt | model | StrOutputParser()
 
 
+def build_answer_chain(prompt, model):
+    """Create the chain that answers from already retrieved documents."""
+    return prompt | model | StrOutputParser()
+
+
+def answer_query(question, faiss_index, prompt, model, similarity_k, timings=None, placeholder=None,
+                 index_folder=None, cache_threshold=None, retrieval_mode=RETRIEVAL_MMR):
+    """Retrieve the documents once and use them both for the prompt and the sources.
+
+    retrieval_mode is RETRIEVAL_MMR (vector search with MMR rerank) or
+    RETRIEVAL_HYBRID (BM25 and vector rankings fused; needs index_folder).
+
+    With index_folder and a cache_threshold below 1, a previous answer to a similar
+    question on the same index (same model, temperature, k, retrieval mode and API key) is returned instead.
+    With index_folder, sessions asking the identical question with the same API key at the same time share
+    one retrieval and one generation, and all of them receive the same tokens.
+    """
+    if timings is None:
+        timings = {}
+
+    model_name = getattr(model, "model_name", None) or getattr(model, "model", "")
+    temperature = getattr(model, "temperature", None)
+    credential = credential_hash(model)
+    use_cache = index_folder is not None and cache_threshold is not None and cache_threshold < 1.0
+    lexical_index = None
+    if retrieval_mode == RETRIEVAL_HYBRID and index_folder is not None:
+        lexical_index = get_lexical_index(index_folder, faiss_index)
+    query_vector = None
+    if use_cache:
+        start = time.perf_counter()
+        query_vector = embed_query(faiss_index, question)
+        timings["embed"] = time.perf_counter() - start
+        cached = lookup_answer(index_folder, query_vector, model_name, temperature, similarity_k, cache_threshold,
+                               retrieval_mode, credential)
+        if cached is not None:
+            response, documents, similarity = cached
+            timings["cache_similarity"] = similarity
+            logging.info(f"Risposta riusata dalla cache semantica (similarità {similarity:.3f})")
+            return response, documents
+
+    if index_folder is None:
+        documents = retrieve_documents(faiss_index, question, similarity_k, timings, query_vector=query_vector,
+                                       lexical_index=lexical_index)
+        answer_chain = build_answer_chain(prompt, model)
+        response = query_stream(
+            {"context": documents, "question": question}, answer_chain, timings, placeholder
+        )
+        logging.info(f"Tempi della query: {format_timings(timings)}")
+        return response, documents
+
+    def run(job):
+        job.set_documents(
+            retrieve_documents(faiss_index, question, similarity_k, job.timings, query_vector=query_vector,
+                               lexical_index=lexical_index)
+        )
+        answer_chain = build_answer_chain(prompt, model)
+        for chunk in answer_chain.stream({"context": job.documents, "question": question}):
+            job.add_chunk(chunk)
+        if use_cache and job.text().strip():
+            store_answer(index_folder, question, query_vector, model_name, temperature, similarity_k,
+                         job.text(), job.documents, retrieval_mode, credential)
+
+    key = query_key(index_folder, question, model_name, temperature, similarity_k, retrieval_mode, credential)
+    job, coalesced = start_query_job(key, run)
+    documents = job.wait_documents()
+    for stage, seconds in job.timings.items():
+        timings.setdefault(stage, seconds)
+    response = render_stream(job.iter_chunks(), timings, placeholder)
+    if coalesced:
+        timings["coalesced"] = True
+
+    logging.info(f"Tempi della query: {format_timings(timings)}")
+    return response, documents
+
+
+def answer_federated_query(question, index_folders, embeddings, prompt, model, similarity_k, timings=None,
+                           placeholder=None, retrieval_mode=RETRIEVAL_MMR):
+    """Answer a question from several indices at once with one combined context.
+
+    The indices are searched in parallel and the best similarity_k chunks overall,
+    each tagged with its source index, are sent to the model in a single prompt.
+    Identical concurrent questions on the same set of indices share one job;
+    the semantic answer cache is per index and is not used here.
+    """
+    if timings is None:
+        timings = {}
+
+    indices = []
+    for index_folder in index_folders:
+        faiss_index = get_faiss_index(index_folder, embeddings)
+        if faiss_index is None:
+            raise ValueError(f"Impossibile caricare l'indice '{os.path.basename(index_folder)}'")
+        lexical_index = get_lexical_index(index_folder, faiss_index) if retrieval_mode == RETRIEVAL_HYBRID else None
+        indices.append((os.path.basename(index_folder), faiss_index, lexical_index))
+
+    model_name = getattr(model, "model_name", None) or getattr(model, "model", "")
+    temperature = getattr(model, "temperature", None)
+
+    def run(job):
+        job.set_documents(retrieve_federated(indices, question, similarity_k, job.timings,
+                                             retrieval_mode=retrieval_mode))
+        answer_chain = build_answer_chain(prompt, model)
+        for chunk in answer_chain.stream({"context": job.documents, "question": question}):
+            job.add_chunk(chunk)
+
+    key = query_key(list(index_folders), question, model_name, temperature, similarity_k, retrieval_mode,
+                    credential_hash(model))
+    job, coalesced = start_query_job(key, run)
+    documents = job.wait_documents()
+    for stage, seconds in job.timings.items():
+        timings.setdefault(stage, seconds)
+    response = render_stream(job.iter_chunks(), timings, placeholder)
+    if coalesced:
+        timings["coalesced"] = True
+
+    logging.info(f"Tempi della query su {len(indices)} indici: {format_timings(timings)}")
+    return response, documents
+
+
+def format_timings(timings):
+    """Format the per-stage timings of a query."""
+    labels = [
+        ("embed", "embedding"),
+        ("search", "ricerca"),
+        ("mmr", "rerank MMR"),
+        ("bm25", "BM25"),
+        ("fusion", "fusione"),
+        ("llm_first_token", "primo token"),
+        ("llm_total", "LLM totale"),
+    ]
+    formatted = " - ".join(
+        f"{label}: {timings[key] * 1000:.0f} ms" for key, label in labels if key in timings
+    )
+    if timings.get("coalesced"):
+        formatted += " - risposta condivisa con una domanda identica già in corso"
+    if "cache_similarity" in timings:
+        formatted += f" - risposta dalla cache semantica (similarità {timings['cache_similarity']:.0%})"
+    return formatted
+
+
 def format_documents(all_documents):
     """Format retrieved documents for output."""
     formatted_docs = []
     for doc in all_documents:
         source = doc.metadata.get("title", "Sconosciuto")
         page = doc.metadata.get("page_number", "Sconosciuta")
+        # Nelle ricerche su più indici ogni chunk indica l'indice da cui proviene
+        index_name = f"Indice: {doc.metadata['indice']}, " if "indice" in doc.metadata else ""
 
         # Add relevant sections
         formatted_docs.append(
-            f"Fonte: {source}, Pagina: {page}\n\n...{doc.page_content}..."
+            f"{index_name}Fonte: {source}, Pagina: {page}\n\n...{doc.page_content}..."
         )
     return "\n\n---------------------------\n\n".join(formatted_docs)
 
 
-def query_stream(query, rag_chain):
-    """Execute the query and return the response as a stream."""
+def query_stream(query, rag_chain, timings=None, placeholder=None):
+    """Execute the query and return the response as a stream.
+
+    If a placeholder (st.empty()) is given, the tokens are rendered as they arrive.
+    """
+    return render_stream(rag_chain.stream(query), timings, placeholder)
+
+
+def render_stream(chunks, timings=None, placeholder=None):
+    """Consume a stream of tokens, timing it and rendering it in the placeholder if given."""
     response = ""
-    for chunk in rag_chain.stream(query):
+    first_token = None
+    last_render = 0.0
+    start = time.perf_counter()
+    for chunk in chunks:
+        now = time.perf_counter()
+        if first_token is None:
+            first_token = now - start
+            logging.info(f"Primo token ricevuto dopo {first_token * 1000:.0f} ms")
+            if timings is not None:
+                timings["llm_first_token"] = first_token
         response += chunk
+
+        # Limita i ridisegni della pagina a circa 20 al secondo
+        if placeholder is not None and now - last_render >= 0.05:
+            render_partial_response(placeholder, response, first_token)
+            last_render = now
+
+    if timings is not None:
+        timings["llm_total"] = time.perf_counter() - start
+    if placeholder is not None and first_token is not None:
+        render_partial_response(placeholder, response, first_token, done=True)
     return response
 
 
+def render_partial_response(placeholder, response, first_token, done=False):
+    """Render the response received so far with the time to first token."""
+    with placeholder.container():
+        st.caption(f"Primo token dopo {first_token * 1000:.0f} ms")
+        st.markdown(response if done else response + "▌")
+
+
 def add_interaction(domanda, risposta, temperatura, similarity_k, Indice, fonte):
     """Add an interaction to the list of interactions."""
     st.session_state.interazioni.append(
@@ -130,6 +317,8 @@ def display_current_interaction(temperature, similarity_k, Indice, formatted_con
     st.write("-----------------------------")
     st.write(f"**Domanda:** {st.session_state.interazioni[-1]['domanda']}")
     st.write(f"**Risposta:** {st.session_state.last_response}")
+    if st.session_state.last_timings:
+        st.caption(f"Tempi: {format_timings(st.session_state.last_timings)}")
     
     # Aggiunta del toggle per mostrare/nascondere i chunk
     show_chunks = st.checkbox("Mostra i dettagli dei chunk", value=True)
@@ -142,6 +331,40 @@ def display_current_interaction(temperature, similarity_k, Indice, formatted_con
         st.write("Dettagli dei chunk nascosti. Utilizza il toggle per mostrarli.")
 
 
+def display_answer_audio():
+    """Display the audio of the last answer, polling its background job until it is ready."""
+    job = st.session_state.get("audio_job")
+    if not job:
+        return
+
+    if job.status == "running":
+        poll_audio_job()
+    elif job.status == "error":
+        st.error(f"Si è verificato un errore durante la generazione dell'audio: {job.error}")
+    else:
+        try:
+            audio_bytes = job.audio_bytes()
+        except FileNotFoundError:
+            st.warning("L'audio non è più disponibile nella cache.")
+            return
+        st.audio(audio_bytes, format="audio/mp3")
+        st.download_button(
+            label="Scarica l'audio",
+            data=audio_bytes,
+            file_name="audio.mp3",
+            mime="audio/mp3"
+        )
+
+
+@st.fragment(run_every=1)
+def poll_audio_job():
+    """Show the synthesis progress; rerun the page once the audio is ready."""
+    job = st.session_state.get("audio_job")
+    if not job or job.status != "running":
+        st.rerun()
+    st.info(f"Generazione dell'audio in corso... ({job.bytes_ready() // 1024} KB pronti)")
+
+
 def display_interaction_history():
     """Display the interaction history."""
     st.write("### Storico delle conversazioni")
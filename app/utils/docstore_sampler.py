@@ -0,0 +1,95 @@
+# docstore_sampler.py
+
+import random
+import threading
+import weakref
+
+# Modalità di campionamento: chunk uniformi, documenti uniformi, pagine uniformi
+STRATIFY_NONE = "chunk"
+STRATIFY_DOCUMENT = "documento"
+STRATIFY_PAGE = "pagina"
+# Tentativi di estrazione prima di calcolare esplicitamente i chunk non ancora usati
+MAX_REJECTIONS = 32
+
+# Strati calcolati una volta per indice caricato: spariscono con l'indice
+_strata = weakref.WeakKeyDictionary()
+_strata_lock = threading.Lock()
+
+
+def _build_strata(faiss_index):
+    """Group the docstore ids of an index by document and by (document, page)."""
+    ids = list(faiss_index.index_to_docstore_id.values())
+    if hasattr(faiss_index.docstore, "iter_metadata"):
+        # Chunk store su disco: si leggono solo i metadati, non i testi
+        metadata_by_id = faiss_index.docstore.iter_metadata()
+    else:
+        metadata_by_id = ((docstore_id, faiss_index.docstore.search(docstore_id).metadata) for docstore_id in ids)
+    by_document = {}
+    by_page = {}
+    for docstore_id, metadata in metadata_by_id:
+        title = metadata.get("title", "Sconosciuto")
+        page = metadata.get("page_number", "Sconosciuta")
+        by_document.setdefault(title, []).append(docstore_id)
+        by_page.setdefault((title, page), []).append(docstore_id)
+    # Nessun gruppo vuoto: un indice senza chunk non ha gruppi da cui estrarre
+    return {
+        STRATIFY_NONE: [ids] if ids else [],
+        STRATIFY_DOCUMENT: list(by_document.values()),
+        STRATIFY_PAGE: list(by_page.values()),
+    }
+
+
+def _get_strata(faiss_index):
+    with _strata_lock:
+        strata = _strata.get(faiss_index)
+        if strata is None or sum(len(group) for group in strata[STRATIFY_NONE]) != len(faiss_index.index_to_docstore_id):
+            strata = _build_strata(faiss_index)
+            _strata[faiss_index] = strata
+        return strata
+
+
+def sample_chunk_ids(faiss_index, n=1, stratify=STRATIFY_NONE, exclude=None):
+    """Draw n distinct docstore ids directly from the index, without any vector search.
+
+    With stratify a document (or a page) is drawn first and then one of its chunks,
+    so long documents do not dominate. Ids in exclude are not drawn while other
+    chunks remain; if every chunk is excluded the draw starts again from all of them.
+    """
+    groups = _get_strata(faiss_index)[stratify]
+    if not groups:
+        return []
+    exclude = set(exclude or ())
+    drawn = []
+    for _ in range(n):
+        docstore_id = _draw(groups, exclude)
+        if docstore_id is None:
+            exclude = set(drawn)
+            docstore_id = _draw(groups, exclude)
+            if docstore_id is None:
+                break
+        drawn.append(docstore_id)
+        exclude.add(docstore_id)
+    return drawn
+
+
+def _draw(groups, exclude):
+    # Estrazione O(1) con rifiuto: finché i chunk usati sono pochi basta un tentativo
+    for _ in range(MAX_REJECTIONS):
+        group = random.choice(groups)
+        docstore_id = group[random.randrange(len(group))]
+        if docstore_id not in exclude:
+            return docstore_id
+    remaining_groups = [
+        remaining for remaining in ([i for i in group if i not in exclude] for group in groups) if remaining
+    ]
+    if not remaining_groups:
+        return None
+    return random.choice(random.choice(remaining_groups))
+
+
+def sample_documents(faiss_index, n=1, stratify=STRATIFY_NONE, exclude=None):
+    """Return (docstore_id, document) pairs drawn with sample_chunk_ids()."""
+    return [
+        (docstore_id, faiss_index.docstore.search(docstore_id))
+        for docstore_id in sample_chunk_ids(faiss_index, n, stratify, exclude)
+    ]
@@ -0,0 +1,191 @@
+# embedding_cache.py
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+
+EMBEDDING_CACHE_PATH = "app/cache/embeddings.sqlite"
+MAX_EMBEDDING_CACHE_BYTES = int(os.getenv("EDURAG_EMBEDDING_CACHE_MB", "1024")) * 1024 * 1024
+
+_write_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+def model_key(embeddings):
+    """Return the cache key of an embedding model: name plus encode settings."""
+    encode_kwargs = getattr(embeddings, "encode_kwargs", {}) or {}
+    settings = ",".join(f"{k}={v}" for k, v in sorted(encode_kwargs.items()) if k != "batch_size")
+    return f"{embeddings.model_name}|{settings}"
+
+
+def text_hash(text):
+    """Hash of the normalized text: whitespace differences do not change the tokens."""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _connect():
+    os.makedirs(os.path.dirname(EMBEDDING_CACHE_PATH), exist_ok=True)
+    connection = sqlite3.connect(EMBEDDING_CACHE_PATH, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    with _schema_lock:
+        if EMBEDDING_CACHE_PATH not in _schema_ready:
+            _create_schema(connection)
+            _schema_ready.add(EMBEDDING_CACHE_PATH)
+    return connection
+
+
+def _create_schema(connection):
+    # Dimensione totale tenuta aggiornata dai trigger: l'eviction non somma l'intera tabella a ogni scrittura
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "last_access REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_size ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL, entries INTEGER NOT NULL)"
+        )
+        # Cache create prima del contatore: il totale viene calcolato una sola volta
+        connection.execute(
+            "INSERT INTO cache_size SELECT 0, COALESCE(SUM(LENGTH(vector)), 0), COUNT(*) FROM embeddings "
+            "WHERE NOT EXISTS (SELECT 1 FROM cache_size)"
+        )
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_size_insert AFTER INSERT ON embeddings BEGIN "
+            "UPDATE cache_size SET bytes = bytes + LENGTH(NEW.vector), entries = entries + 1; END"
+        )
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_size_delete AFTER DELETE ON embeddings BEGIN "
+            "UPDATE cache_size SET bytes = bytes - LENGTH(OLD.vector), entries = entries - 1; END"
+        )
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_size_update AFTER UPDATE OF vector ON embeddings BEGIN "
+            "UPDATE cache_size SET bytes = bytes + LENGTH(NEW.vector) - LENGTH(OLD.vector); END"
+        )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def get_many(model, hashes):
+    """Return {text_hash: vector} for the hashes already in the cache."""
+    found = {}
+    if not hashes:
+        return found
+    connection = _connect()
+    try:
+        unique = list(set(hashes))
+        # SQLite limita il numero di parametri per query
+        for start in range(0, len(unique), 500):
+            part = unique[start:start + 500]
+            rows = connection.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                f"AND text_hash IN ({','.join('?' * len(part))})",
+                [model, *part],
+            ).fetchall()
+            for hash_, vector in rows:
+                found[hash_] = np.frombuffer(vector, dtype=np.float32).tolist()
+        if found:
+            with _write_lock, connection:
+                connection.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(time.time(), model, hash_) for hash_ in found],
+                )
+    finally:
+        connection.close()
+    return found
+
+
+def put_many(model, items):
+    """Store (text_hash, vector) pairs and evict the oldest entries beyond the size limit."""
+    if not items:
+        return
+    now = time.time()
+    connection = _connect()
+    try:
+        with _write_lock, connection:
+            connection.executemany(
+                # Upsert e non INSERT OR REPLACE: la cancellazione implicita di REPLACE non attiva i trigger
+                "INSERT INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (model, text_hash) DO UPDATE SET vector = excluded.vector, last_access = excluded.last_access",
+                [(model, hash_, np.asarray(vector, dtype=np.float32).tobytes(), now) for hash_, vector in items],
+            )
+            _evict(connection)
+    finally:
+        connection.close()
+
+
+def _evict(connection):
+    total, count = connection.execute("SELECT bytes, entries FROM cache_size").fetchone()
+    if total <= MAX_EMBEDDING_CACHE_BYTES or not count:
+        return
+    # Rimuove le voci usate meno di recente fino a tornare al 90% del limite
+    to_remove = int(count * (1 - 0.9 * MAX_EMBEDDING_CACHE_BYTES / total)) + 1
+    connection.execute(
+        "DELETE FROM embeddings WHERE rowid IN "
+        "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+        (to_remove,),
+    )
+    with _stats_lock:
+        _stats["evictions"] += to_remove
+    logging.info(f"Cache degli embedding: rimosse {to_remove} voci meno recenti")
+
+
+def cached_embed(texts, model, encode):
+    """Embed texts consulting the cache first; encode(texts) is called only for the misses."""
+    hashes = [text_hash(text) for text in texts]
+    try:
+        cached = get_many(model, hashes)
+    except sqlite3.Error as e:
+        logging.error(f"Cache degli embedding non disponibile: {e}")
+        return encode(texts)
+
+    missing = {}
+    for text, hash_ in zip(texts, hashes):
+        if hash_ not in cached and hash_ not in missing:
+            missing[hash_] = text
+
+    if missing:
+        vectors = encode(list(missing.values()))
+        new_items = list(zip(missing.keys(), vectors))
+        cached.update(new_items)
+        try:
+            put_many(model, new_items)
+        except sqlite3.Error as e:
+            logging.error(f"Impossibile salvare gli embedding in cache: {e}")
+
+    with _stats_lock:
+        _stats["hits"] += len(texts) - len(missing)
+        _stats["misses"] += len(missing)
+    return [cached[hash_] for hash_ in hashes]
+
+
+def get_embedding_cache_stats():
+    """Return hit/miss counters of this process and the size of the cache on disk."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["entries"] = 0
+    stats["bytes"] = 0
+    if os.path.exists(EMBEDDING_CACHE_PATH):
+        connection = _connect()
+        try:
+            stats["bytes"], stats["entries"] = connection.execute(
+                "SELECT bytes, entries FROM cache_size"
+            ).fetchone()
+        finally:
+            connection.close()
+    stats["max_bytes"] = MAX_EMBEDDING_CACHE_BYTES
+    return stats
@@ -0,0 +1,120 @@
+# embedding_engine.py
+
+import os
+import time
+import logging
+import threading
+from utils.embedding_cache import cached_embed, model_key
+
+DEFAULT_BATCH_SIZE = int(os.getenv("EDURAG_EMBED_BATCH_SIZE", "64"))
+DEFAULT_NUM_THREADS = int(os.getenv("EDURAG_EMBED_THREADS", "0")) or os.cpu_count() or 1
+DEFAULT_NUM_WORKERS = int(os.getenv("EDURAG_EMBED_WORKERS", "1"))
+
+# Ultime esecuzioni, mostrate nella pagina Prestazioni per dimensionare l'hardware
+_runs = []
+_runs_lock = threading.Lock()
+# torch.set_num_threads è globale al processo: un solo encoding alla volta lo modifica e lo ripristina
+_torch_threads_lock = threading.Lock()
+
+
+class EmbeddingEngine:
+    """Encode ingestion chunks in tunable, length-sorted batches, optionally on several processes.
+
+    Produces the same vectors as embeddings.embed_documents(): it uses the same
+    SentenceTransformer, the same newline replacement and the same encode_kwargs.
+    Use it as a context manager so the worker processes are stopped at the end.
+    """
+
+    def __init__(self, embeddings, batch_size=DEFAULT_BATCH_SIZE, num_threads=DEFAULT_NUM_THREADS,
+                 num_workers=DEFAULT_NUM_WORKERS):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.num_workers = num_workers
+        self.model = getattr(embeddings, "client", None) or getattr(embeddings, "_client")
+        self.encode_kwargs = dict(getattr(embeddings, "encode_kwargs", {}) or {})
+        self.encode_kwargs.pop("batch_size", None)
+        self.pool = None
+        self.chunks = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        if self.num_workers > 1:
+            self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.num_workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+        self.record_run()
+        return False
+
+    def encode(self, texts):
+        """Return one vector per text, in the original order, reusing cached embeddings."""
+        if not texts:
+            return []
+        return cached_embed(texts, model_key(self.embeddings), self._encode)
+
+    def _encode(self, texts):
+        texts = [text.replace("\n", " ") for text in texts]
+        # Ordina per lunghezza: i batch contengono testi simili e si riduce il padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        sorted_texts = [texts[i] for i in order]
+
+        start = time.perf_counter()
+        if self.pool is not None:
+            vectors = self.model.encode_multi_process(
+                sorted_texts, self.pool, batch_size=self.batch_size,
+                chunk_size=max(self.batch_size, len(sorted_texts) // self.num_workers + 1),
+                **self.encode_kwargs,
+            )
+        else:
+            vectors = self._encode_local(sorted_texts)
+        self.seconds += time.perf_counter() - start
+        self.chunks += len(texts)
+
+        result = [None] * len(texts)
+        for position, original_index in enumerate(order):
+            result[original_index] = vectors[position].tolist()
+        return result
+
+    def _encode_local(self, texts):
+        """Encode in this process with num_threads torch threads, restoring the previous setting after."""
+        import torch
+
+        with _torch_threads_lock:
+            previous_threads = torch.get_num_threads()
+            torch.set_num_threads(self.num_threads)
+            try:
+                return self.model.encode(
+                    texts, batch_size=self.batch_size, show_progress_bar=False, **self.encode_kwargs
+                )
+            finally:
+                torch.set_num_threads(previous_threads)
+
+    def throughput(self):
+        """Chunks encoded per second."""
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def record_run(self):
+        if not self.chunks:
+            return
+        run = {
+            "chunk": self.chunks,
+            "secondi": round(self.seconds, 1),
+            "chunk/s": round(self.throughput(), 1),
+            "batch size": self.batch_size,
+            "thread": self.num_threads,
+            "processi": self.num_workers,
+        }
+        logging.info(f"Embedding completato: {run}")
+        with _runs_lock:
+            _runs.append(run)
+            del _runs[:-10]
+
+
+def get_embedding_runs():
+    """Return the last embedding runs (most recent first)."""
+    with _runs_lock:
+        return list(reversed(_runs))
@@ -0,0 +1,84 @@
+# embeddings.py
+
+import logging
+import threading
+import time
+from utils.metrics import rss_bytes
+
+DEFAULT_MODEL_NAME = "sentence-transformers/all-MiniLM-L12-v2"
+
+# Registro dei modelli di embedding condiviso da tutte le sessioni Streamlit del processo
+_registry = {}
+_stats = {}
+_registry_lock = threading.Lock()
+_load_locks = {}
+
+
+def get_embeddings(model_name=DEFAULT_MODEL_NAME, device=None, normalize_embeddings=False):
+    """Return the shared embedding model, loading it only once per process."""
+    key = (model_name, device, normalize_embeddings)
+
+    embeddings = _registry.get(key)
+    if embeddings is not None:
+        with _registry_lock:
+            _stats[key]["hits"] += 1
+        return embeddings
+
+    # Un lock per chiave: le sessioni concorrenti aspettano lo stesso caricamento
+    with _registry_lock:
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    with load_lock:
+        embeddings = _registry.get(key)
+        if embeddings is not None:
+            with _registry_lock:
+                _stats[key]["hits"] += 1
+            return embeddings
+
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        model_kwargs = {"device": device} if device else {}
+        encode_kwargs = {"normalize_embeddings": True} if normalize_embeddings else {}
+
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        embeddings = HuggingFaceEmbeddings(
+            model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs
+        )
+        load_seconds = time.perf_counter() - start
+        rss_delta = max(rss_bytes() - rss_before, 0)
+
+        with _registry_lock:
+            _registry[key] = embeddings
+            _stats[key] = {
+                "load_seconds": load_seconds,
+                "rss_delta_bytes": rss_delta,
+                "loaded_at": time.time(),
+                "hits": 0,
+            }
+
+        logging.info(
+            f"Modello di embedding '{model_name}' (device={device or 'auto'}, "
+            f"normalize={normalize_embeddings}) caricato in {load_seconds:.2f}s, "
+            f"+{rss_delta / (1024 * 1024):.1f} MB"
+        )
+        return embeddings
+
+
+def get_embeddings_stats():
+    """Return load time, memory and reuse statistics for every loaded model."""
+    with _registry_lock:
+        stats = []
+        for (model_name, device, normalize), entry in _stats.items():
+            stats.append({
+                "modello": model_name,
+                "device": device or "auto",
+                "normalize": normalize,
+                "caricamento (s)": round(entry["load_seconds"], 2),
+                "memoria (MB)": round(entry["rss_delta_bytes"] / (1024 * 1024), 1),
+                "riutilizzi": entry["hits"],
+                # Tempo e allocazioni evitate rispetto a un caricamento per ogni richiesta
+                "tempo risparmiato (s)": round(entry["hits"] * entry["load_seconds"], 1),
+                "MB non riallocati": round(entry["hits"] * entry["rss_delta_bytes"] / (1024 * 1024), 1),
+            })
+        return stats
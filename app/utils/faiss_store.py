@@ -0,0 +1,366 @@
+# faiss_store.py
+
+import os
+import uuid
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from utils.metrics import file_mappings
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi
+    fcntl = None
+
+INDEX_FILES = ("index.faiss", "chunks.sqlite")
+# Formato precedente: docstore e mappa degli id serializzati con pickle
+LEGACY_INDEX_FILES = ("index.faiss", "index.pkl")
+
+# Serializza le scritture di un indice tra processi
+LOCK_FILE = ".lock"
+# Attese quando un lettore trova index.faiss e chunks.sqlite di generazioni diverse
+PAIR_RETRIES = 20
+PAIR_RETRY_DELAY = 0.1
+
+# Gli indici condivisi aprono index.faiss mappato in memoria e in sola lettura:
+# processi e sessioni usano la stessa copia fisica nella page cache
+USE_MMAP = os.getenv("EDURAG_INDEX_MMAP", "1") != "0"
+
+# Limite della memoria occupata dagli indici in cache (MB), configurabile da ambiente
+MAX_CACHE_BYTES = int(os.getenv("EDURAG_INDEX_CACHE_MB", "2048")) * 1024 * 1024
+
+# Cache LRU condivisa da tutte le sessioni: percorso assoluto -> indice caricato
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_load_locks = {}
+_stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+
+def index_files(folder):
+    """Return the names of the files of an index, in the current or the legacy format."""
+    if os.path.exists(os.path.join(folder, INDEX_FILES[1])):
+        return INDEX_FILES
+    return LEGACY_INDEX_FILES
+
+
+def index_signature(folder):
+    """Return the (name, mtime, size) signature of the files of an index."""
+    signature = []
+    for name in index_files(folder):
+        file_stat = os.stat(os.path.join(folder, name))
+        signature.append((name, file_stat.st_mtime_ns, file_stat.st_size))
+    return tuple(signature)
+
+
+def load_index(folder, embeddings, lazy=False):
+    """Load a FAISS index from disk.
+
+    Only the vectors are read: chunk texts and metadata stay in chunks.sqlite and
+    are read when a search returns them. By default the copy is private and
+    modifiable; with lazy the id map is read on demand too, index.faiss is
+    memory-mapped when possible and the index must not be modified.
+
+    Indices in the legacy pickle format are loaded as they are: converting them
+    is an explicit step (migrate_legacy_index). If a writer is replacing the
+    pair of files, the load waits until index.faiss and chunks.sqlite match.
+    """
+    from langchain_community.vectorstores import FAISS
+    from utils.ann_index import prepare_index
+    from utils.chunk_store import open_chunk_store
+
+    if index_files(folder) == LEGACY_INDEX_FILES:
+        index = FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
+        prepare_index(index.index)
+        return index
+
+    for _ in range(PAIR_RETRIES):
+        generation = _matching_generation(folder)
+        if generation is not False:
+            docstore, index_to_docstore_id = open_chunk_store(folder, lazy=lazy, generation=generation)
+            vector_index = read_vector_index(os.path.join(folder, INDEX_FILES[0]), mmap=lazy and USE_MMAP)
+            # Ricontrollo: la coppia non deve essere cambiata durante la lettura
+            if _matching_generation(folder) == generation:
+                return FAISS(embeddings, prepare_index(vector_index), docstore, index_to_docstore_id)
+        time.sleep(PAIR_RETRY_DELAY)
+    raise RuntimeError(f"index.faiss e chunks.sqlite di '{folder}' non corrispondono: indice in scrittura o danneggiato")
+
+
+def _matching_generation(folder):
+    """Return the generation of the index files if they belong together, False otherwise.
+
+    chunks.sqlite records the size and mtime of the index.faiss written with it
+    (a rename keeps them); files written before the stamp existed return None.
+    """
+    from utils.chunk_store import read_chunk_store_stamp
+
+    stamp = read_chunk_store_stamp(os.path.join(folder, INDEX_FILES[1]))
+    if not stamp:
+        return None
+    faiss_stat = os.stat(os.path.join(folder, INDEX_FILES[0]))
+    if stamp["faiss_size"] != str(faiss_stat.st_size) or stamp["faiss_mtime_ns"] != str(faiss_stat.st_mtime_ns):
+        return False
+    return stamp["generation"]
+
+
+def read_vector_index(path, mmap=False):
+    """Read index.faiss, memory-mapped and read-only if the index type allows it.
+
+    Index types that faiss cannot map are read into memory as before. With the
+    pinned faiss-cpu 1.8, IO_FLAG_MMAP maps only the inverted lists of IVF
+    indices: flat and HNSW indices (the automatic choice below 1M vectors) are
+    read into the heap of each process without any error. is_mapped() tells
+    the two cases apart.
+    """
+    import faiss
+
+    if mmap:
+        flag_sets = []
+        if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+            # Versioni recenti: mappa anche i codici degli indici flat e HNSW
+            flag_sets.append(faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        flag_sets.append(faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        for flags in flag_sets:
+            try:
+                return faiss.read_index(path, flags)
+            except RuntimeError as e:
+                logging.info(f"'{path}' non apribile in mmap (flag {flags}): {e}")
+    return faiss.read_index(path)
+
+
+def is_mapped(folder):
+    """Return True if index.faiss of the folder is memory-mapped by this process."""
+    path = os.path.join(folder, INDEX_FILES[0])
+    return file_mappings([path])[path][0] > 0
+
+
+@contextmanager
+def index_write_lock(folder):
+    """Serialize the writers of an index folder, also across processes (flock on folder/.lock)."""
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, LOCK_FILE), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def save_index(index, folder):
+    """Write a FAISS index to disk: vectors in index.faiss, chunks in chunks.sqlite.
+
+    Each file is written aside and renamed into place (never rewritten in place,
+    since other processes may have it mapped). The two renames are not one
+    atomic step: chunks.sqlite carries a stamp of its index.faiss, so readers
+    that see a new file next to an old one detect it and retry. The legacy
+    index.pkl is removed.
+    """
+    with index_write_lock(folder):
+        _write_index(index, folder)
+
+
+def _write_index(index, folder):
+    import faiss
+    from utils.chunk_store import write_chunk_store
+
+    faiss_path = os.path.join(folder, INDEX_FILES[0])
+    chunks_path = os.path.join(folder, INDEX_FILES[1])
+    faiss.write_index(index.index, faiss_path + ".tmp")
+    faiss_stat = os.stat(faiss_path + ".tmp")
+    stamp = {
+        "generation": uuid.uuid4().hex,
+        "faiss_size": faiss_stat.st_size,
+        "faiss_mtime_ns": faiss_stat.st_mtime_ns,
+    }
+    write_chunk_store(chunks_path + ".tmp", index.docstore, index.index_to_docstore_id, stamp)
+    os.replace(faiss_path + ".tmp", faiss_path)
+    os.replace(chunks_path + ".tmp", chunks_path)
+    legacy_path = os.path.join(folder, LEGACY_INDEX_FILES[1])
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+
+def is_legacy_index(folder):
+    """Return True if the index still uses the pickled docstore (index.pkl)."""
+    return index_files(folder) == LEGACY_INDEX_FILES
+
+
+def migrate_legacy_index(folder, embeddings):
+    """Convert an index from index.pkl to chunks.sqlite under the write lock.
+
+    Returns False if another process converted it in the meantime.
+    """
+    from langchain_community.vectorstores import FAISS
+
+    with index_write_lock(folder):
+        if not is_legacy_index(folder):
+            return False
+        index = FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
+        _write_index(index, folder)
+    invalidate_index(folder)
+    logging.info(f"Indice '{folder}' convertito da index.pkl a chunks.sqlite")
+    return True
+
+
+def get_cached_index(folder, embeddings):
+    """Return the shared, read-only FAISS index for a folder.
+
+    The index is loaded once per process and reloaded automatically when
+    its files change on disk. Callers must not modify it:
+    use load_index() for operations that add or remove documents.
+    """
+    key = os.path.abspath(folder)
+    signature = index_signature(folder)
+
+    entry = _lookup(key, signature, embeddings)
+    if entry is not None:
+        return entry["index"]
+
+    with _cache_lock:
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # Le sessioni che chiedono lo stesso indice aspettano un solo caricamento
+    with load_lock:
+        entry = _lookup(key, signature, embeddings, count_hit=False)
+        if entry is not None:
+            return entry["index"]
+
+        start = time.perf_counter()
+        index = load_index(folder, embeddings, lazy=True)
+        signature = index_signature(folder)
+        load_seconds = time.perf_counter() - start
+        mapped = USE_MMAP and is_mapped(folder)
+        if USE_MMAP and not mapped:
+            logging.warning(
+                f"index.faiss di '{folder}' letto in memoria: questa versione di faiss non mappa "
+                "questo tipo di indice, ogni processo ne tiene una copia"
+            )
+        # I chunk restano su disco (letti su richiesta): in memoria ci sono solo i vettori
+        nbytes = sum(size for name, _, size in signature if name != INDEX_FILES[1])
+
+        with _cache_lock:
+            _stats["misses"] += 1
+            _cache[key] = {
+                "index": index,
+                "embeddings": embeddings,
+                "signature": signature,
+                "nbytes": nbytes,
+                "load_seconds": load_seconds,
+                "mapped": mapped,
+                "hits": 0,
+            }
+            _cache.move_to_end(key)
+            _evict()
+
+        logging.info(f"Indice FAISS '{folder}' caricato in cache in {load_seconds:.2f}s")
+        return index
+
+
+def _lookup(key, signature, embeddings, count_hit=True):
+    """Return a valid cache entry or drop the stale one."""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if entry["signature"] != signature or entry["embeddings"] is not embeddings:
+            # I file su disco sono cambiati: l'indice in memoria non è più valido
+            del _cache[key]
+            _stats["invalidations"] += 1
+            logging.info(f"Indice in cache '{key}' invalidato: file modificati su disco")
+            return None
+        _cache.move_to_end(key)
+        if count_hit:
+            entry["hits"] += 1
+            _stats["hits"] += 1
+        return entry
+
+
+def _evict():
+    """Evict least recently used indices beyond the memory limit (lock held)."""
+    for key in [key for key in _cache if not os.path.exists(key)]:
+        del _cache[key]
+        _stats["invalidations"] += 1
+
+    total = sum(entry["nbytes"] for entry in _cache.values())
+    while total > MAX_CACHE_BYTES and len(_cache) > 1:
+        key, entry = _cache.popitem(last=False)
+        total -= entry["nbytes"]
+        _stats["evictions"] += 1
+        logging.info(f"Indice '{key}' rimosso dalla cache (limite di memoria raggiunto)")
+
+
+def invalidate_index(folder):
+    """Drop the cached copy of an index (e.g. after it is renamed or deleted)."""
+    key = os.path.abspath(folder)
+    with _cache_lock:
+        if _cache.pop(key, None) is not None:
+            _stats["invalidations"] += 1
+
+
+def get_index_cache_stats():
+    """Return global counters and the list of cached indices.
+
+    For each index the mapped and resident bytes of its files are read from
+    /proc/self/smaps: a mapped index.faiss is shared with the other processes.
+    """
+    with _cache_lock:
+        entries = list(reversed(_cache.items()))
+        totals = dict(_stats)
+        totals["bytes"] = sum(entry["nbytes"] for entry in _cache.values())
+        totals["max_bytes"] = MAX_CACHE_BYTES
+
+    mappings = file_mappings([os.path.join(key, name) for key, _ in entries for name in INDEX_FILES])
+    indices = []
+    for key, entry in entries:
+        mapped, resident = (
+            sum(values) for values in zip(*(mappings[os.path.join(key, name)] for name in INDEX_FILES))
+        )
+        indices.append({
+            "indice": os.path.basename(key),
+            "dimensione (MB)": round(entry["nbytes"] / (1024 * 1024), 1),
+            "index.faiss in mmap": "sì" if entry["mapped"] else "no (copia in memoria)",
+            "mappato (MB)": round(mapped / (1024 * 1024), 1),
+            "residente mappato (MB)": round(resident / (1024 * 1024), 1),
+            "caricamento (s)": round(entry["load_seconds"], 2),
+            "riutilizzi": entry["hits"],
+        })
+    totals["mapped_bytes"] = sum(size for size, _ in mappings.values())
+    totals["mapped_resident_bytes"] = sum(rss for _, rss in mappings.values())
+    return totals, indices
+
+
+def find_ids_by_title(index, titles):
+    """Return the docstore ids of the chunks belonging to the given titles."""
+    if hasattr(index.docstore, "ids_by_title"):
+        return index.docstore.ids_by_title(titles)
+    titles = set(titles)
+    ids = []
+    for docstore_id in index.index_to_docstore_id.values():
+        doc = index.docstore.search(docstore_id)
+        if doc.metadata.get("title") in titles:
+            ids.append(docstore_id)
+    return ids
+
+
+def delete_documents(index, ids):
+    """Remove chunks from the index in place, without re-embedding the others.
+
+    Flat indices drop the vectors with faiss remove_ids, which compacts the
+    positions like LangChain does with index_to_docstore_id. IVF and IVF-PQ
+    remove them too and renumber the surviving labels, keeping their codes.
+    HNSW has no remove_ids and is rebuilt from its (exact) surviving vectors.
+    """
+    from utils.ann_index import index_type_of, rebuild_without, remove_from_ivf, INDEX_HNSW, INDEX_IVF, INDEX_IVFPQ
+
+    if ids:
+        index_type = index_type_of(index.index)
+        if index_type == INDEX_HNSW:
+            rebuild_without(index, ids)
+        elif index_type in (INDEX_IVF, INDEX_IVFPQ):
+            remove_from_ivf(index, ids)
+        else:
+            index.delete(ids)
+    return len(ids)
@@ -0,0 +1,209 @@
+# llm_cache.py
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+LLM_CACHE_PATH = "app/cache/llm_responses.sqlite"
+MAX_LLM_CACHE_BYTES = int(os.getenv("EDURAG_LLM_CACHE_MB", "200")) * 1024 * 1024
+LLM_CACHE_TTL_SECONDS = float(os.getenv("EDURAG_LLM_CACHE_TTL_DAYS", "30")) * 24 * 3600
+
+_write_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+def cache_key(model, temperature, template_version, messages):
+    """Key of a call: model, temperature, prompt template version and hash of the formatted messages."""
+    payload = json.dumps(
+        [model, round(float(temperature), 3), template_version, [(m.type, m.content) for m in messages]],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def prompt_versions(tool, **versions):
+    """Return the template versions of the prompts of a tool, e.g. {"summarize": "pdf_summary/summarize/1"}.
+
+    The version is part of the cache key: bump it when the prompt changes.
+    """
+    return {step: f"{tool}/{step}/{version}" for step, version in versions.items()}
+
+
+def _connect():
+    os.makedirs(os.path.dirname(LLM_CACHE_PATH), exist_ok=True)
+    connection = sqlite3.connect(LLM_CACHE_PATH, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    with _schema_lock:
+        if LLM_CACHE_PATH not in _schema_ready:
+            _create_schema(connection)
+            _schema_ready.add(LLM_CACHE_PATH)
+    return connection
+
+
+def _create_schema(connection):
+    # Byte totali tenuti aggiornati dai trigger, come nella cache degli embedding
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, template_version TEXT NOT NULL, "
+            "response TEXT NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_size ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL, entries INTEGER NOT NULL)"
+        )
+        # Cache create prima del contatore: il totale viene calcolato una sola volta
+        connection.execute(
+            "INSERT INTO cache_size SELECT 0, COALESCE(SUM(LENGTH(CAST(response AS BLOB))), 0), COUNT(*) "
+            "FROM responses WHERE NOT EXISTS (SELECT 1 FROM cache_size)"
+        )
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_size_insert AFTER INSERT ON responses BEGIN "
+            "UPDATE cache_size SET bytes = bytes + LENGTH(CAST(NEW.response AS BLOB)), entries = entries + 1; END"
+        )
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_size_delete AFTER DELETE ON responses BEGIN "
+            "UPDATE cache_size SET bytes = bytes - LENGTH(CAST(OLD.response AS BLOB)), entries = entries - 1; END"
+        )
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_size_update AFTER UPDATE OF response ON responses BEGIN "
+            "UPDATE cache_size SET bytes = bytes + LENGTH(CAST(NEW.response AS BLOB)) "
+            "- LENGTH(CAST(OLD.response AS BLOB)); END"
+        )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def get_response(key):
+    """Return the cached response of a key, or None if missing or older than the TTL."""
+    connection = _connect()
+    try:
+        row = connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        response, created = row
+        now = time.time()
+        with _write_lock, connection:
+            if now - created > LLM_CACHE_TTL_SECONDS:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                with _stats_lock:
+                    _stats["expired"] += 1
+                return None
+            connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return response
+    finally:
+        connection.close()
+
+
+def put_response(key, model, template_version, response):
+    """Store a response, then drop expired entries and the least recently used beyond the size limit."""
+    now = time.time()
+    connection = _connect()
+    try:
+        with _write_lock, connection:
+            # Upsert e non INSERT OR REPLACE: la cancellazione implicita di REPLACE non attiva i trigger
+            connection.execute(
+                "INSERT INTO responses (key, model, template_version, response, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET model = excluded.model, "
+                "template_version = excluded.template_version, response = excluded.response, "
+                "created = excluded.created, last_access = excluded.last_access",
+                (key, model, template_version, response, now, now),
+            )
+            expired = connection.execute(
+                "DELETE FROM responses WHERE created < ?", (now - LLM_CACHE_TTL_SECONDS,)
+            ).rowcount
+            with _stats_lock:
+                _stats["expired"] += expired
+            _evict(connection)
+    finally:
+        connection.close()
+
+
+def _evict(connection):
+    (total,) = connection.execute("SELECT bytes FROM cache_size").fetchone()
+    if total <= MAX_LLM_CACHE_BYTES:
+        return
+    # Rimuove le risposte usate meno di recente finché i byte liberati non riportano al 90% del limite
+    to_free = total - 0.9 * MAX_LLM_CACHE_BYTES
+    keys = []
+    for key, size in connection.execute(
+        "SELECT key, LENGTH(CAST(response AS BLOB)) FROM responses ORDER BY last_access"
+    ):
+        keys.append(key)
+        to_free -= size
+        if to_free <= 0:
+            break
+    # Parametri per query IN (...): le versioni di SQLite precedenti alla 3.32 ne accettano al massimo 999
+    for start in range(0, len(keys), 900):
+        batch = keys[start:start + 900]
+        connection.execute(f"DELETE FROM responses WHERE key IN ({','.join('?' * len(batch))})", batch)
+    with _stats_lock:
+        _stats["evictions"] += len(keys)
+    logging.info(f"Cache delle risposte LLM: rimosse {len(keys)} voci meno recenti")
+
+
+def cached_invoke(template, llm, inputs, model, temperature, template_version, use_cache=True):
+    """Invoke template | llm and return the response text, reusing a stored response if allowed.
+
+    template_version must change whenever the prompt of the template changes, so
+    responses produced by an older prompt are not returned.
+    """
+    messages = template.format_messages(**inputs)
+    if not use_cache:
+        return llm.invoke(messages).content
+
+    key = cache_key(model, temperature, template_version, messages)
+    try:
+        response = get_response(key)
+    except sqlite3.Error as e:
+        logging.error(f"Cache delle risposte LLM non disponibile: {e}")
+        response = None
+
+    if response is not None:
+        with _stats_lock:
+            _stats["hits"] += 1
+        logging.info(f"Risposta LLM riusata dalla cache ({template_version}).")
+        return response
+
+    with _stats_lock:
+        _stats["misses"] += 1
+    response = llm.invoke(messages).content
+    if response.strip():
+        try:
+            put_response(key, model, template_version, response)
+        except sqlite3.Error as e:
+            logging.error(f"Impossibile salvare la risposta LLM in cache: {e}")
+    return response
+
+
+def get_llm_cache_stats():
+    """Return hit/miss counters of this process and the size of the cache on disk."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["entries"] = 0
+    stats["bytes"] = 0
+    if os.path.exists(LLM_CACHE_PATH):
+        connection = _connect()
+        try:
+            stats["bytes"], stats["entries"] = connection.execute(
+                "SELECT bytes, entries FROM cache_size"
+            ).fetchone()
+        finally:
+            connection.close()
+    stats["max_bytes"] = MAX_LLM_CACHE_BYTES
+    stats["ttl_days"] = LLM_CACHE_TTL_SECONDS / (24 * 3600)
+    return stats
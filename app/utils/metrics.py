@@ -0,0 +1,51 @@
+# metrics.py
+
+import os
+import sys
+import resource
+
+
+def rss_bytes():
+    """Return the resident memory of the current process in bytes."""
+    try:
+        # Linux: seconda colonna di /proc/self/statm = pagine residenti
+        with open("/proc/self/statm", "r") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # macOS e altri: ru_maxrss è il picco (byte su macOS, KB su Linux)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def format_bytes(num_bytes):
+    """Format a number of bytes in a human readable way."""
+    value = float(num_bytes or 0)
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(value) < 1024 or unit == "GB":
+            return f"{value:.1f} {unit}"
+        value /= 1024
+
+
+def file_mappings(paths):
+    """Return {path: (mapped_bytes, resident_bytes)} for files memory-mapped by this process.
+
+    Reads /proc/self/smaps (Linux); elsewhere every file is reported as not mapped.
+    """
+    real_paths = {os.path.realpath(path): path for path in paths}
+    totals = {path: [0, 0] for path in paths}
+    try:
+        with open("/proc/self/smaps", "r") as smaps:
+            current = None
+            for line in smaps:
+                fields = line.split()
+                if not fields:
+                    continue
+                if not fields[0].endswith(":"):
+                    # Intestazione della mappatura: indirizzi, permessi, offset, device, inode, percorso
+                    current = real_paths.get(" ".join(fields[5:])) if len(fields) > 5 else None
+                elif current is not None and fields[0] in ("Size:", "Rss:"):
+                    totals[current][0 if fields[0] == "Size:" else 1] += int(fields[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return {path: tuple(values) for path, values in totals.items()}
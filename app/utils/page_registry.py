@@ -0,0 +1,59 @@
+# page_registry.py
+
+import time
+import logging
+import importlib
+import threading
+from utils.metrics import rss_bytes
+
+# Sottopagina -> (modulo, funzione). Il modulo viene importato solo quando la pagina è selezionata,
+# così la Home non carica torch, langchain, pdfplumber, edge_tts...
+PAGES = {
+    "Primo utilizzo": ("utilizzo.uso", "get_uso"),
+    "Consigli": ("utilizzo.consigli", "get_consigli"),
+    "Gestione Indici": ("amm.manage_indices", "view_and_manage_db"),
+    "Crea Database": ("amm.crea_database", "create_database"),
+    "Elimina File": ("amm.delete_file", "delete_file_from_database"),
+    "Prestazioni": ("amm.prestazioni", "mostra_prestazioni"),
+    "Openai": ("query_database.query_gpt", "query_db_gpt4"),
+    "Anthropic": ("query_database.query_claude", "query_db_claude"),
+    "Riassunto PDF": ("tool.pdf_summary", "pdf_summary"),
+    "Riassunto PDF articoli scientifici": ("tool.pdf_summary_a", "pdf_summary_a"),
+    "Domande aperte": ("tool.open_question", "open_question"),
+    "TTS Edge": ("tool.voce", "voce"),
+}
+
+# Tempo e memoria del primo import di ogni modulo di pagina in questo processo
+_import_report = {}
+_import_lock = threading.Lock()
+
+
+def load_page(name):
+    """Return the function of a page, importing its module on first use."""
+    module_name, function_name = PAGES[name]
+    with _import_lock:
+        if module_name not in _import_report:
+            rss_before = rss_bytes()
+            start = time.perf_counter()
+            module = importlib.import_module(module_name)
+            _import_report[module_name] = {
+                "pagina": name,
+                "modulo": module_name,
+                "import (ms)": round((time.perf_counter() - start) * 1000, 1),
+                "memoria (MB)": round((rss_bytes() - rss_before) / (1024 * 1024), 1),
+            }
+            logging.info(f"Pagina '{name}' importata: {_import_report[module_name]}")
+        else:
+            module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+
+def run_page(name):
+    """Import (if needed) and render a page."""
+    load_page(name)()
+
+
+def get_import_report():
+    """Return the import time and memory of the page modules loaded so far, in load order."""
+    with _import_lock:
+        return list(_import_report.values())
@@ -0,0 +1,128 @@
+# query_coalescing.py
+
+import os
+import logging
+import threading
+
+# Query in corso, condivise tra le sessioni che fanno la stessa domanda nello stesso momento
+_jobs = {}
+_jobs_lock = threading.Lock()
+_stats = {"started": 0, "coalesced": 0}
+
+
+def query_key(index_folder, question, model_name, temperature, similarity_k, retrieval_mode=None, credential=None):
+    """Key of a query: identical keys share one retrieval and one generation.
+
+    index_folder may be a list of folders for a query across several indices.
+    credential is the credential_hash() of the model: only sessions using the same
+    API key share a job, so one user's key is never billed for, or its errors
+    propagated to, another user.
+    """
+    normalized = " ".join(question.split())
+    if isinstance(index_folder, (list, tuple)):
+        folders = tuple(sorted(os.path.abspath(folder) for folder in index_folder))
+    else:
+        folders = os.path.abspath(index_folder)
+    return (folders, normalized, model_name, temperature, similarity_k, retrieval_mode, credential)
+
+
+class QueryJob:
+    """Background retrieval and generation whose tokens can be read by several sessions."""
+
+    def __init__(self, key, run):
+        self.key = key
+        self._run = run
+        self.status = "running"
+        self.error = None
+        self.documents = None
+        self.timings = {}
+        self.subscribers = 1
+        self._chunks = []
+        self._condition = threading.Condition()
+
+    def run(self):
+        status = "error"
+        try:
+            self._run(self)
+            status = "done"
+        except Exception as e:
+            logging.error(f"Errore durante la query condivisa: {e}")
+            self.error = e
+        finally:
+            with self._condition:
+                self.status = status
+                self._condition.notify_all()
+            with _jobs_lock:
+                _jobs.pop(self.key, None)
+
+    def set_documents(self, documents):
+        with self._condition:
+            self.documents = documents
+            self._condition.notify_all()
+
+    def add_chunk(self, chunk):
+        with self._condition:
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+    def text(self):
+        """Return the tokens produced so far joined together."""
+        with self._condition:
+            return "".join(self._chunks)
+
+    def iter_chunks(self):
+        """Yield every token from the first one, also to sessions that joined late."""
+        position = 0
+        while True:
+            with self._condition:
+                while position >= len(self._chunks) and self.status == "running":
+                    self._condition.wait()
+                new_chunks = self._chunks[position:]
+                finished = self.status != "running"
+            for chunk in new_chunks:
+                yield chunk
+            position += len(new_chunks)
+            if finished and position >= len(self._chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+    def wait_documents(self):
+        """Return the retrieved documents once the job has them (or has failed)."""
+        with self._condition:
+            while self.documents is None and self.status == "running":
+                self._condition.wait()
+        if self.error is not None:
+            raise self.error
+        return self.documents
+
+
+def start_query_job(key, run):
+    """Start the query of a key, or join the identical one already running.
+
+    run(job) performs retrieval and generation, calling job.set_documents() and
+    job.add_chunk(). Returns (job, coalesced): coalesced is True for the sessions
+    that joined a query started by another session.
+    """
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is not None:
+            with job._condition:
+                job.subscribers += 1
+            _stats["coalesced"] += 1
+            logging.info(f"Query identica già in corso: condivisa con {job.subscribers} sessioni")
+            return job, True
+        job = QueryJob(key, run)
+        _jobs[key] = job
+        _stats["started"] += 1
+
+    threading.Thread(target=job.run, name="query-job", daemon=True).start()
+    return job, False
+
+
+def get_coalescing_stats():
+    """Return how many queries were started and how many requests joined a running one."""
+    with _jobs_lock:
+        stats = dict(_stats)
+        stats["in_flight"] = len(_jobs)
+    return stats
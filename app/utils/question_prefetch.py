@@ -0,0 +1,169 @@
+# question_prefetch.py
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.faiss_store import index_signature
+from utils.docstore_sampler import sample_documents, STRATIFY_NONE
+from utils.concurrent_llm import call_with_backoff, SUMMARY_CONCURRENCY
+
+QUESTION_BANK_FILE = "question_bank.json"
+DEFAULT_PREFETCH_SIZE = 3
+
+# Code di domande pronte condivise dalle sessioni con la stessa chiave API:
+# (indice, modello, temperatura, k, estrazione, credenziale) -> coda
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+class QuestionQueue:
+    """Questions generated in background and kept ready for the next request."""
+
+    def __init__(self, signature, size):
+        self.signature = signature
+        self.size = size
+        self.error = None
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._filling = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ready)
+
+    def pop(self, exclude=()):
+        """Return the oldest ready question whose chunk is not in exclude, or None."""
+        with self._lock:
+            for item in self._ready:
+                if item["docstore_id"] not in exclude:
+                    self._ready.remove(item)
+                    return item
+        return None
+
+    def ensure_filling(self, faiss_index, generate, stratify=STRATIFY_NONE):
+        """Start a background thread that generates questions until size are ready."""
+        with self._lock:
+            if self._filling or len(self._ready) >= self.size:
+                return
+            self._filling = True
+        threading.Thread(
+            target=self._fill, args=(faiss_index, generate, stratify), name="question-prefetch", daemon=True
+        ).start()
+
+    def _fill(self, faiss_index, generate, stratify):
+        try:
+            while True:
+                with self._lock:
+                    if len(self._ready) >= self.size:
+                        return
+                    queued_ids = {item["docstore_id"] for item in self._ready}
+                sampled = sample_documents(faiss_index, 1, stratify, exclude=queued_ids)
+                if not sampled:
+                    return
+                docstore_id, document = sampled[0]
+                question = call_with_backoff(generate, document)
+                with self._lock:
+                    self._ready.append({"question": question, "docstore_id": docstore_id, "document": document})
+                self.error = None
+        except Exception as e:
+            logging.error(f"Errore durante la preparazione delle domande: {e}")
+            self.error = e
+        finally:
+            with self._lock:
+                self._filling = False
+
+
+def get_question_queue(index_folder, model_name, temperature, similarity_k, stratify, size=DEFAULT_PREFETCH_SIZE,
+                       credential=None):
+    """Return the queue of ready questions for these settings, dropping it if the index changed.
+
+    credential is the credential_hash() of the generating model: the queue is
+    filled with that API key, so only sessions using the same key share it.
+    """
+    key = (os.path.abspath(index_folder), model_name, temperature, similarity_k, stratify, credential)
+    signature = index_signature(index_folder)
+    with _queues_lock:
+        queue = _queues.get(key)
+        if queue is None or queue.signature != signature:
+            queue = QuestionQueue(signature, size)
+            _queues[key] = queue
+        queue.size = size
+        return queue
+
+
+def question_bank_path(index_folder):
+    return os.path.join(index_folder, QUESTION_BANK_FILE)
+
+
+def read_question_bank(index_folder):
+    """Return the question bank of an index: questions plus the model and temperature used ({} if none)."""
+    path = question_bank_path(index_folder)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as bank_file:
+            return json.load(bank_file)
+    except (OSError, ValueError) as e:
+        logging.error(f"Banco di domande di '{index_folder}' non leggibile: {e}")
+        return {}
+
+
+def bank_matches(bank, model_name, temperature):
+    """Return True if the bank was generated with this model and temperature."""
+    return bank.get("modello") == model_name and bank.get("temperatura") == temperature
+
+
+def pop_bank_question(question_bank, faiss_index, exclude=()):
+    """Return the first bank question whose chunk is still in the index and not in exclude."""
+    for entry in question_bank:
+        docstore_id = entry.get("docstore_id")
+        if docstore_id in exclude:
+            continue
+        document = faiss_index.docstore.search(docstore_id)
+        if isinstance(document, str):
+            continue  # Chunk eliminato dall'indice dopo la creazione del banco
+        return {"question": entry["domanda"], "docstore_id": docstore_id, "document": document}
+    return None
+
+
+def build_question_bank(index_folder, faiss_index, generate, num_questions, model_name, temperature,
+                        stratify=STRATIFY_NONE, max_workers=SUMMARY_CONCURRENCY, on_question_done=None):
+    """Generate num_questions questions on distinct chunks and save them in question_bank.json.
+
+    on_question_done(completed, total) is called in the calling thread after each question.
+    Returns the number of questions saved.
+    """
+    sampled = sample_documents(faiss_index, num_questions, stratify)
+    questions = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {pool.submit(call_with_backoff, generate, document): (docstore_id, document)
+                   for docstore_id, document in sampled}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            docstore_id, document = futures[future]
+            try:
+                questions.append({
+                    "domanda": future.result(),
+                    "docstore_id": docstore_id,
+                    "title": document.metadata.get("title", "Sconosciuto"),
+                    "page_number": document.metadata.get("page_number", "Sconosciuta"),
+                })
+            except Exception as e:
+                logging.error(f"Errore nella generazione di una domanda del banco: {e}")
+            if on_question_done is not None:
+                on_question_done(completed, len(sampled))
+
+    bank = {
+        "modello": model_name,
+        "temperatura": temperature,
+        "creato": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "domande": questions,
+    }
+    path = question_bank_path(index_folder)
+    with open(path + ".tmp", "w", encoding="utf-8") as bank_file:
+        json.dump(bank, bank_file, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+    return len(questions)
@@ -0,0 +1,161 @@
+# retrieval.py
+
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Stessi valori predefiniti del retriever MMR di LangChain
+MMR_FETCH_K = 20
+MMR_LAMBDA_MULT = 0.5
+
+# Modalità di ricerca selezionabili dalle pagine di interrogazione
+RETRIEVAL_MMR = "mmr"
+RETRIEVAL_HYBRID = "ibrida"
+# Fusione dei ranking FAISS e BM25 (reciprocal rank fusion, costante usuale 60)
+HYBRID_FETCH_K = 50
+RRF_K = 60
+
+
+def embed_query(faiss_index, query):
+    """Embed the query with the embedding function bound to the index."""
+    embeddings = faiss_index.embeddings
+    if embeddings is not None:
+        return embeddings.embed_query(query)
+    return faiss_index.embedding_function(query)
+
+
+def retrieve_with_scores(faiss_index, query, k, timings=None, fetch_k=MMR_FETCH_K, lambda_mult=MMR_LAMBDA_MULT,
+                         query_vector=None):
+    """Run a single MMR retrieval and return (document, distance) pairs.
+
+    Equivalent to faiss_index.as_retriever(search_type="mmr"), but split in
+    stages so that embedding, vector search and MMR rerank can be timed.
+    An already computed query_vector skips the embedding stage.
+    """
+    from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+    if timings is None:
+        timings = {}
+
+    if query_vector is None:
+        start = time.perf_counter()
+        query_vector = embed_query(faiss_index, query)
+        timings["embed"] = time.perf_counter() - start
+    query_vector = np.array([query_vector], dtype=np.float32)
+
+    start = time.perf_counter()
+    scores, indices = faiss_index.index.search(query_vector, fetch_k)
+    timings["search"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    candidates = [int(i) for i in indices[0] if i != -1]
+    candidate_vectors = [faiss_index.index.reconstruct(i) for i in candidates]
+    selected = maximal_marginal_relevance(query_vector, candidate_vectors, k=k, lambda_mult=lambda_mult)
+    results = []
+    for position in selected:
+        docstore_id = faiss_index.index_to_docstore_id[candidates[position]]
+        results.append((faiss_index.docstore.search(docstore_id), float(scores[0][position])))
+    timings["mmr"] = time.perf_counter() - start
+
+    return results
+
+
+def retrieve_documents(faiss_index, query, k, timings=None, query_vector=None, lexical_index=None):
+    """Run a single retrieval and return the documents: hybrid if a lexical_index is given, MMR otherwise."""
+    if lexical_index is not None:
+        results = retrieve_hybrid(faiss_index, lexical_index, query, k, timings, query_vector=query_vector)
+    else:
+        results = retrieve_with_scores(faiss_index, query, k, timings, query_vector=query_vector)
+    return [doc for doc, _ in results]
+
+
+def retrieve_hybrid(faiss_index, lexical_index, query, k, timings=None, fetch_k=HYBRID_FETCH_K, query_vector=None):
+    """Fuse the FAISS and BM25 rankings with reciprocal rank fusion and return (document, score) pairs.
+
+    Exact terms (names, acronyms, article numbers) found by BM25 reach the top k
+    even when the embedding model places them far from the query.
+    """
+    if timings is None:
+        timings = {}
+
+    if query_vector is None:
+        start = time.perf_counter()
+        query_vector = embed_query(faiss_index, query)
+        timings["embed"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, indices = faiss_index.index.search(np.array([query_vector], dtype=np.float32), fetch_k)
+    vector_ids = [faiss_index.index_to_docstore_id[int(i)] for i in indices[0] if i != -1]
+    timings["search"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lexical_ids = [docstore_id for docstore_id, _ in lexical_index.search(query, fetch_k)]
+    timings["bm25"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fused = {}
+    for ranking in (vector_ids, lexical_ids):
+        for rank, docstore_id in enumerate(ranking, start=1):
+            fused[docstore_id] = fused.get(docstore_id, 0.0) + 1.0 / (RRF_K + rank)
+    results = []
+    for docstore_id, score in sorted(fused.items(), key=lambda item: item[1], reverse=True):
+        doc = faiss_index.docstore.search(docstore_id)
+        if isinstance(doc, str):
+            continue  # Id presente solo nell'indice BM25: i due indici non sono allineati
+        results.append((doc, score))
+        if len(results) == k:
+            break
+    timings["fusion"] = time.perf_counter() - start
+
+    return results
+
+
+def retrieve_federated(indices, query, k, timings=None, query_vector=None, retrieval_mode=RETRIEVAL_MMR):
+    """Search several indices in parallel threads and return the k best documents overall.
+
+    indices is a list of (name, faiss_index, lexical_index) triples; lexical_index is
+    used only in hybrid mode. The query is embedded once (all indices share the
+    embedding model). The per-index rankings are merged with reciprocal rank
+    fusion, chunks found in more than one index are kept once (under the first
+    index that returned them), and each document is a copy tagged with its
+    source index in metadata["indice"].
+    """
+    from langchain_community.docstore.document import Document
+
+    if timings is None:
+        timings = {}
+
+    if query_vector is None:
+        start = time.perf_counter()
+        query_vector = embed_query(indices[0][1], query)
+        timings["embed"] = time.perf_counter() - start
+
+    def search(name, faiss_index, lexical_index):
+        if retrieval_mode == RETRIEVAL_HYBRID and lexical_index is not None:
+            results = retrieve_hybrid(faiss_index, lexical_index, query, k, query_vector=query_vector)
+        else:
+            results = retrieve_with_scores(faiss_index, query, k, query_vector=query_vector)
+        return [(name, doc, score) for doc, score in results]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(indices)) as pool:
+        per_index = list(pool.map(lambda entry: search(*entry), indices))
+    timings["search"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # Fusione per rango (RRF): conserva l'ordine MMR di ogni indice e non confronta
+    # distanze di indici diversi (esatte e approssimate, o punteggi ibridi)
+    fused = {}
+    for results in per_index:
+        for rank, (name, doc, _) in enumerate(results, start=1):
+            key = (doc.metadata.get("title"), doc.metadata.get("page_number"), doc.page_content)
+            if key not in fused:
+                fused[key] = [0.0, name, doc]
+            fused[key][0] += 1.0 / (RRF_K + rank)
+    best = sorted(fused.values(), key=lambda entry: entry[0], reverse=True)[:k]
+    documents = [
+        Document(page_content=doc.page_content, metadata={**doc.metadata, "indice": name}) for _, name, doc in best
+    ]
+    timings["fusion"] = time.perf_counter() - start
+
+    return documents
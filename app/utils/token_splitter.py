@@ -0,0 +1,169 @@
+# token_splitter.py
+
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+DEFAULT_MODEL = "gpt-4o-mini"
+# Token per blocco proposti di default: il prompt di riassunto contiene anche i due blocchi vicini
+DEFAULT_CHUNK_TOKENS = 4000
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+# Conteggi e frasi dei testi recenti, per hash del testo: Streamlit riesegue la pagina a ogni interazione
+TEXT_CACHE_SIZE = 16
+_text_cache = OrderedDict()
+_text_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model=DEFAULT_MODEL):
+    """Return the tiktoken encoding of a model, falling back to the generic GPT encodings."""
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        for name in ("o200k_base", "cl100k_base"):
+            try:
+                return tiktoken.get_encoding(name)
+            except ValueError:
+                continue
+        raise
+
+
+def _cached(kind, text, model, max_tokens, compute):
+    """Return compute() for a text, reusing the result of the same text, model and budget."""
+    key = (kind, hashlib.sha256(text.encode("utf-8")).hexdigest(), model, max_tokens)
+    with _text_cache_lock:
+        if key in _text_cache:
+            _text_cache.move_to_end(key)
+            return _text_cache[key]
+    result = compute()
+    with _text_cache_lock:
+        _text_cache[key] = result
+        while len(_text_cache) > TEXT_CACHE_SIZE:
+            _text_cache.popitem(last=False)
+    return result
+
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    """Return the number of tokens of a text for the given model."""
+    return _cached("tokens", text, model, None, lambda: len(get_encoding(model).encode(text, disallowed_special=())))
+
+
+def _split_units(text, model, max_tokens=None):
+    """Split text into (paragraph index, sentence, tokens) units (cached by text hash).
+
+    Sentences longer than max_tokens are cut on token boundaries: it is the only
+    case in which a unit does not end on a sentence or paragraph boundary.
+    """
+    return _cached("units", text, model, max_tokens, lambda: tuple(_compute_units(text, model, max_tokens)))
+
+
+def _compute_units(text, model, max_tokens):
+    encoding = get_encoding(model)
+    units = []
+    for paragraph_index, paragraph in enumerate(_PARAGRAPH_BREAK.split(text)):
+        for sentence in _SENTENCE_END.split(paragraph.strip()):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            tokens = encoding.encode(sentence, disallowed_special=())
+            if max_tokens and len(tokens) > max_tokens:
+                for start in range(0, len(tokens), max_tokens):
+                    piece = tokens[start:start + max_tokens]
+                    units.append((paragraph_index, encoding.decode(piece).strip(), len(piece)))
+            else:
+                units.append((paragraph_index, sentence, len(tokens)))
+    return units
+
+
+def _join_units(units):
+    """Rebuild the text of a chunk: sentences joined by spaces, paragraphs by blank lines."""
+    parts = []
+    previous_paragraph = None
+    for paragraph_index, sentence, _ in units:
+        if previous_paragraph is not None:
+            parts.append(" " if paragraph_index == previous_paragraph else "\n\n")
+        parts.append(sentence)
+        previous_paragraph = paragraph_index
+    return "".join(parts)
+
+
+def _group_tokens(group):
+    """Tokens of a chunk: its units plus one separator between consecutive units."""
+    return sum(unit[2] for unit in group) + len(group) - 1
+
+
+def _pack_by_budget(units, max_tokens):
+    """Greedily fill each chunk up to max_tokens: the minimal number of contiguous chunks."""
+    groups = [[]]
+    used = 0
+    for unit in units:
+        cost = unit[2] + (1 if groups[-1] else 0)
+        if groups[-1] and used + cost > max_tokens:
+            groups.append([])
+            used = 0
+            cost = unit[2]
+        groups[-1].append(unit)
+        used += cost
+    return [group for group in groups if group]
+
+
+def _pack_into(units, num_chunks):
+    """Cut the units into num_chunks chunks of about the same number of tokens."""
+    num_chunks = max(1, min(num_chunks, len(units)))
+    total = sum(unit[2] for unit in units)
+    groups = [[] for _ in range(num_chunks)]
+    cumulative = 0
+    for position, unit in enumerate(units):
+        # Il blocco è scelto dal punto medio della frase, così ogni taglio cade sul confine più vicino
+        middle = cumulative + unit[2] / 2
+        chunk_index = min(int(middle * num_chunks / total), num_chunks - 1) if total else 0
+        # Le frasi rimaste devono bastare a riempire i blocchi successivi
+        chunk_index = max(chunk_index, num_chunks - (len(units) - position))
+        groups[chunk_index].append(unit)
+        cumulative += unit[2]
+    return [group for group in groups if group]
+
+
+def minimal_num_chunks(text, max_tokens, model=DEFAULT_MODEL):
+    """Return the minimal number of chunks whose size does not exceed max_tokens."""
+    units = _split_units(text, model, max_tokens)
+    return len(_pack_by_budget(units, max_tokens)) if units else 0
+
+
+def split_text_into_chunks(text, num_chunks=None, model=DEFAULT_MODEL, max_tokens=None):
+    """Split text into chunks on sentence and paragraph boundaries, counting tokens.
+
+    With num_chunks the text is divided into that many chunks of balanced token
+    length. With max_tokens only, it is divided into the minimal number of chunks
+    that fit the budget; with both, num_chunks is raised if needed to fit it.
+    """
+    units = _split_units(text, model, max_tokens)
+    if not units:
+        return []
+
+    if num_chunks is None:
+        groups = _pack_by_budget(units, max_tokens or sum(unit[2] for unit in units))
+    else:
+        if max_tokens:
+            num_chunks = max(num_chunks, len(_pack_by_budget(units, max_tokens)))
+        groups = _pack_into(units, num_chunks)
+        # Il bilanciamento può superare il budget in un blocco: si aggiunge un blocco finché non basta
+        while max_tokens and any(_group_tokens(group) > max_tokens for group in groups):
+            if num_chunks >= len(units):
+                groups = _pack_by_budget(units, max_tokens)
+                break
+            num_chunks += 1
+            groups = _pack_into(units, num_chunks)
+
+    chunks = [_join_units(group) for group in groups]
+    for i, (group, chunk) in enumerate(zip(groups, chunks)):
+        logging.info(f"Chunk {i+1} ({_group_tokens(group)} token): {chunk[:100]}...")
+    return chunks
@@ -0,0 +1,148 @@
+# tts.py
+
+import os
+import re
+import asyncio
+import hashlib
+import logging
+import threading
+
+DEFAULT_VOICE = "it-IT-IsabellaNeural"
+TTS_CACHE_DIR = "app/cache/tts"
+MAX_TTS_CACHE_BYTES = int(os.getenv("EDURAG_TTS_CACHE_MB", "200")) * 1024 * 1024
+
+# Job di sintesi in corso, condivisi tra le sessioni che chiedono lo stesso audio
+_jobs = {}
+_jobs_lock = threading.Lock()
+_evict_lock = threading.Lock()
+
+
+# Function to clean the text from markdown markers
+def clean_text(text):
+    # Remove bold markers **text**
+    clean_text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    # Remove italic markers *text* or _text_
+    clean_text = re.sub(r'\*(.*?)\*', r'\1', clean_text)
+    clean_text = re.sub(r'\_(.*?)\_', r'\1', clean_text)
+    # Remove other potential markdown markers if necessary
+    return clean_text
+
+
+def audio_cache_key(cleaned_text, voice):
+    """Return the cache key of an audio: hash of the cleaned text and the voice."""
+    return hashlib.sha256(f"{voice}\n{cleaned_text}".encode("utf-8")).hexdigest()
+
+
+class AudioJob:
+    """Background edge-tts synthesis written to the mp3 cache.
+
+    The page is rendered without waiting for the audio: it polls the job and plays
+    the complete file once it is done. Only a byte count is kept in memory while
+    the audio is produced, the data goes straight to disk.
+    """
+
+    def __init__(self, key, text, voice, status="running"):
+        self.key = key
+        self.text = text
+        self.voice = voice
+        self.status = status
+        self.error = None
+        self.path = os.path.join(TTS_CACHE_DIR, f"{key}.mp3")
+        self._bytes_ready = 0
+        self._condition = threading.Condition()
+
+    def run(self):
+        part_path = self.path + ".part"
+        status = "error"
+        try:
+            os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+            asyncio.run(self._synthesize(part_path))
+            os.replace(part_path, self.path)
+            status = "done"
+        except Exception as e:
+            logging.error(f"Errore durante la generazione dell'audio: {e}")
+            self.error = e
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        finally:
+            with self._condition:
+                self.status = status
+                self._condition.notify_all()
+            with _jobs_lock:
+                _jobs.pop(self.key, None)
+            _evict_cache()
+
+    async def _synthesize(self, part_path):
+        import edge_tts
+
+        communicate = edge_tts.Communicate(self.text, self.voice)
+        with open(part_path, "wb") as part_file:
+            async for message in communicate.stream():
+                if message["type"] != "audio":
+                    continue
+                part_file.write(message["data"])
+                with self._condition:
+                    self._bytes_ready += len(message["data"])
+
+    def bytes_ready(self):
+        """Return how many bytes of audio have been produced so far."""
+        with self._condition:
+            return self._bytes_ready
+
+    def audio_bytes(self):
+        """Return the complete mp3 once the job is done."""
+        with open(self.path, "rb") as audio_file:
+            return audio_file.read()
+
+
+def start_audio_job(text, voice=DEFAULT_VOICE):
+    """Start (or reuse) the background synthesis of a text and return its job."""
+    cleaned = clean_text(text)
+    key = audio_cache_key(cleaned, voice)
+
+    with _jobs_lock:
+        job = _jobs.get(key) or _cached_job(key, cleaned, voice)
+        if job is not None:
+            return job
+        job = AudioJob(key, cleaned, voice)
+        _jobs[key] = job
+
+    threading.Thread(target=job.run, name=f"tts-{key[:8]}", daemon=True).start()
+    return job
+
+
+def _cached_job(key, text, voice):
+    job = AudioJob(key, text, voice, status="done")
+    try:
+        os.utime(job.path)  # Aggiorna l'ultimo accesso per l'evizione
+    except FileNotFoundError:
+        return None
+    return job
+
+
+def _evict_cache():
+    """Remove the least recently used mp3 files beyond the cache size limit."""
+    # I job in background terminano insieme: una sola evizione alla volta in questo processo
+    with _evict_lock:
+        try:
+            names = [name for name in os.listdir(TTS_CACHE_DIR) if name.endswith(".mp3")]
+        except FileNotFoundError:
+            return
+        files = []
+        for name in names:
+            path = os.path.join(TTS_CACHE_DIR, name)
+            try:
+                file_stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # Già rimosso da un altro processo
+            files.append((file_stat.st_mtime, file_stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= MAX_TTS_CACHE_BYTES:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,96 @@
+# test_ann_index.py
+
+import os
+import sys
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from langchain_community.docstore.in_memory import InMemoryDocstore  # noqa: E402
+from langchain_community.docstore.document import Document  # noqa: E402
+from langchain_community.vectorstores import FAISS  # noqa: E402
+from utils.ann_index import (  # noqa: E402
+    build_index, reconstruct_all, convert_index, index_type_of,
+    INDEX_FLAT, INDEX_HNSW, INDEX_IVF, INDEX_IVFPQ, IVFPQ_MIN_TRAINING_VECTORS,
+)
+from utils.faiss_store import delete_documents  # noqa: E402
+
+DIMENSION = 16
+# IVF-PQ ha bisogno di abbastanza vettori per addestrare il quantizzatore (altrimenti diventa IVF)
+NUM_VECTORS = {INDEX_FLAT: 2000, INDEX_HNSW: 2000, INDEX_IVF: 2000, INDEX_IVFPQ: IVFPQ_MIN_TRAINING_VECTORS + 2000}
+
+
+def make_store(index_type):
+    num_vectors = NUM_VECTORS[index_type]
+    vectors = np.random.default_rng(0).normal(size=(num_vectors, DIMENSION)).astype(np.float32)
+    index, used_type, _ = build_index(vectors, index_type)
+    assert used_type == index_type
+    ids = [f"id{i}" for i in range(num_vectors)]
+    docstore = InMemoryDocstore({docstore_id: Document(page_content=docstore_id) for docstore_id in ids})
+    store = FAISS(lambda text: vectors[0].tolist(), index, docstore, dict(enumerate(ids)))
+    return store, dict(zip(ids, vectors))
+
+
+def recall(store, vectors_by_id, queries, k=10):
+    """Recall@k of the store against exact search over the chunks it still contains."""
+    ids = list(store.index_to_docstore_id.values())
+    exact = faiss.IndexFlatL2(DIMENSION)
+    exact.add(np.vstack([vectors_by_id[docstore_id] for docstore_id in ids]))
+    _, truth = exact.search(queries, k)
+    _, found = store.index.search(queries, k)
+    hits = [
+        len({ids[label] for label in truth[i]} & {store.index_to_docstore_id[int(label)] for label in found[i] if label != -1})
+        for i in range(len(queries))
+    ]
+    return sum(hits) / (k * len(queries))
+
+
+@pytest.mark.parametrize("index_type", [INDEX_FLAT, INDEX_HNSW, INDEX_IVF, INDEX_IVFPQ])
+def test_delete_then_search_and_append(index_type):
+    store, vectors_by_id = make_store(index_type)
+    num_vectors = len(vectors_by_id)
+    deleted = [f"id{i}" for i in range(0, num_vectors, 3)]
+    delete_documents(store, deleted)
+
+    assert index_type_of(store.index) == index_type
+    assert store.index.ntotal == len(store.index_to_docstore_id) == num_vectors - len(deleted)
+    assert sorted(store.index_to_docstore_id) == list(range(store.index.ntotal))
+
+    # Ogni etichetta restituita dalla ricerca punta al chunk del proprio vettore
+    _, labels = store.index.search(vectors_by_id["id1"][None, :], 10)
+    assert "id1" in {store.index_to_docstore_id[int(label)] for label in labels[0] if label != -1}
+    queries = np.vstack([vectors_by_id[f"id{i}"] for i in range(50)])
+    found = {store.index_to_docstore_id[int(label)] for label in store.index.search(queries, 5)[1].ravel() if label != -1}
+    assert not found & set(deleted)
+
+    store.add_embeddings([("nuovo", vectors_by_id["id0"].tolist())], ids=["nuovo"])
+    _, labels = store.index.search(vectors_by_id["id0"][None, :], 10)
+    assert "nuovo" in {store.index_to_docstore_id[int(label)] for label in labels[0] if label != -1}
+
+    assert reconstruct_all(store.index).shape == (store.index.ntotal, DIMENSION)
+    convert_index(store, INDEX_IVF)
+    assert store.index.ntotal == len(store.index_to_docstore_id)
+
+
+@pytest.mark.parametrize("index_type", [INDEX_FLAT, INDEX_HNSW, INDEX_IVF, INDEX_IVFPQ])
+def test_recall_does_not_degrade_after_deletes(index_type):
+    store, vectors_by_id = make_store(index_type)
+    rng = np.random.default_rng(1)
+    queries = (np.vstack(list(vectors_by_id.values()))[rng.choice(len(vectors_by_id), 100, replace=False)]
+               + rng.normal(scale=0.1, size=(100, DIMENSION))).astype(np.float32)
+    recall_before = recall(store, vectors_by_id, queries)
+
+    # Più cicli di eliminazione: IVF-PQ non deve essere riquantizzato a ogni ciclo
+    for cycle in range(3):
+        ids = list(store.index_to_docstore_id.values())
+        delete_documents(store, ids[cycle::10])
+
+    recall_after = recall(store, vectors_by_id, queries)
+    if index_type == INDEX_FLAT:
+        assert recall_before == recall_after == 1.0
+    else:
+        assert recall_after >= recall_before - 0.05
@@ -0,0 +1,64 @@
+# test_answer_cache.py
+
+import os
+import sys
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils import answer_cache  # noqa: E402
+from utils.answer_cache import lookup_answer, store_answer  # noqa: E402
+
+SETTINGS = {"model_name": "gpt-4o-mini", "temperature": 0.0, "similarity_k": 4}
+
+
+@pytest.fixture
+def index_folder(tmp_path):
+    answer_cache._indices.clear()
+    for name in ("index.faiss", "chunks.sqlite"):
+        (tmp_path / name).write_bytes(b"x")
+    return str(tmp_path)
+
+
+def store(folder, vector, credential="chiave-a"):
+    store_answer(folder, "domanda", vector, response="risposta", documents=["doc"], credential=credential, **SETTINGS)
+
+
+def lookup(folder, vector, threshold=0.95, credential="chiave-a", **settings):
+    return lookup_answer(folder, vector, threshold=threshold, credential=credential, **dict(SETTINGS, **settings))
+
+
+def test_similar_question_reuses_the_answer(index_folder):
+    store(index_folder, [1.0, 0.0])
+    answer, documents, similarity = lookup(index_folder, [2.0, 0.1])
+    assert answer == "risposta" and documents == ["doc"]
+    assert similarity > 0.99
+
+
+def test_threshold(index_folder):
+    store(index_folder, [1.0, 0.0])
+    # Coseno 0.8: sotto la soglia predefinita, sopra una soglia più bassa
+    assert lookup(index_folder, [0.8, 0.6]) is None
+    assert lookup(index_folder, [0.8, 0.6], threshold=0.75) is not None
+
+
+def test_other_settings_do_not_match(index_folder):
+    store(index_folder, [1.0, 0.0])
+    assert lookup(index_folder, [1.0, 0.0], model_name="altro-modello") is None
+    assert lookup(index_folder, [1.0, 0.0], similarity_k=8) is None
+
+
+def test_answers_are_scoped_by_credential(index_folder):
+    store(index_folder, [1.0, 0.0], credential="chiave-a")
+    assert lookup(index_folder, [1.0, 0.0], credential="chiave-b") is None
+    assert lookup(index_folder, [1.0, 0.0], credential=None) is None
+    assert lookup(index_folder, [1.0, 0.0], credential="chiave-a") is not None
+
+
+def test_index_change_invalidates_the_answers(index_folder):
+    store(index_folder, [1.0, 0.0])
+    with open(os.path.join(index_folder, "index.faiss"), "ab") as index_file:
+        index_file.write(b"nuovi vettori")
+    assert lookup(index_folder, [1.0, 0.0]) is None
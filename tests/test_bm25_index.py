@@ -0,0 +1,91 @@
+# test_bm25_index.py
+
+import os
+import sys
+import types
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.bm25_index import BM25Index, tokenize  # noqa: E402
+
+CHUNKS = {
+    "a": "La fotosintesi clorofilliana avviene nelle foglie.",
+    "b": "Il ciclo di Krebs produce energia nei mitocondri.",
+    "c": "La fotosintesi usa la luce; la fotosintesi produce ossigeno.",
+}
+
+
+def make_index():
+    index = BM25Index()
+    index.add_documents(CHUNKS.items())
+    return index
+
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("La fotosintesi e il DNA") == ["fotosintesi", "dna"]
+
+
+def test_search_ranks_by_term_frequency():
+    ids = [docstore_id for docstore_id, _ in make_index().search("fotosintesi", 10)]
+    assert ids == ["c", "a"]
+
+
+def test_remove_and_re_add():
+    index = make_index()
+    index.remove(["c"])
+    assert len(index) == 2
+    assert [docstore_id for docstore_id, _ in index.search("fotosintesi", 10)] == ["a"]
+    assert "c" not in {docstore_id for documents in index.postings.values() for docstore_id in documents}
+    assert index.total_length == sum(index.doc_lengths.values())
+
+    # Riaggiungere un id esistente ne sostituisce il testo
+    index.add_documents([("a", "Krebs")])
+    assert index.search("fotosintesi", 10) == []
+    assert index.total_length == sum(index.doc_lengths.values())
+
+
+def test_save_and_load(tmp_path):
+    index = make_index()
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    assert loaded.search("krebs mitocondri", 3) == index.search("krebs mitocondri", 3)
+
+
+class FakeVectorIndex:
+    def __init__(self, ranking):
+        self.ranking = ranking
+
+    def search(self, query, k):
+        import numpy as np
+
+        return None, np.array([self.ranking[:k] + [-1] * (k - len(self.ranking[:k]))])
+
+
+class FakeDocstore:
+    def search(self, docstore_id):
+        if docstore_id not in CHUNKS:
+            return f"ID {docstore_id} not found."
+        return types.SimpleNamespace(page_content=CHUNKS[docstore_id], docstore_id=docstore_id)
+
+
+class FakeFaissIndex:
+    def __init__(self, ranking):
+        self.index = FakeVectorIndex(ranking)
+        self.index_to_docstore_id = dict(enumerate(CHUNKS))
+        self.docstore = FakeDocstore()
+
+
+def test_hybrid_rrf_ordering():
+    pytest.importorskip("numpy")
+    from utils.retrieval import retrieve_hybrid
+
+    lexical_index = make_index()
+    lexical_index.add_documents([("solo-bm25", "fotosintesi fotosintesi fotosintesi")])
+    # FAISS: a, b, c. BM25: solo-bm25, c, a. RRF: a (1/61 + 1/63) > c (1/63 + 1/62) > b (1/62)
+    faiss_index = FakeFaissIndex([0, 1, 2])
+    results = retrieve_hybrid(faiss_index, lexical_index, "fotosintesi", k=3, query_vector=[0.0])
+    # L'id presente solo in BM25 (assente dal docstore) viene saltato e sostituito dal successivo
+    assert [doc.docstore_id for doc, _ in results] == ["a", "c", "b"]
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
@@ -0,0 +1,62 @@
+# test_chunk_store.py
+
+import os
+import sys
+import pytest
+
+pytest.importorskip("langchain_community")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from langchain_community.docstore.in_memory import InMemoryDocstore  # noqa: E402
+from langchain_community.docstore.document import Document  # noqa: E402
+from utils.chunk_store import (  # noqa: E402
+    READ_BATCH_SIZE, SQLiteDocstore, StaleChunkStoreError, open_chunk_store, read_chunk_store_stamp, write_chunk_store,
+)
+
+NUM_CHUNKS = 2 * READ_BATCH_SIZE + 50
+
+
+@pytest.fixture
+def folder(tmp_path):
+    ids = [f"id{i}" for i in range(NUM_CHUNKS)]
+    docstore = InMemoryDocstore({
+        docstore_id: Document(page_content=f"testo {docstore_id}", metadata={"title": f"doc{i % 3}", "page_number": i})
+        for i, docstore_id in enumerate(ids)
+    })
+    stamp = {"generation": "gen-1", "faiss_size": 123, "faiss_mtime_ns": 456}
+    write_chunk_store(str(tmp_path / "chunks.sqlite"), docstore, dict(enumerate(ids)), stamp)
+    return tmp_path
+
+
+def test_stamp_is_written(folder):
+    stamp = read_chunk_store_stamp(str(folder / "chunks.sqlite"))
+    assert stamp == {"generation": "gen-1", "faiss_size": "123", "faiss_mtime_ns": "456"}
+
+
+def test_generation_mismatch_is_detected(folder):
+    assert SQLiteDocstore(str(folder / "chunks.sqlite"), generation="gen-1").search("id0").page_content == "testo id0"
+    stale = SQLiteDocstore(str(folder / "chunks.sqlite"), generation="gen-0")
+    with pytest.raises(StaleChunkStoreError):
+        stale.search("id0")
+
+
+def test_mget_reads_more_ids_than_a_batch(folder):
+    docstore, id_map = open_chunk_store(str(folder), lazy=True)
+    assert len(id_map) == NUM_CHUNKS
+    ids = [f"id{i}" for i in reversed(range(NUM_CHUNKS))] + ["assente"]
+    documents = docstore.mget(ids)
+    assert documents[-1] is None
+    assert [document.page_content for document in documents[:-1]] == [f"testo {docstore_id}" for docstore_id in ids[:-1]]
+
+
+def test_pending_changes_and_title_lookup(folder):
+    docstore, id_map = open_chunk_store(str(folder), lazy=False)
+    assert id_map[5] == "id5"
+    docstore.delete(["id0"])
+    docstore.add({"nuovo": Document(page_content="nuovo", metadata={"title": "doc0"})})
+    assert isinstance(docstore.search("id0"), str)
+    ids = docstore.ids_by_title(["doc0"])
+    assert "id0" not in ids and "id3" in ids and "nuovo" in ids
+    with pytest.raises(ValueError):
+        docstore.add({"id3": Document(page_content="duplicato")})
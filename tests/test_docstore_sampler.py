@@ -0,0 +1,37 @@
+# test_docstore_sampler.py
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.docstore_sampler import sample_chunk_ids, STRATIFY_NONE, STRATIFY_DOCUMENT, STRATIFY_PAGE  # noqa: E402
+
+
+class MetadataDocstore:
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def iter_metadata(self):
+        return iter(self.metadata.items())
+
+
+class FakeIndex:
+    def __init__(self, num_chunks):
+        metadata = {f"id{i}": {"title": f"doc{i % 2}", "page_number": i // 4} for i in range(num_chunks)}
+        self.index_to_docstore_id = dict(enumerate(metadata))
+        self.docstore = MetadataDocstore(metadata)
+
+
+@pytest.mark.parametrize("stratify", [STRATIFY_NONE, STRATIFY_DOCUMENT, STRATIFY_PAGE])
+def test_empty_index_returns_no_ids(stratify):
+    assert sample_chunk_ids(FakeIndex(0), n=3, stratify=stratify) == []
+
+
+@pytest.mark.parametrize("stratify", [STRATIFY_NONE, STRATIFY_DOCUMENT, STRATIFY_PAGE])
+def test_draws_distinct_ids_then_starts_again(stratify):
+    index = FakeIndex(10)
+    drawn = sample_chunk_ids(index, n=10, stratify=stratify)
+    assert sorted(drawn) == sorted(index.index_to_docstore_id.values())
+    assert len(sample_chunk_ids(index, n=3, stratify=stratify, exclude=drawn)) == 3
@@ -0,0 +1,84 @@
+# test_ingestion.py
+
+import io
+import os
+import sys
+import pytest
+
+pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from amm.ingestion import ingest_files, split_indexed_entries  # noqa: E402
+
+
+class Upload(io.BytesIO):
+    """Minimal stand-in for a Streamlit UploadedFile."""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+class TitleDocstore:
+    def __init__(self, titles):
+        self.titles = titles
+
+    def ids_by_title(self, titles):
+        return [f"id-{title}" for title in titles if title in self.titles]
+
+
+class FakeIndex:
+    def __init__(self, titles):
+        self.docstore = TitleDocstore(titles)
+        self.added = 0
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None):
+        self.added += len(list(text_embeddings))
+
+
+def entry(name, title):
+    return {"file": Upload(name, b"Testo di prova abbastanza lungo da diventare un chunk.\n" * 5),
+            "metadata": {"title": title, "author": "Autore"}}
+
+
+def test_split_indexed_entries():
+    entries = [entry("a.txt", "A"), entry("b.txt", "B")]
+    new_entries, duplicated = split_indexed_entries(entries, FakeIndex({"A"}))
+    assert [e["metadata"]["title"] for e in new_entries] == ["B"]
+    assert [e["metadata"]["title"] for e in duplicated] == ["A"]
+
+
+def test_append_of_indexed_title_adds_no_chunks():
+    index = FakeIndex({"A"})
+    result, first_chunks, progress = ingest_files([entry("a.txt", "A")], embeddings=None, index=index)
+    assert result is index
+    assert index.added == 0
+    assert progress.chunks == 0
+    assert first_chunks == []
+
+
+class HashEmbeddings:
+    model_name = "test-hash"
+
+    def embed_documents(self, texts):
+        return [[float((hash(text) >> shift) & 0xFF) for shift in range(0, 64, 8)] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_append_of_indexed_title_keeps_faiss_size(tmp_path, monkeypatch):
+    pytest.importorskip("faiss")
+    pytest.importorskip("langchain_text_splitters")
+    import utils.embedding_cache as embedding_cache
+
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings.sqlite"))
+    embeddings = HashEmbeddings()
+    index, _, progress = ingest_files([entry("a.txt", "A")], embeddings, max_workers=1)
+    size = index.index.ntotal
+    assert size == progress.chunks > 0
+
+    index, _, progress = ingest_files([entry("a.txt", "A")], embeddings, max_workers=1, index=index)
+    assert index.index.ntotal == size
+    assert progress.chunks == 0
@@ -0,0 +1,66 @@
+# test_query_coalescing.py
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.query_coalescing import query_key, start_query_job  # noqa: E402
+
+
+def blocking_run(release, calls):
+    def run(job):
+        calls.append(job.key)
+        job.set_documents(["doc"])
+        release.wait(5)
+        job.add_chunk("risposta")
+    return run
+
+
+def test_identical_request_joins_the_running_job(tmp_path):
+    release = threading.Event()
+    calls = []
+    key = query_key(str(tmp_path), "Cos'è  la fotosintesi?", "gpt-4o-mini", 0.0, 4, credential="abc")
+    job, coalesced = start_query_job(key, blocking_run(release, calls))
+    assert not coalesced
+
+    # Spazi diversi, stessa domanda: stessa chiave
+    same_key = query_key(str(tmp_path), "Cos'è la fotosintesi?", "gpt-4o-mini", 0.0, 4, credential="abc")
+    joined, coalesced = start_query_job(same_key, blocking_run(release, calls))
+    assert coalesced and joined is job
+    assert job.subscribers == 2
+
+    release.set()
+    assert "".join(joined.iter_chunks()) == "risposta"
+    assert joined.wait_documents() == ["doc"]
+    assert calls == [key]
+
+
+def test_different_credentials_do_not_share_a_job(tmp_path):
+    release = threading.Event()
+    calls = []
+    first, _ = start_query_job(query_key(str(tmp_path), "domanda", "m", 0.0, 4, credential="a"), blocking_run(release, calls))
+    second, coalesced = start_query_job(query_key(str(tmp_path), "domanda", "m", 0.0, 4, credential="b"), blocking_run(release, calls))
+    assert not coalesced and second is not first
+    release.set()
+    list(first.iter_chunks())
+    list(second.iter_chunks())
+    assert len(calls) == 2
+
+
+def test_finished_job_is_not_reused(tmp_path):
+    release = threading.Event()
+    release.set()
+    calls = []
+    key = query_key(str(tmp_path), "domanda finita", "m", 0.0, 4)
+    job, _ = start_query_job(key, blocking_run(release, calls))
+    list(job.iter_chunks())
+    job.wait_documents()
+    # Il job terminato si toglie dalla tabella dopo aver notificato i lettori
+    for _ in range(100):
+        again, coalesced = start_query_job(key, blocking_run(release, calls))
+        list(again.iter_chunks())
+        if not coalesced:
+            break
+    assert not coalesced and again is not job
@@ -0,0 +1,52 @@
+# test_token_splitter.py
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.token_splitter import _pack_by_budget, _group_tokens  # noqa: E402
+
+
+def units(token_counts, sentences_per_paragraph=3):
+    return [(i // sentences_per_paragraph, f"frase {i}", tokens) for i, tokens in enumerate(token_counts)]
+
+
+def test_pack_by_budget_respects_the_limit():
+    groups = _pack_by_budget(units([30, 40, 25, 10, 50, 5, 45, 20]), 100)
+    assert all(_group_tokens(group) <= 100 for group in groups)
+    # Contigui e completi: nessuna frase persa o riordinata
+    assert [unit for group in groups for unit in group] == units([30, 40, 25, 10, 50, 5, 45, 20])
+
+
+def test_pack_by_budget_counts_separators():
+    # 50 + 50 token più il separatore superano 100: servono due blocchi
+    assert len(_pack_by_budget(units([50, 50]), 100)) == 2
+    assert len(_pack_by_budget(units([50, 49]), 100)) == 1
+
+
+def test_pack_by_budget_is_minimal():
+    # Riempimento greedy: ogni blocco tranne l'ultimo non può accogliere la frase successiva
+    token_counts = [30, 40, 25, 10, 50, 5, 45, 20]
+    groups = _pack_by_budget(units(token_counts), 100)
+    for group, next_group in zip(groups, groups[1:]):
+        assert _group_tokens(group + next_group[:1]) > 100
+
+
+def test_minimal_num_chunks_matches_split():
+    pytest.importorskip("tiktoken")
+    from utils.token_splitter import minimal_num_chunks, split_text_into_chunks, count_tokens
+
+    text = "\n\n".join(
+        " ".join(f"Questa è la frase {i}.{j} del paragrafo di prova." for j in range(8)) for i in range(40)
+    )
+    max_tokens = 200
+    chunks = split_text_into_chunks(text, max_tokens=max_tokens)
+    assert len(chunks) == minimal_num_chunks(text, max_tokens)
+    assert all(count_tokens(chunk) <= max_tokens for chunk in chunks)
+
+    # Con un numero di blocchi troppo basso per il budget, il numero viene aumentato
+    balanced = split_text_into_chunks(text, num_chunks=2, max_tokens=max_tokens)
+    assert len(balanced) >= len(chunks)
+    assert all(count_tokens(chunk) <= max_tokens for chunk in balanced)